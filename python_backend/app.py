@@ -6,11 +6,11 @@ Fixed version with file upload, content extraction, and Ollama AI integration
 import os
 import sqlite3
 import json
-import bcrypt
-import secrets
+import hashlib
+import tempfile
 import datetime
 from datetime import timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 import requests
 from werkzeug.utils import secure_filename
@@ -22,12 +22,31 @@ import unicodedata
 import fitz  # PyMuPDF
 import docx
 from docx import Document
+from services.search_index import init_search_index, search as search_index
+from services.retrieval import init_retrieval_index, index_material, retrieve_chunks, format_chunks
+from services.prompt_budget import PromptBudget, prompt_stats, estimate_tokens, SECTION_BUDGETS
+from services.summarizer import init_summary_table, material_summarizer, format_summaries, ADHOC_MATERIAL_ID
+from ollama_service import ollama_service
+from services.circuit_breaker import CircuitOpenError
+from services.json_output import review_schema, coerce_to_schema
+from services.generation_profiles import generation_stats
+from services.lesson_triage import init_triage_table, triage_lesson, rejection_verdict, REJECT
+from services.qaqf_scoring import score_lessons
+from services.near_duplicates import (init_near_duplicate_index, index_item, duplicate_clusters,
+                                      find_verified_duplicate, DUPLICATE_THRESHOLD)
+from services.rate_limiter import rate_limiter
+from services.password_hashing import password_hasher, PasswordHasherBusy
+from services.signed_tokens import (create_token, verify_token, init_revoked_tokens_table, RevocationList,
+                                    InvalidTokenError)
 app = Flask(__name__)
-CORS(app)
+# Let browser clients read the rate-limit headers
+CORS(app, expose_headers=['X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset',
+                          'X-RateLimit-Policy', 'Retry-After'])
 
 DATABASE = 'complete_qaqf_platform.db'
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'md'}
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -35,10 +54,68 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_upload_content_addressed(file):
+    """Stream an upload into UPLOAD_FOLDER under its SHA-256 hash.
+
+    Identical files are stored once, and different files that share a name
+    no longer overwrite each other. Returns (file_path, file_hash).
+    """
+    ext = secure_filename(file.filename).rsplit('.', 1)[1].lower()
+    hasher = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    file_hash = hasher.hexdigest()
+    file_path = os.path.join(UPLOAD_FOLDER, f"{file_hash}.{ext}")
+    if os.path.exists(file_path):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, file_path)
+    return file_path, file_hash
+
+# Routes that call the model get the small AI budget; every other /api route gets the CRUD one
+AI_RATE_LIMITED_ROUTES = {
+    '/api/ai/generate-content', '/api/ai/assessment-content', '/api/ai/assess-content',
+    '/api/ai/test', '/api/ai/warmup', '/api/autoverification_lessons', '/api/automoderation_lessons'
+}
+RATE_LIMIT_EXEMPT_ROUTES = {'/api/health'}
+
+def apply_rate_limit():
+    """Charge the request to the caller's token bucket, answering 429 once it is empty"""
+    if request.method == 'OPTIONS' or not request.path.startswith('/api/') or request.path in RATE_LIMIT_EXEMPT_ROUTES:
+        return None
+    policy = 'ai' if request.path in AI_RATE_LIMITED_ROUTES else 'crud'
+    claims = request_token_claims()
+    caller = f"user:{claims['uid']}" if claims else f"ip:{request.remote_addr}"
+
+    g.rate_limit = rate_limiter.hit(policy, caller)
+    if not g.rate_limit.allowed:
+        return jsonify({
+            'error': 'Too many requests, please slow down',
+            'retry_after': int(g.rate_limit.headers()['Retry-After'])
+        }), 429
+    return None
+
+app.before_request(apply_rate_limit)
+
+# Started by the first request each process serves, so it runs under the dev server,
+# its reloader child and every WSGI worker alike, and never in a process that doesn't serve
+app.before_request(ollama_service.ensure_keep_alive)
+
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    decision = g.get('rate_limit')
+    if decision is not None:
+        response.headers.extend(decision.headers())
     return response
 
 app.after_request(after_request)
@@ -53,6 +130,9 @@ def get_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+# Revoked token ids, so signed tokens can be withdrawn before they expire
+revocation_list = RevocationList(get_db)
+
 def init_complete_db():
     """Initialize all database tables"""
     conn = get_db()
@@ -151,11 +231,17 @@ def init_complete_db():
             content TEXT,
             file_url VARCHAR(255),
             file_name VARCHAR(255),
+            file_hash VARCHAR(64),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (created_by_user_id) REFERENCES users (id)
         )
     ''')
+    # file_hash was added later; CREATE TABLE IF NOT EXISTS won't add it to existing databases
+    study_material_columns = [row['name'] for row in conn.execute('PRAGMA table_info(study_materials)')]
+    if 'file_hash' not in study_material_columns:
+        conn.execute('ALTER TABLE study_materials ADD COLUMN file_hash VARCHAR(64)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_study_materials_file_hash ON study_materials (file_hash)')
     # Collections table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS collections (
@@ -202,8 +288,8 @@ def init_complete_db():
     ''')
     
     # Insert default admin and user
-    admin_password = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt())
-    user_password = bcrypt.hashpw('user123'.encode('utf-8'), bcrypt.gensalt())
+    admin_password = password_hasher.hash('admin123')
+    user_password = password_hasher.hash('user123')
     
     try:
         conn.execute('''
@@ -366,44 +452,65 @@ def init_complete_db():
             UPDATE weeklessons SET updateddate = CURRENT_TIMESTAMP WHERE id = OLD.id;
         END;
     ''')
+
+    # Full-text search indexes over study_materials and generatedlesson
+    init_search_index(conn)
+    # Overlapping chunks of study material text for retrieval during AI generation
+    init_retrieval_index(conn)
+    # Cached map-reduce summaries of long materials
+    init_summary_table(conn)
+    # Pre-screening results for lesson verification
+    init_triage_table(conn)
+    # MinHash signatures for near-duplicate lessons and materials
+    init_near_duplicate_index(conn)
+    # Ids of signed tokens withdrawn before their expiry (logout), and per-user cutoffs (role changes)
+    init_revoked_tokens_table(conn)
     conn.commit()
     conn.close()
 
-def create_simple_token(user_id, username):
-    """Create simple authentication token"""
-    payload = f"{user_id}:{username}:{secrets.token_hex(16)}"
-    return payload
+def create_access_token(user_id, username, role):
+    """Create a signed authentication token carrying the user's id, name and role"""
+    return create_token(user_id, username, role)
 
-def verify_simple_token(token):
-    """Verify authentication token"""
-    try:
-        parts = token.split(':')
-        if len(parts) == 3:
-            user_id, username = parts[0], parts[1]
-            return int(user_id)
-    except:
-        pass
-    return None
+def request_token_claims():
+    """Claims of the request's bearer token, or None if it has no valid one; verified once per request"""
+    if 'token_claims' not in g:
+        token = request.headers.get('Authorization', '')
+        if token.startswith('Bearer '):
+            token = token[7:]
+        try:
+            g.token_claims = verify_token(token, revocation_list.is_revoked) if token else None
+        except InvalidTokenError:
+            g.token_claims = None
+    return g.token_claims
 
 def token_required(f):
-    """Authentication decorator"""
+    """Authentication decorator; the signed token is trusted, so no users query is made"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if token and token.startswith('Bearer '):
-            token = token[7:]
-        
-        if not token:
+        if not request.headers.get('Authorization'):
             return jsonify({'message': 'Token is missing!'}), 401
         
-        current_user_id = verify_simple_token(token)
-        if not current_user_id:
+        claims = request_token_claims()
+        if not claims:
             return jsonify({'message': 'Token is invalid!'}), 401
         
-        return f(current_user_id, *args, **kwargs)
+        return f(claims['uid'], *args, **kwargs)
     
     return decorated
 
+def role_required(*roles):
+    """Authorisation decorator for use under token_required: the token's role must be one of roles"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            claims = request_token_claims()
+            if not claims or claims.get('role') not in roles:
+                return jsonify({'message': 'You do not have permission to do this'}), 403
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
 def log_activity(user_id, action, entity_type, entity_id, details=None):
     """Log user activity"""
     conn = get_db()
@@ -469,14 +576,24 @@ def login():
     if not username or not password:
         return jsonify({'error': 'Username and password required'}), 400
     
-    conn = get_db()
-    user = conn.execute(
-        'SELECT * FROM users WHERE username = ?', (username,)
-    ).fetchone()
-    conn.close()
+    with password_hasher.login_timer():
+        conn = get_db()
+        try:
+            user = conn.execute(
+                'SELECT * FROM users WHERE username = ?', (username,)
+            ).fetchone()
+            valid, new_hash = password_hasher.verify(password, user['password_hash']) if user else (False, None)
+            if new_hash:
+                # Stored at an older BCRYPT_ROUNDS; upgrade while the password is known
+                conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, user['id']))
+                conn.commit()
+        except PasswordHasherBusy:
+            return jsonify({'error': 'Too many sign-ins in progress, please retry'}), 503, {'Retry-After': '1'}
+        finally:
+            conn.close()
     
-    if user and bcrypt.checkpw(password.encode('utf-8'), user['password_hash']):
-        token = create_simple_token(user['id'], user['username'])
+    if valid:
+        token = create_access_token(user['id'], user['username'], user['role'])
         return jsonify({
             'access_token': token,
             'token_type': 'bearer',
@@ -501,20 +618,24 @@ def register():
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    password_hash = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt())
+    try:
+        password_hash = password_hasher.hash(data['password'])
+    except PasswordHasherBusy:
+        return jsonify({'error': 'Too many sign-ups in progress, please retry'}), 503, {'Retry-After': '1'}
     
     conn = get_db()
     try:
         cursor = conn.execute('''
             INSERT INTO users (username, email, password_hash, name, role)
             VALUES (?, ?, ?, ?, ?)
-        ''', (data['username'], data['email'], password_hash, data['name'], data.get('role', 'user')))
+        ''', (data['username'], data['email'], password_hash, data['name'], 'user'))
         
         user_id = cursor.lastrowid
         conn.commit()
         conn.close()
         
-        token = create_simple_token(user_id, data['username'])
+        # Self-registration always makes a plain user; admins are promoted through /api/users/<id>/role
+        token = create_access_token(user_id, data['username'], 'user')
         return jsonify({
             'access_token': token,
             'token_type': 'bearer',
@@ -677,6 +798,7 @@ def create_lesson():
     ''', (data['courseid'], data['title'], data.get('level', ''),data.get('description', ''), data['userid'], data.get('duration', 0), data.get('type', 'lecture')))
     print(cur.lastrowid)
     print(data)
+    index_item(db, 'lesson', cur.lastrowid, data.get('description', ''))
     db.commit()
     return jsonify({'success': True, 'id': cur.lastrowid})
 
@@ -688,6 +810,7 @@ def update_lesson(id):
         UPDATE generatedlesson SET courseid = ?, title = ?,level = ?, description = ?, userid = ?, duration = ?, type = ?
         WHERE id = ?
     ''', (data['courseid'], data['title'],data['level'], data.get('description', ''), data['userid'], data.get('duration', 0), data.get('type', 'lecture'), id))
+    index_item(db, 'lesson', id, data.get('description', ''))
     db.commit()
     return jsonify({'success': True})
 
@@ -853,18 +976,25 @@ def generate_content_with_ollama(current_user_id):
     selected_course_id = data.get('selected_course_id')
     source_content = data.get('source_content', '')
     db = get_db()
-    cur = db.cursor()
+    source_chunks = []
+    source_summaries = []
     if selected_pdfs:
-        for pdf in selected_pdfs:
-            print(pdf)
-            booksid = pdf.get('id')
-            cur.execute(''' SELECT * FROM study_materials WHERE id = ?
-            ''', (booksid,))
-            pdf = cur.fetchone()
-            if pdf:
-                source_content = source_content +"\n" + pdf['content']
+        # Only the passages relevant to what is being generated go into the prompt, not whole documents
+        retrieval_query = " ".join(str(data.get(key) or '') for key in (
+            'title', 'subject_area', 'learning_objectives', 'additional_instructions'))
+        material_ids = [pdf.get('id') for pdf in selected_pdfs if pdf.get('id')]
+        # Summaries give the overview, retrieved chunks the detail. Existing summaries are always
+        # reused; computing missing ones (many LLM calls per textbook) is opt-in.
+        source_summaries = material_summarizer.summaries_for(
+            db, material_ids, compute=bool(data.get('summarize_sources')))
+        if source_summaries:
+            source_content = source_content + "\n" + format_summaries(source_summaries)
+        source_chunks = retrieve_chunks(db, material_ids, retrieval_query)
+        if source_chunks:
+            source_content = source_content + "\n" + format_chunks(source_chunks)
     try:
         contenttype = data.get('generation_type', 'content').lower()
+        budget = PromptBudget(f'generate_{contenttype}', 'course_outline' if contenttype == 'course' else 'lesson')
         prompt = ""
         content_type = data.get('content_type', 'academic_paper')
 
@@ -881,6 +1011,10 @@ def generate_content_with_ollama(current_user_id):
             assessment_methods = data.get('assessment_methods', 'quizzes, assignments')
             characteristics = data.get('selected_characteristics', ['clarity', 'coherence', 'relevance'])
 
+            # Trim the variable inputs so the prompt fits the model's context window
+            source_content = budget.fit('source_content', source_content, strategy='extractive',
+                                        query=f"{title} {subject} {learning_objectives}")
+            additional_instructions = budget.fit('additional_instructions', additional_instructions, strategy='head')
             extra_sections = ""
             if source_content:
                 extra_sections += f"\n- Source Material: {source_content}"
@@ -897,7 +1031,7 @@ def generate_content_with_ollama(current_user_id):
     - Module Code: {module_code}
     - Target Audience: {target_audience}
     - Learning Objectives: {learning_objectives}
-    - Assessment Methods: {assessment_methods}
+    - Assessment Methods: {assessment_methods}{extra_sections}
 
     Generate well-structured, educational content with:
     1. Clear learning objectives
@@ -921,10 +1055,13 @@ def generate_content_with_ollama(current_user_id):
             delivery_mode = data.get('delivery_mode', 'online')
             qaqf_level = data.get('qaqf_level', 5)
             additional_instructions = data.get('additional_instructions', '')
-            source_content = data.get('source_content', '')
             assessment_methods = data.get('assessment_methods', 'quizzes, assignments')
             characteristics = data.get('selected_characteristics', ['clarity', 'coherence', 'relevance'])
 
+            # Trim the variable inputs so the prompt fits the model's context window
+            source_content = budget.fit('source_content', source_content, strategy='extractive',
+                                        query=f"{title} {subject} {learning_objectives}")
+            additional_instructions = budget.fit('additional_instructions', additional_instructions, strategy='head')
             extra_sections = ""
             if source_content:
                 extra_sections += f"\n- Source Material: {source_content}"
@@ -943,7 +1080,7 @@ def generate_content_with_ollama(current_user_id):
     - Delivery Mode: {delivery_mode}
     - Target Audience: {target_audience}
     - Learning Objectives: {learning_objectives}
-    - Assessment Methods: {assessment_methods}
+    - Assessment Methods: {assessment_methods}{extra_sections}
 
     Structure the course with:
     1. Weekly module breakdown
@@ -958,21 +1095,11 @@ def generate_content_with_ollama(current_user_id):
         # === COMMON OLLAMA HANDLER FOR BOTH TYPES ===
         if not prompt:
             return jsonify({'error': 'Prompt generation failed. Unsupported content_type?'}), 400
+        prompt = budget.finalize(prompt)
 
         # Try Ollama API first
-        ollama_response = requests.post('http://localhost:11434/api/generate', 
-            json={
-                'model': 'llama3.2',
-                'prompt': prompt,
-                'stream': False
-            }, 
-            timeout=3000
-        )
-        
-        if ollama_response.status_code == 200:
-            generated_content = ollama_response.json().get('response', '')
-        else:
-            raise Exception("Ollama API not available")
+        generated_content = ollama_service.generate(
+            prompt, timeout=3000, task='course_outline' if contenttype == 'course' else 'lesson')
             
         # Log activity
         # log_activity(current_user_id, 'ai_generate', 'content', 0, {
@@ -989,27 +1116,64 @@ def generate_content_with_ollama(current_user_id):
                 INSERT INTO generatedlesson (courseid, title, level, description, userid, duration, type)
                 VALUES (?, ?, ?, ?, ?, ?,?)
             ''', (selected_course_id, title, qaqf_level, finn , current_user_id, 20, content_type))
+            index_item(db, 'lesson', cur.lastrowid, finn)
             db.commit()
         return jsonify({
             'generated_content': finn,
             'content_type': content_type,
             'qaqf_level': qaqf_level,
+            'source_chunks': len(source_chunks),
+            'source_summaries': len(source_summaries),
             'status': 'success'
         })
         
+    except CircuitOpenError:
+        # Ollama is known to be down: answer immediately rather than queueing behind timeouts
+        return jsonify({'error': 'AI service is temporarily unavailable, please try again shortly'}), 503
     except Exception as e:
         return jsonify({'error': f'Content generation failed: {str(e)}'}), 500
 
 @app.route('/api/ai/assessment-content', methods=['POST'])
 @token_required
 def assessment_content_ollama(current_user_id):
-    data = request.get_json()
+    data = request.get_json() or {}
+    material_ids = data.get('material_ids') or []
+    try:
+        if not isinstance(material_ids, list):
+            raise TypeError
+        material_ids = [int(material_id) for material_id in material_ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'material_ids must be a list of material ids'}), 400
     try:
         contenttype = data.get('generation_type', 'quiz').lower()
         material = data.get('material', 'nomaterial').lower()
         qaqf_level = data.get('qaqf_level', '1').lower()
         subject = data.get('subject', '').lower()
         userquery = data.get('userquery').lower()
+        if material_ids or (material != "nomaterial" and estimate_tokens(material) > SECTION_BUDGETS['material']):
+            db = get_db()
+            try:
+                if material_ids:
+                    # As for generate-content: cached summaries give the overview, retrieved chunks the detail.
+                    # Computing missing summaries in the request is opt-in; otherwise they're prepared for next time.
+                    compute = bool(data.get('summarize_sources'))
+                    summaries = material_summarizer.summaries_for(db, material_ids, compute=compute)
+                    if not compute and len(summaries) < len(set(material_ids)):
+                        material_summarizer.summarize_later(get_db, material_ids)
+                    chunks = retrieve_chunks(db, material_ids, f"{subject} {userquery}")
+                    sources = ([format_summaries(summaries)] if summaries else []) + \
+                        ([format_chunks(chunks)] if chunks else [])
+                    if sources:
+                        material = "\n".join(sources)
+                else:
+                    # Condense long pasted material; cached by its content hash
+                    material = material_summarizer.summarize(db, ADHOC_MATERIAL_ID, material) or material
+            finally:
+                db.close()
+        budget = PromptBudget(f'assessment_{contenttype}', 'quiz')
+        if material != "nomaterial":
+            material = budget.fit('material', material, strategy='extractive', query=f"{subject} {userquery}")
+        userquery = budget.fit('user_query', userquery, strategy='head')
         if material == "nomaterial":
             prompt = f"""Create a comprehensive {contenttype} for related to {subject} at QAQF Level {qaqf_level}. 
             Format professionally with proper headings and structure. 
@@ -1020,21 +1184,10 @@ def assessment_content_ollama(current_user_id):
             Format professionally with proper headings and structure. 
             Ensure the content is engaging and suitable for learning purposes.
             User query: {userquery}"""
+        prompt = budget.finalize(prompt)
         print(prompt)
         # Try Ollama API first
-        ollama_response = requests.post('http://localhost:11434/api/generate', 
-            json={
-                'model': 'llama3.2',
-                'prompt': prompt,
-                'stream': False
-            }, 
-            timeout=3000
-        )
-        
-        if ollama_response.status_code == 200:
-            generated_content = ollama_response.json().get('response', '')
-        else:
-            raise Exception("Ollama API not available")
+        generated_content = ollama_service.generate(prompt, timeout=3000, task='quiz')
             
         finn = generated_content.strip()
         print(finn)
@@ -1044,9 +1197,109 @@ def assessment_content_ollama(current_user_id):
             'status': 'success'
         })
         
+    except CircuitOpenError:
+        # Ollama is known to be down: answer immediately rather than queueing behind timeouts
+        return jsonify({'error': 'AI service is temporarily unavailable, please try again shortly'}), 503
     except Exception as e:
         return jsonify({'error': f'Content generation failed: {str(e)}'}), 500
 
+@app.route('/api/ai/prompt-stats', methods=['GET'])
+@token_required
+def get_prompt_stats(current_user_id):
+    """Prompt size distribution per AI task, to tune the section budgets"""
+    return jsonify(prompt_stats.summary())
+
+@app.route('/api/ai/generation-stats', methods=['GET'])
+@token_required
+def get_generation_stats(current_user_id):
+    """Tokens generated per AI task against its generation profile, to tune the caps"""
+    return jsonify(generation_stats.summary())
+
+@app.route('/api/users/<int:user_id>/role', methods=['PUT'])
+@token_required
+@role_required('admin')
+def update_user_role(current_user_id, user_id):
+    """Change a user's role (admin only); their existing tokens are revoked, so it applies from their next login"""
+    role = (request.get_json() or {}).get('role')
+    if role not in ('user', 'admin'):
+        return jsonify({'error': "role must be 'user' or 'admin'"}), 400
+    conn = get_db()
+    try:
+        cursor = conn.execute('UPDATE users SET role = ? WHERE id = ?', (role, user_id))
+        conn.commit()
+    finally:
+        conn.close()
+    if not cursor.rowcount:
+        return jsonify({'error': 'User not found'}), 404
+    # Tokens carry the role, so the old ones would keep it until they expire
+    revocation_list.revoke_user(user_id)
+    return jsonify({'message': f'User role updated to {role}'}), 200
+
+@app.route('/api/auth/logout', methods=['POST'])
+@token_required
+def logout(current_user_id):
+    """Revoke the token this request was made with"""
+    revocation_list.revoke(request_token_claims())
+    return jsonify({'message': 'Logged out'}), 200
+
+@app.route('/api/auth/login-stats', methods=['GET'])
+@token_required
+@role_required('admin')
+def get_login_stats(current_user_id):
+    """Login latency percentiles and password hashing pool counters"""
+    return jsonify(password_hasher.get_stats())
+
+@app.route('/api/rate-limits', methods=['GET'])
+@token_required
+@role_required('admin')
+def get_rate_limit_stats(current_user_id):
+    """Rate-limit budgets and how many requests each one has throttled"""
+    return jsonify(rate_limiter.summary())
+
+@app.route('/api/ai/score-lessons', methods=['POST'])
+@token_required
+def score_generated_lessons(current_user_id):
+    """Deterministic QAQF scores for a course's lessons (or given lesson ids), in one batch without the LLM"""
+    data = request.get_json() or {}
+    lesson_ids = data.get('lesson_ids') or []
+    db = get_db()
+    try:
+        if lesson_ids:
+            placeholders = ','.join('?' * len(lesson_ids))
+            rows = db.execute(f'SELECT id, title, level, description FROM generatedlesson WHERE id IN ({placeholders})',
+                              lesson_ids).fetchall()
+        elif data.get('course_id'):
+            rows = db.execute('SELECT id, title, level, description FROM generatedlesson WHERE courseid = ?',
+                              (data['course_id'],)).fetchall()
+        else:
+            return jsonify({'error': 'lesson_ids or course_id is required'}), 400
+    finally:
+        db.close()
+
+    # Levels are stored as labels such as "Qaqf Level 5 (Intermediate)"
+    levels = []
+    for row in rows:
+        match = re.search(r'\d+', str(row['level'] or ''))
+        levels.append(int(match.group()) if match else int(data.get('qaqf_level', 5)))
+    scores = score_lessons([row['description'] or '' for row in rows], levels)
+    return jsonify({
+        'lessons': [{'id': row['id'], 'title': row['title'], 'qaqf_level': level, **result}
+                    for row, level, result in zip(rows, levels, scores)]
+    })
+
+@app.route('/api/ai/status', methods=['GET'])
+@token_required
+def get_ai_status(current_user_id):
+    """Ollama availability, whether the model is loaded, and cold vs warm latency"""
+    return jsonify(ollama_service.get_status())
+
+@app.route('/api/ai/warmup', methods=['POST'])
+@token_required
+def warm_up_ai(current_user_id):
+    """Load the model now, e.g. before a teaching session"""
+    result = ollama_service.warm_up()
+    return jsonify(result), 200 if result['success'] else 503
+
 # CONTENT ROUTES
 @app.route('/api/content', methods=['GET'])
 @token_required
@@ -1235,6 +1488,72 @@ def updatecollection_study_material(current_user_id):
         conn.close()
         return jsonify({'error': str(e)}), 500
 
+# SEARCH ROUTES
+@app.route('/api/search', methods=['GET'])
+@token_required
+def search_content(current_user_id):
+    """Full-text search over your study materials and the generated lessons"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query parameter q is required'}), 400
+
+    scope = request.args.get('scope', 'all')
+    if scope not in ('all', 'materials', 'lessons'):
+        return jsonify({'error': 'scope must be one of all, materials, lessons'}), 400
+
+    owner = request.args.get('owner')
+    if owner == 'me':
+        owner_id = current_user_id
+    elif owner:
+        try:
+            owner_id = int(owner)
+        except ValueError:
+            return jsonify({'error': 'owner must be a user id or "me"'}), 400
+    else:
+        owner_id = None
+
+    conn = get_db()
+    try:
+        results = search_index(
+            conn,
+            query,
+            current_user_id,
+            scope=scope,
+            qaqf_level=request.args.get('qaqf_level', type=int),
+            content_type=request.args.get('type'),
+            owner_id=owner_id,
+            limit=request.args.get('limit', 20, type=int),
+            offset=request.args.get('offset', 0, type=int)
+        )
+        return jsonify(results)
+    except sqlite3.OperationalError as e:
+        return jsonify({'error': 'Search failed', 'details': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/duplicates', methods=['GET'])
+@token_required
+def list_duplicates(current_user_id):
+    """Clusters of near-identical lessons, or of your own study materials"""
+    kind = request.args.get('kind', 'lessons')
+    if kind not in ('lessons', 'materials'):
+        return jsonify({'error': 'kind must be one of lessons, materials'}), 400
+    threshold = request.args.get('threshold', DUPLICATE_THRESHOLD, type=float)
+    if not 0 < threshold <= 1:
+        return jsonify({'error': 'threshold must be between 0 and 1'}), 400
+
+    conn = get_db()
+    try:
+        clusters = duplicate_clusters(
+            conn,
+            'lesson' if kind == 'lessons' else 'material',
+            threshold,
+            owner_id=current_user_id if kind == 'materials' else None
+        )
+        return jsonify({'kind': kind, 'threshold': threshold, 'clusters': clusters})
+    finally:
+        conn.close()
+
 # STUDY MATERIALS ROUTES
 @app.route('/api/study-materials', methods=['GET'])
 @token_required
@@ -1271,20 +1590,29 @@ def create_study_material(current_user_id):
     content = ""
     file_url = None
     file_name = None
-    UPLOAD_FOLDER = 'uploads'
-    ALLOWED_EXTENSIONS = {'pdf', 'txt', 'doc', 'docx', 'md'}
+    file_hash = None
     if file and allowed_file(file.filename):
         print(file.filename)
         filename = secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(file_path)
+        file_path, file_hash = save_upload_content_addressed(file)
 
         ext = filename.rsplit('.', 1)[1].lower()
         file_name = filename
         file_url = file_path
 
+        # An identical file has been uploaded before: reuse its extracted text
+        conn = get_db()
+        known = conn.execute('''
+            SELECT content FROM study_materials
+            WHERE file_hash = ? AND content IS NOT NULL AND content != ''
+            LIMIT 1
+        ''', (file_hash,)).fetchone()
+        conn.close()
+
         try:
-            if ext == 'pdf':
+            if known:
+                content = known['content']
+            elif ext == 'pdf':
                 content = extract_pdf_content(file_path)
             elif ext == 'txt':
                 content = extract_txt_content(file_path)
@@ -1299,8 +1627,8 @@ def create_study_material(current_user_id):
     try:
         cursor = conn.execute('''
             INSERT INTO study_materials 
-            (title, description, type, qaqf_level, created_by_user_id, content, file_url, file_name ,collectionid)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ? , ?)
+            (title, description, type, qaqf_level, created_by_user_id, content, file_url, file_name ,collectionid, file_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ? , ?, ?)
         ''', (
             title,
             description,
@@ -1310,9 +1638,13 @@ def create_study_material(current_user_id):
             content,
             file_url,
             file_name,
-            int(collectionid if collectionid else 0)  # Ensure collectionid is an integer, default to 0 if not provided
+            int(collectionid if collectionid else 0),  # Ensure collectionid is an integer, default to 0 if not provided
+            file_hash
         ))
         material_id = cursor.lastrowid
+        # Chunk now so the first generation from this material doesn't pay for it
+        index_material(conn, material_id, content)
+        index_item(conn, 'material', material_id, content)
         conn.commit()
         conn.close()
 
@@ -1384,6 +1716,8 @@ def update_study_material(current_user_id):
             int(collectionid if collectionid else 0),
             id  # You must provide the ID of the row to update
         ))
+        if id:
+            index_item(conn, 'material', int(id), content)
         conn.commit()
         conn.close()
         return jsonify({
@@ -1469,6 +1803,38 @@ def verification_lesson(id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Review prompts are a fixed prefix plus the lesson. The prefix must stay byte-identical
+# between requests so Ollama's KV cache for it is reused and only the lesson is evaluated.
+REVIEW_PROMPT_PREFIX = """You are an AI assistant that verifies educational content based on QAQF standards.
+
+Your task is to evaluate the content and provide feedback on:
+- Clarity
+- Completeness
+- Accuracy
+- QAQF Alignment
+- Whether it aligns with British standards
+- Any other comments
+
+Return your evaluation strictly in the following JSON format:
+
+{{
+    "{kind}_status": "approved" or "rejected",
+    "{kind}_clarity": 1 to 4,
+    "{kind}_completeness": 1 to 4,
+    "{kind}_accuracy": 1 to 4,
+    "{kind}_qaqf_alignment": 1 to 4,
+    "{kind}_british_standard": "yes" or "no",
+    "{kind}_comments": "Short, helpful comments about the content's strengths and weaknesses"
+}}
+
+The content to evaluate follows.
+"""
+VERIFICATION_PROMPT_PREFIX = REVIEW_PROMPT_PREFIX.format(kind='verification')
+MODERATION_PROMPT_PREFIX = REVIEW_PROMPT_PREFIX.format(kind='moderation')
+# Passed as Ollama's `format` so the reply can only be the verdict object
+VERIFICATION_SCHEMA = review_schema('verification')
+MODERATION_SCHEMA = review_schema('moderation')
+
 @app.route('/api/autoverification_lessons', methods=['POST'])
 def autoverification_lesson():
     data = request.json
@@ -1478,59 +1844,56 @@ def autoverification_lesson():
         return jsonify({'success': False, 'error': 'Content field is required'}), 400
     
     try:
-        # Build the prompt
-        prompt = f"""
-        You are an AI assistant that verifies educational content based on QAQF standards.
-
-        Your task is to evaluate the content and provide feedback on:
-        - Clarity
-        - Completeness
-        - Accuracy
-        - QAQF Alignment
-        - Whether it aligns with British standards
-        - Any other comments
-
-        Content:
-        \"\"\"{data.get('content')}\"\"\"
-
-        Return your evaluation strictly in the following JSON format:
-
-        {{
-            "verification_status": "approved" or "rejected",
-            "verification_clarity": 1 to 4,
-            "verification_completeness": 1 to 4,
-            "verification_accuracy": 1 to 4,
-            "verification_qaqf_alignment": 1 to 4,
-            "verification_british_standard": "yes" or "no",
-            "verification_comments": "Short, helpful comments about the content's strengths and weaknesses"
-        }}
-        """
-        print("Prompt:", prompt)
+        # A lesson practically identical to one already verified takes over its verdict
+        if data.get('reuse_verified'):
+            db = get_db()
+            try:
+                duplicate = find_verified_duplicate(db, data.get('content'))
+            finally:
+                db.close()
+            if duplicate:
+                return jsonify({
+                    'success': True,
+                    'data': duplicate['verdict'],
+                    'reused_from': duplicate['lesson_id'],
+                    'similarity': duplicate['similarity']
+                })
+
+        # Obviously unusable lessons are rejected without the full evaluation
+        triage = None
+        if not data.get('force_full_review'):
+            db = get_db()
+            try:
+                triage = triage_lesson(db, data.get('content'))
+            finally:
+                db.close()
+            if triage['decision'] == REJECT:
+                return jsonify({
+                    'success': True,
+                    'data': rejection_verdict('verification', triage),
+                    'triage': triage
+                })
+
+        budget = PromptBudget('verification', 'verification')
+        content = budget.fit('content', data.get('content'))
+        # Static instructions go in the system message and only the lesson varies,
+        # so Ollama can reuse the cached prefix
+        user_message = f'''Content:
+"""{content}"""'''
+        user_message = budget.finalize(user_message, system=VERIFICATION_PROMPT_PREFIX)
         # Call Ollama
-        ollama_response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={
-                'model': 'llama3.2',
-                'prompt': prompt,
-                'stream': False
-            },
-            timeout=600
+        # Schema-constrained and streamed: generation stops once the object closes,
+        # and near-valid output is repaired rather than failing the request
+        response_json = coerce_to_schema(
+            ollama_service.chat_json(VERIFICATION_PROMPT_PREFIX, user_message, VERIFICATION_SCHEMA,
+                                     timeout=600, task='verification'),
+            VERIFICATION_SCHEMA
         )
-
-        if ollama_response.status_code != 200:
-            raise Exception("Ollama API returned an error.")
-        print("Ollama Response:", ollama_response.json())
-        raw_response = ollama_response.json().get('response', '').strip()
-        import re
-        match = re.search(r'{[\s\S]+}', raw_response)
-        if not match:
-            raise ValueError("AI response does not contain valid JSON")
-
-        response_json = json.loads(match.group())
         print("AI Response:", response_json)
         return jsonify({
             'success': True,
-            'data': response_json
+            'data': response_json,
+            'triage': triage
         })
 
     except Exception as e:
@@ -1542,55 +1905,21 @@ def automoderation_lessons():
     data = request.json
     print(data)
     try:
-        # Build the prompt
-        prompt = f"""
-        You are an AI assistant that verifies educational content based on QAQF standards.
-
-        Your task is to evaluate the content and provide feedback on:
-        - Clarity
-        - Completeness
-        - Accuracy
-        - QAQF Alignment
-        - Whether it aligns with British standards
-        - Any other comments
-
-        Content:
-        \"\"\"{data.get('content')}\"\"\"
-
-        Return your evaluation strictly in the following JSON format:
-
-        {{
-            "moderation_status": "approved" or "rejected",
-            "moderation_clarity": 1 to 4,
-            "moderation_completeness": 1 to 4,
-            "moderation_accuracy": 1 to 4,
-            "moderation_qaqf_alignment": 1 to 4,
-            "moderation_british_standard": "yes" or "no",
-            "moderation_comments": "Short, helpful comments about the content's strengths and weaknesses"
-        }}
-        """
-        print(prompt)
+        budget = PromptBudget('moderation', 'moderation')
+        content = budget.fit('content', data.get('content'))
+        # Static instructions go in the system message and only the lesson varies,
+        # so Ollama can reuse the cached prefix
+        user_message = f'''Content:
+"""{content}"""'''
+        user_message = budget.finalize(user_message, system=MODERATION_PROMPT_PREFIX)
         # Call Ollama
-        ollama_response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={
-                'model': 'llama3.2',
-                'prompt': prompt,
-                'stream': False
-            },
-            timeout=600
+        # Schema-constrained and streamed: generation stops once the object closes,
+        # and near-valid output is repaired rather than failing the request
+        response_json = coerce_to_schema(
+            ollama_service.chat_json(MODERATION_PROMPT_PREFIX, user_message, MODERATION_SCHEMA,
+                                     timeout=600, task='moderation'),
+            MODERATION_SCHEMA
         )
-
-        if ollama_response.status_code != 200:
-            raise Exception("Ollama API returned an error.")
-        print("Ollama Response:", ollama_response.json())
-        raw_response = ollama_response.json().get('response', '').strip()
-        import re
-        match = re.search(r'{[\s\S]+}', raw_response)
-        if not match:
-            raise ValueError("AI response does not contain valid JSON")
-
-        response_json = json.loads(match.group())
         print("AI Response:", response_json)
         return jsonify({
             'success': True,
@@ -1693,19 +2022,7 @@ Format as a complete assessment ready for use."""
 
         try:
             # Try Ollama API first
-            ollama_response = requests.post('http://localhost:11434/api/generate', 
-                json={
-                    'model': 'llama3.2',
-                    'prompt': prompt,
-                    'stream': False
-                }, 
-                timeout=30
-            )
-            
-            if ollama_response.status_code == 200:
-                assessment = ollama_response.json().get('response', '')
-            else:
-                raise Exception("Ollama API not available")
+            assessment = ollama_service.generate(prompt, timeout=30, task='quiz')
                 
         except:
             # Fallback assessment generation
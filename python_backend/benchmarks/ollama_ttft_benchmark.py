@@ -0,0 +1,130 @@
+"""
+Time-to-first-token benchmark for the lesson verification prompt
+Compares the old layout (lesson in the middle of one /api/generate prompt) with the cached-prefix /api/chat layout
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import VERIFICATION_PROMPT_PREFIX  # noqa: E402
+
+# The prompt autoverification_lesson sent before the prefix/suffix split
+LEGACY_TEMPLATE = """
+        You are an AI assistant that verifies educational content based on QAQF standards.
+
+        Your task is to evaluate the content and provide feedback on:
+        - Clarity
+        - Completeness
+        - Accuracy
+        - QAQF Alignment
+        - Whether it aligns with British standards
+        - Any other comments
+
+        Content:
+        \"\"\"{content}\"\"\"
+
+        Return your evaluation strictly in the following JSON format:
+
+        {{
+            "verification_status": "approved" or "rejected",
+            "verification_clarity": 1 to 4,
+            "verification_completeness": 1 to 4,
+            "verification_accuracy": 1 to 4,
+            "verification_qaqf_alignment": 1 to 4,
+            "verification_british_standard": "yes" or "no",
+            "verification_comments": "Short, helpful comments about the content's strengths and weaknesses"
+        }}
+        """
+
+
+def sample_lesson(index: int, paragraphs: int) -> str:
+    """Distinct lesson text per request, so nothing but the static instructions can be cached"""
+    return "\n\n".join(
+        f"Lesson {index}, section {section}: learners examine case study {index * 31 + section}, "
+        f"compare two approaches to the problem and justify a recommendation with evidence."
+        for section in range(paragraphs)
+    )
+
+
+def stream_ttft(url: str, payload: dict, timeout: int) -> dict:
+    """Send a streaming request; return seconds to the first token and Ollama's prompt eval figures"""
+    started = time.perf_counter()
+    first_token = None
+    final = {}
+    with requests.post(url, json={**payload, "stream": True}, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            text = chunk.get("response") or chunk.get("message", {}).get("content")
+            if first_token is None and text:
+                first_token = time.perf_counter() - started
+            if chunk.get("done"):
+                final = chunk
+                break
+    return {
+        "ttft": first_token if first_token is not None else time.perf_counter() - started,
+        "prompt_eval_count": final.get("prompt_eval_count", 0),
+        "prompt_eval_ms": final.get("prompt_eval_duration", 0) / 1e6,
+    }
+
+
+def run(base_url: str, model: str, requests_per_layout: int, paragraphs: int, keep_alive: str, timeout: int):
+    options = {"num_predict": 1}  # only the first token matters here
+
+    layouts = {
+        "legacy /api/generate": lambda content: (f"{base_url}/api/generate", {
+            "model": model, "prompt": LEGACY_TEMPLATE.format(content=content), "options": options
+        }),
+        "prefix /api/chat": lambda content: (f"{base_url}/api/chat", {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": VERIFICATION_PROMPT_PREFIX},
+                {"role": "user", "content": f'Content:\n"""{content}"""'}
+            ],
+            "keep_alive": keep_alive,
+            "options": options
+        }),
+    }
+
+    # Load the model first so neither layout is charged for the cold start
+    requests.post(f"{base_url}/api/generate", json={"model": model, "keep_alive": keep_alive}, timeout=timeout)
+
+    print(f"{'layout':<24}{'p50 TTFT ms':>13}{'p95 TTFT ms':>13}{'prompt tokens':>15}{'evaluated':>11}")
+    for offset, (name, build) in enumerate(layouts.items()):
+        results = []
+        for index in range(requests_per_layout):
+            url, payload = build(sample_lesson(offset * 10_000 + index, paragraphs))
+            results.append(stream_ttft(url, payload, timeout))
+        ttfts = sorted(result["ttft"] * 1000 for result in results)
+        p95 = ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))]
+        # Ollama reports only the tokens it had to evaluate, so a cached prefix shows up as a smaller count
+        evaluated = statistics.mean(result["prompt_eval_count"] for result in results[1:] or results)
+        print(f"{name:<24}{statistics.median(ttfts):>13.0f}{p95:>13.0f}"
+              f"{results[0]['prompt_eval_count']:>15}{evaluated:>11.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark verification prompt time-to-first-token")
+    parser.add_argument("--base-url", default="http://localhost:11434")
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--paragraphs", type=int, default=12)
+    parser.add_argument("--keep-alive", default="30m")
+    parser.add_argument("--timeout", type=int, default=600)
+    args = parser.parse_args()
+
+    try:
+        requests.get(f"{args.base_url}/api/tags", timeout=5).raise_for_status()
+    except requests.exceptions.RequestException:
+        sys.exit(f"Ollama is not reachable at {args.base_url}")
+    run(args.base_url, args.model, args.requests, args.paragraphs, args.keep_alive, args.timeout)
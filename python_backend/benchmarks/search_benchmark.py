@@ -0,0 +1,133 @@
+"""
+Benchmark for the study material / lesson full-text search index
+Loads synthetic documents into a scratch SQLite database and times indexing and queries
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import itertools
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.search_index import init_search_index, search  # noqa: E402
+
+VOCABULARY = (
+    "assessment learning outcome module curriculum pedagogy analysis evaluation framework "
+    "qualification competence reflection research method evidence practice theory design "
+    "digital literacy communication collaboration innovation leadership ethics sustainability "
+    "biology chemistry physics mathematics statistics economics history geography literature "
+    "programming database network security algorithm structure organisation behaviour colour "
+    "programme centre analyse optimise laboratory experiment hypothesis observation conclusion"
+).split()
+
+# Real text is Zipf-distributed: a few common words and a long tail of rare ones
+VOCABULARY += [f"term{index}" for index in range(20_000)]
+ZIPF_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+QUERIES = ["assessment", "learning outcome", "research method", "digital literacy", "organ",
+           "sustainability ethics", "programme design", "laboratory experiment hypothesis", "term4821"]
+
+
+def create_tables(conn: sqlite3.Connection):
+    """The columns of study_materials / generatedlesson that the index and filters use"""
+    conn.execute('''
+        CREATE TABLE study_materials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, description TEXT,
+            collectionid INTEGER, type TEXT NOT NULL, qaqf_level INTEGER NOT NULL,
+            created_by_user_id INTEGER NOT NULL, content TEXT, file_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE generatedlesson (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, courseid INTEGER NOT NULL, title TEXT NOT NULL,
+            description TEXT, level INTEGER, userid INTEGER NOT NULL, type TEXT, status TEXT,
+            createddate DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choices(VOCABULARY, cum_weights=ZIPF_WEIGHTS, k=count))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(documents: int, users: int, body_words: int, repeats: int):
+    rng = random.Random(42)
+    db_dir = tempfile.mkdtemp()
+    db_path = os.path.join(db_dir, "search_benchmark.db")
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    create_tables(conn)
+    init_search_index(conn)
+
+    materials = documents // 2
+    lessons = documents - materials
+
+    started = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO study_materials (title, description, type, qaqf_level, created_by_user_id, content) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        ((words(rng, 6), words(rng, 25), rng.choice(["pdf", "notes", "slides"]), rng.randint(1, 9),
+          rng.randint(1, users), words(rng, body_words)) for _ in range(materials))
+    )
+    conn.executemany(
+        "INSERT INTO generatedlesson (courseid, title, description, level, userid, type) VALUES (?, ?, ?, ?, ?, ?)",
+        ((rng.randint(1, 500), words(rng, 6), words(rng, body_words // 2), rng.randint(1, 9),
+          rng.randint(1, users), rng.choice(["lecture", "quiz", "workshop"])) for _ in range(lessons))
+    )
+    conn.commit()
+    insert_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    conn.execute("INSERT INTO study_materials_fts (study_materials_fts) VALUES ('optimize')")
+    conn.execute("INSERT INTO generatedlesson_fts (generatedlesson_fts) VALUES ('optimize')")
+    conn.commit()
+    optimize_seconds = time.perf_counter() - started
+
+    print(f"Documents: {documents:,} ({materials:,} materials, {lessons:,} lessons, {users} users)")
+    print(f"Insert with trigger indexing: {insert_seconds:.2f}s ({documents / insert_seconds:,.0f} docs/sec)")
+    print(f"Index optimize: {optimize_seconds:.2f}s")
+    print(f"Database size: {os.path.getsize(db_path) / (1024 * 1024):.1f} MB")
+    print()
+
+    filters = [
+        ("no filters", {}),
+        ("qaqf_level=5", {"qaqf_level": 5}),
+        ("type=quiz, lessons", {"content_type": "quiz", "scope": "lessons"}),
+        ("owner=1, lessons", {"owner_id": 1, "scope": "lessons"}),
+    ]
+    print(f"{'query':<36}{'filters':<22}{'p50 ms':>9}{'p95 ms':>9}{'hits':>6}")
+    for query in QUERIES:
+        for label, options in filters:
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                result = search(conn, query, user_id=rng.randint(1, users), **options)
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"{query:<36}{label:<22}{statistics.median(timings):>9.2f}"
+                  f"{percentile(timings, 0.95):>9.2f}{result['count']:>6}")
+
+    conn.close()
+    os.remove(db_path)
+    os.rmdir(db_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the FTS5 search index")
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--body-words", type=int, default=300)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    run(args.documents, args.users, args.body_words, args.repeats)
@@ -0,0 +1,113 @@
+"""
+Throughput benchmark for the British spelling checker
+Compares the word-scan checker with a flat and a trie-shaped regex of the same dictionary, in MB/s
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typing import Dict, Any, Iterable  # noqa: E402
+
+from services.british_spelling import spelling_map, find_spellings  # noqa: E402
+
+FILLER = """the learners will examine how evidence from each case study supports a reasoned argument
+and evaluate the strengths and limitations of different approaches before presenting findings to peers
+in a structured report with references and a reflective commentary on their own learning""".split()
+
+
+def sample_text(megabytes: float, american_share: float, seed: int = 7) -> str:
+    """Lesson-like prose with a given share of American spellings"""
+    rng = random.Random(seed)
+    americans = list(spelling_map())
+    words = []
+    size = 0
+    target = int(megabytes * 1024 * 1024)
+    while size < target:
+        word = rng.choice(americans) if rng.random() < american_share else rng.choice(FILLER)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """Regex alternation of words, factored into a trie so shared prefixes are matched once.
+
+    A flat "color|colors|colored|..." makes the regex engine retry every
+    alternative at each position; the trie form rejects a position after
+    checking at most one branch per character.
+    """
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: Dict[str, Any]) -> str:
+        ends_here = "" in node
+        leaves = sorted(char for char, child in node.items() if char and list(child) == [""])
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())
+                    if char and char not in leaves]
+        if len(leaves) == 1:
+            branches.append(re.escape(leaves[0]))
+        elif leaves:
+            branches.append("[" + "".join(re.escape(char) for char in leaves) + "]")
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if ends_here:
+            # A single character or character class can take "?" directly
+            atomic = len(body) == 1 or (len(branches) == 1 and body.startswith("["))
+            return body + "?" if atomic else "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+def measure(find, text: str, repeats: int):
+    """Best of repeats: (MB/s, matches)"""
+    best = float("inf")
+    matches = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        matches = find(text)
+        best = min(best, time.perf_counter() - started)
+    return len(text.encode("utf-8")) / (1024 * 1024) / best, matches
+
+
+def run(megabytes: float, american_share: float, repeats: int):
+    text = sample_text(megabytes, american_share)
+    words = sorted(spelling_map(), key=len, reverse=True)
+
+    matchers = []
+    started = time.perf_counter()
+    flat = re.compile(r"\b(?:" + "|".join(map(re.escape, words)) + r")\b", re.IGNORECASE)
+    matchers.append(("flat regex", time.perf_counter() - started, lambda text: sum(1 for _ in flat.finditer(text))))
+    started = time.perf_counter()
+    trie = re.compile(r"\b" + trie_pattern(words) + r"\b", re.IGNORECASE)
+    matchers.append(("trie regex", time.perf_counter() - started, lambda text: sum(1 for _ in trie.finditer(text))))
+    spelling_map.cache_clear()
+    started = time.perf_counter()
+    spelling_map()
+    matchers.append(("word scan", time.perf_counter() - started, lambda text: len(find_spellings(text))))
+
+    print(f"{len(words)} dictionary entries, {megabytes} MB of text, {american_share:.1%} American spellings")
+    print(f"{'matcher':<14}{'build ms':>10}{'MB/s':>10}{'matches':>10}")
+    for name, build_seconds, find in matchers:
+        throughput, matches = measure(find, text, repeats)
+        print(f"{name:<14}{build_seconds * 1000:>10.1f}{throughput:>10.1f}{matches:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the British spelling checker")
+    parser.add_argument("--megabytes", type=float, default=5.0)
+    parser.add_argument("--american-share", type=float, default=0.01)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    run(args.megabytes, args.american_share, args.repeats)
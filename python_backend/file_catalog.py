@@ -0,0 +1,216 @@
+"""
+File metadata catalogue for the local upload store
+SQLite index kept in sync by LocalFileService so listings and stats never walk the disk
+"""
+
+import sqlite3
+import mimetypes
+from pathlib import Path
+from datetime import datetime
+from typing import Optional, Dict, List, Any, Callable, Iterable, Tuple
+
+
+class FileCatalog:
+    def __init__(self, db_path: Path):
+        self.db_path = str(db_path)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                name TEXT,
+                owner_id INTEGER,
+                size INTEGER NOT NULL,
+                mime_type TEXT,
+                hash TEXT,
+                category TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                fingerprint TEXT,
+                fingerprint_algorithm TEXT
+            )
+        ''')
+        # hash is always the SHA-256 storage key; the configurable fingerprint lives in its own
+        # columns. Catalogues from before the split get them added with NULLs for reconcile to fill
+        columns = {row["name"] for row in conn.execute('PRAGMA table_info(files)')}
+        for column in ("fingerprint", "fingerprint_algorithm"):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE files ADD COLUMN {column} TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_files_owner ON files (owner_id, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_files_category ON files (category, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_files_hash ON files (hash)')
+        conn.commit()
+        conn.close()
+
+    def add(self, file_info: Dict[str, Any]):
+        """Record (or refresh) an uploaded file"""
+        conn = self._connect()
+        conn.execute('''
+            INSERT OR REPLACE INTO files (path, name, owner_id, size, mime_type, hash, category, created_at,
+                                          fingerprint, fingerprint_algorithm)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            file_info["path"],
+            file_info.get("name"),
+            file_info.get("uploaded_by"),
+            file_info["size"],
+            file_info.get("mime_type"),
+            file_info.get("hash"),
+            file_info["category"],
+            str(file_info.get("uploaded_at") or datetime.now()),
+            file_info.get("fingerprint"),
+            file_info.get("fingerprint_algorithm")
+        ))
+        conn.commit()
+        conn.close()
+
+    def remove(self, path: str):
+        conn = self._connect()
+        conn.execute('DELETE FROM files WHERE path = ?', (path,))
+        conn.commit()
+        conn.close()
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM files WHERE path = ?', (path,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def find_by_hash(self, file_hash: str) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        rows = conn.execute('SELECT * FROM files WHERE hash = ?', (file_hash,)).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def list(self, category: Optional[str] = None, owner_id: Optional[int] = None,
+             limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """List catalogued files, newest first, using the owner/category indexes"""
+        conditions = []
+        params: List[Any] = []
+        if category:
+            conditions.append('category = ?')
+            params.append(category)
+        if owner_id is not None:
+            conditions.append('owner_id = ?')
+            params.append(owner_id)
+
+        query = 'SELECT * FROM files'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_at DESC'
+        if limit is not None:
+            query += ' LIMIT ? OFFSET ?'
+            params.extend([limit, offset])
+
+        conn = self._connect()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def stats(self, deduplicated: bool = True) -> Dict[str, Any]:
+        """Per-category totals plus deduplication savings, aggregated in SQL.
+
+        deduplicated is False when the store keeps every upload as its own copy,
+        in which case nothing is saved however many hashes repeat.
+        """
+        conn = self._connect()
+        category_rows = conn.execute('''
+            SELECT category, COUNT(*) AS file_count, COALESCE(SUM(size), 0) AS size
+            FROM files GROUP BY category
+        ''').fetchall()
+        # Files without a hash can't be shared, so each counts as its own stored copy
+        stored = conn.execute('''
+            SELECT COUNT(*) AS unique_files, COALESCE(SUM(size), 0) AS stored_size FROM (
+                SELECT MAX(size) AS size FROM files WHERE hash IS NOT NULL AND hash != '' GROUP BY hash
+                UNION ALL
+                SELECT size FROM files WHERE hash IS NULL OR hash = ''
+            )
+        ''').fetchone()
+        conn.close()
+
+        stats = {
+            "total_files": sum(row["file_count"] for row in category_rows),
+            "total_size": sum(row["size"] for row in category_rows),
+            "categories": {
+                row["category"]: {"file_count": row["file_count"], "size": row["size"]}
+                for row in category_rows
+            }
+        }
+        if deduplicated:
+            unique_files, stored_size = stored["unique_files"], stored["stored_size"]
+        else:
+            unique_files, stored_size = stats["total_files"], stats["total_size"]
+        stats["deduplication"] = {
+            "enabled": deduplicated,
+            "unique_files": unique_files,
+            "stored_size": stored_size,
+            "saved_bytes": stats["total_size"] - stored_size,
+            "savings_ratio": round(1 - stored_size / stats["total_size"], 4) if stats["total_size"] else 0.0
+        }
+        return stats
+
+    def reconcile(self, base_dir: Path, categories: Iterable[str],
+                  hash_file: Callable[[Path], Tuple[str, str]],
+                  fingerprint_algorithm: str) -> Dict[str, int]:
+        """Bring the catalogue back in line with the files actually on disk.
+
+        Files found on disk but not catalogued are added without an owner;
+        catalogue rows whose file has disappeared are dropped. hash_file returns
+        (storage_hash, fingerprint); rows without a fingerprint predate the split
+        between the two and have both recomputed.
+        """
+        on_disk = {}
+        for category in categories:
+            category_dir = base_dir / category
+            if category_dir.exists():
+                for file_path in category_dir.iterdir():
+                    if file_path.is_file():
+                        on_disk[str(file_path.relative_to(base_dir))] = file_path
+
+        conn = self._connect()
+        catalogued = {row["path"]: row["fingerprint"] for row in conn.execute('SELECT path, fingerprint FROM files')}
+
+        missing = [path for path in catalogued if path not in on_disk]
+        conn.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in missing])
+
+        added = 0
+        rehashed = 0
+        for relative_path, file_path in on_disk.items():
+            if relative_path in catalogued:
+                if catalogued[relative_path] is None:
+                    file_hash, fingerprint = hash_file(file_path)
+                    conn.execute(
+                        'UPDATE files SET hash = ?, fingerprint = ?, fingerprint_algorithm = ? WHERE path = ?',
+                        (file_hash, fingerprint, fingerprint_algorithm, relative_path)
+                    )
+                    rehashed += 1
+                continue
+            stat = file_path.stat()
+            file_hash, fingerprint = hash_file(file_path)
+            conn.execute('''
+                INSERT INTO files (path, name, owner_id, size, mime_type, hash, category, created_at,
+                                   fingerprint, fingerprint_algorithm)
+                VALUES (?, ?, NULL, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                relative_path,
+                file_path.name,
+                stat.st_size,
+                mimetypes.guess_type(str(file_path))[0],
+                file_hash,
+                file_path.parent.name,
+                str(datetime.fromtimestamp(stat.st_mtime)),
+                fingerprint,
+                fingerprint_algorithm
+            ))
+            added += 1
+
+        conn.commit()
+        conn.close()
+        return {"added": added, "removed": len(missing), "rehashed": rehashed, "total": len(on_disk)}
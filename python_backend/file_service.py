@@ -5,18 +5,69 @@ Replaces AWS S3 with local file storage
 
 import os
 import uuid
-import shutil
+import tempfile
 from pathlib import Path
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, BinaryIO, Set, Tuple
 from fastapi import UploadFile, HTTPException
 import mimetypes
 import hashlib
+import threading
 from datetime import datetime
 
+from file_catalog import FileCatalog
+
+
+def new_hasher(algorithm: str):
+    """Create a streaming hasher by name.
+
+    Any hashlib algorithm works (md5, sha256, blake2b, ...); "blake3" and
+    "xxhash" (xxh3_128) are much faster and need their packages installed.
+    """
+    if algorithm == "blake3":
+        from blake3 import blake3
+        return blake3()
+    if algorithm == "xxhash":
+        import xxhash
+        return xxhash.xxh3_128()
+    return hashlib.new(algorithm)
+
+
+# Objects are stored and deduplicated under this hash: a collision would serve one user's file as
+# another's, so it has to stay collision-resistant whatever fingerprint is configured
+STORAGE_HASH_ALGORITHM = "sha256"
+
+
+class ContentHashes:
+    """The SHA-256 storage key and the configured fingerprint, fed in the same pass"""
+    
+    def __init__(self, fingerprint_algorithm: str):
+        self._storage = hashlib.new(STORAGE_HASH_ALGORITHM)
+        self._fingerprint = (None if fingerprint_algorithm == STORAGE_HASH_ALGORITHM
+                             else new_hasher(fingerprint_algorithm))
+    
+    def update(self, chunk):
+        self._storage.update(chunk)
+        if self._fingerprint is not None:
+            self._fingerprint.update(chunk)
+    
+    @property
+    def storage_key(self) -> str:
+        return self._storage.hexdigest()
+    
+    @property
+    def fingerprint(self) -> str:
+        return (self._fingerprint or self._storage).hexdigest()
+
+
 class LocalFileService:
     def __init__(self, base_upload_dir: str = "uploads"):
         self.base_upload_dir = Path(base_upload_dir)
         self.max_file_size = 50 * 1024 * 1024  # 50MB
+        self.chunk_size = 1024 * 1024  # 1MB per read, so peak memory per upload is constant
+        # Only the fingerprint reported for each upload; storage always uses STORAGE_HASH_ALGORITHM
+        self.hash_algorithm = os.getenv("FILE_HASH_ALGORITHM", "md5").lower()
+        new_hasher(self.hash_algorithm)  # fail at startup on an unknown or missing algorithm
+        self._buffers = threading.local()
         self.allowed_extensions = {
             'images': {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'},
             'documents': {'.pdf', '.doc', '.docx', '.txt', '.rtf', '.odt'},
@@ -25,6 +76,11 @@ class LocalFileService:
             'archives': {'.zip', '.rar', '.7z', '.tar', '.gz'}
         }
         self._ensure_directories()
+        # Deduplication relies on hard links; without them each upload is stored once, at its own path
+        self.object_store_enabled = self._supports_hard_links()
+        # A new catalogue starts empty; files uploaded before it existed are indexed by an explicit
+        # reconcile (python file_service.py reconcile, or POST /files/reconcile), never at import
+        self.catalog = FileCatalog(self.base_upload_dir / "catalog.db")
     
     def _ensure_directories(self):
         """Create necessary directories"""
@@ -35,12 +91,27 @@ class LocalFileService:
             self.base_upload_dir / "videos",
             self.base_upload_dir / "audio",
             self.base_upload_dir / "archives",
+            self.base_upload_dir / "objects",
             self.base_upload_dir / "temp"
         ]
         
         for directory in directories:
             directory.mkdir(parents=True, exist_ok=True)
     
+    def _supports_hard_links(self) -> bool:
+        """Whether the upload directory's filesystem can hard-link into the object store"""
+        probe = self.base_upload_dir / "objects" / f".link-probe-{uuid.uuid4()}"
+        link = probe.with_name(probe.name + ".link")
+        try:
+            probe.touch()
+            os.link(probe, link)
+            return True
+        except OSError:
+            return False
+        finally:
+            link.unlink(missing_ok=True)
+            probe.unlink(missing_ok=True)
+    
     def upload_file(self, file: UploadFile, user_id: int, 
                    category: Optional[str] = None) -> Dict[str, Any]:
         """Upload file to local storage"""
@@ -60,29 +131,154 @@ class LocalFileService:
         upload_dir = self.base_upload_dir / category
         file_path = upload_dir / unique_filename
         
-        # Save file
+        # Stream to uploads/temp, then move into place so readers never see a partial file
+        temp_path, _, file_hash, fingerprint = self.stream_to_temp(file.file)
+        deduplicated = False
         try:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            if self.object_store_enabled:
+                deduplicated = self._store_object(temp_path, file_hash)
+                self._link_object(file_hash, file_path)
+            else:
+                os.replace(temp_path, file_path)
         except Exception as e:
+            temp_path.unlink(missing_ok=True)
+            if self.object_store_enabled and not deduplicated:
+                self._object_path(file_hash).unlink(missing_ok=True)
             raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
         
         # Get file info
-        file_info = self._get_file_info(file_path, file.filename, user_id)
+        file_info = self._get_file_info(file_path, file.filename, user_id, file_hash, fingerprint)
+        file_info["deduplicated"] = deduplicated
+        self.catalog.add(file_info)
         
         return file_info
     
+    def _object_path(self, file_hash: str) -> Path:
+        """Content-addressed location of the single stored copy of a file"""
+        return self.base_upload_dir / "objects" / file_hash[:2] / file_hash
+    
+    def _store_object(self, temp_path: Path, file_hash: str) -> bool:
+        """Move a streamed upload into the object store; returns True if it was a duplicate"""
+        object_path = self._object_path(file_hash)
+        if object_path.exists():
+            temp_path.unlink(missing_ok=True)
+            return True
+        object_path.parent.mkdir(exist_ok=True)
+        os.replace(temp_path, object_path)
+        return False
+    
+    def _link_object(self, file_hash: str, file_path: Path):
+        """Expose a stored object at its public path.
+        
+        Hard links let the filesystem share one copy between duplicates, and the
+        catalogue counts references, so the object is removed with its last
+        public link. Only used when object_store_enabled; filesystems without
+        hard links store each upload directly at its public path instead.
+        """
+        os.link(self._object_path(file_hash), file_path)
+    
+    def _read_chunks(self, source: BinaryIO):
+        """Yield memoryviews over a per-thread buffer filled with readinto.
+        
+        Each view is only valid until the next one is produced, so consumers
+        must hash/write it straight away rather than keep a reference.
+        """
+        buffer = getattr(self._buffers, "buffer", None)
+        if buffer is None or len(buffer) != self.chunk_size:
+            buffer = self._buffers.buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        readinto = getattr(source, "readinto", None)
+        while True:
+            if readinto is not None:
+                read = readinto(buffer)
+            else:
+                data = source.read(self.chunk_size)
+                read = len(data)
+                buffer[:read] = data
+            if not read:
+                break
+            yield view[:read]
+    
+    def stream_to_temp(self, source: BinaryIO, suffix: str = "") -> Tuple[Path, int, str, str]:
+        """Copy an upload stream into uploads/temp in fixed-size chunks.
+        
+        The size limit is enforced as bytes arrive and the hashes are computed
+        in the same pass, so the file is never re-read. Returns (temp_path, size,
+        storage_hash, fingerprint); the caller moves or removes the file.
+        """
+        hasher = ContentHashes(self.hash_algorithm)
+        size = 0
+        temp_file = tempfile.NamedTemporaryFile(dir=self.base_upload_dir / "temp", suffix=suffix, delete=False)
+        temp_path = Path(temp_file.name)
+        try:
+            with temp_file:
+                for chunk in self._read_chunks(source):
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"File too large. Maximum size: {self.max_file_size // (1024*1024)}MB"
+                        )
+                    hasher.update(chunk)
+                    temp_file.write(chunk)
+        except HTTPException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        except Exception as e:
+            temp_path.unlink(missing_ok=True)
+            raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
+        
+        return temp_path, size, hasher.storage_key, hasher.fingerprint
+    
     def delete_file(self, file_path: str) -> bool:
-        """Delete file from local storage"""
+        """Delete file from local storage, and its stored object once no other file references it"""
         try:
             full_path = self.base_upload_dir / file_path
             if full_path.exists() and full_path.is_file():
+                record = self.catalog.get(file_path)
+                file_hash = record["hash"] if record else None
+                if not file_hash and full_path.parent.name in self.allowed_extensions:
+                    file_hash = self._calculate_file_hash(full_path)
                 full_path.unlink()
+                self.catalog.remove(file_path)
+                # The catalogue counts the hard links still referencing the object
+                if file_hash and not self.catalog.find_by_hash(file_hash):
+                    self._object_path(file_hash).unlink(missing_ok=True)
                 return True
             return False
         except Exception:
             return False
     
+    def resolve_public_path(self, file_path: str) -> Optional[Path]:
+        """Map a public file path to disk, refusing anything outside the served directories"""
+        base_dir = self.base_upload_dir.resolve()
+        full_path = (base_dir / file_path).resolve()
+        try:
+            relative_path = full_path.relative_to(base_dir)
+        except ValueError:
+            return None
+        
+        public_dirs = set(self.allowed_extensions) | {"thumbnails"}
+        if len(relative_path.parts) < 2 or relative_path.parts[0] not in public_dirs:
+            return None
+        if not full_path.is_file():
+            return None
+        return full_path
+    
+    def public_relative_path(self, full_path: Path) -> str:
+        """Catalogue key of a path returned by resolve_public_path"""
+        return full_path.relative_to(self.base_upload_dir.resolve()).as_posix()
+    
+    def file_owners(self, relative_path: str) -> Set[int]:
+        """Users who uploaded a file; for a thumbnail, the users who uploaded its source image"""
+        if relative_path.startswith("thumbnails/"):
+            # Variants are named <hash>_<size>.<ext>
+            records = self.catalog.find_by_hash(Path(relative_path).name.split("_", 1)[0])
+        else:
+            record = self.catalog.get(relative_path)
+            records = [record] if record else []
+        return {record["owner_id"] for record in records if record["owner_id"] is not None}
+    
     def get_file_url(self, file_path: str) -> str:
         """Get public URL for file"""
         # In production, this would be your domain + file path
@@ -107,28 +303,25 @@ class LocalFileService:
             return None
     
     def list_files(self, category: Optional[str] = None, 
-                  user_id: Optional[int] = None) -> List[Dict[str, Any]]:
-        """List files in storage"""
+                  user_id: Optional[int] = None,
+                  limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """List files in storage from the catalogue, optionally for one owner"""
         files = []
-        
-        if category:
-            search_dirs = [self.base_upload_dir / category]
-        else:
-            search_dirs = [
-                self.base_upload_dir / cat 
-                for cat in ['images', 'documents', 'videos', 'audio', 'archives']
-            ]
-        
-        for directory in search_dirs:
-            if directory.exists():
-                for file_path in directory.iterdir():
-                    if file_path.is_file():
-                        relative_path = file_path.relative_to(self.base_upload_dir)
-                        file_info = self.get_file_info(str(relative_path))
-                        if file_info:
-                            file_info['category'] = directory.name
-                            file_info['path'] = str(relative_path)
-                            files.append(file_info)
+        for record in self.catalog.list(category=category, owner_id=user_id, limit=limit, offset=offset):
+            files.append({
+                "name": Path(record["path"]).name,
+                "original_name": record["name"],
+                "size": record["size"],
+                "modified": record["created_at"],
+                "mime_type": record["mime_type"],
+                "url": self.get_file_url(record["path"]),
+                "category": record["category"],
+                "path": record["path"],
+                "uploaded_by": record["owner_id"],
+                "hash": record["hash"],
+                "fingerprint": record["fingerprint"],
+                "fingerprint_algorithm": record["fingerprint_algorithm"]
+            })
         
         return files
     
@@ -164,32 +357,24 @@ class LocalFileService:
     
     def get_storage_stats(self) -> Dict[str, Any]:
         """Get storage statistics"""
-        stats = {
-            "total_files": 0,
-            "total_size": 0,
-            "categories": {}
-        }
-        
+        stats = self.catalog.stats(deduplicated=self.object_store_enabled)
         for category in ['images', 'documents', 'videos', 'audio', 'archives']:
-            category_dir = self.base_upload_dir / category
-            if category_dir.exists():
-                files = list(category_dir.iterdir())
-                category_files = [f for f in files if f.is_file()]
-                category_size = sum(f.stat().st_size for f in category_files)
-                
-                stats["categories"][category] = {
-                    "file_count": len(category_files),
-                    "size": category_size
-                }
-                
-                stats["total_files"] += len(category_files)
-                stats["total_size"] += category_size
+            stats["categories"].setdefault(category, {"file_count": 0, "size": 0})
         
         return stats
     
+    def reconcile_catalog(self) -> Dict[str, int]:
+        """Repair drift between the catalogue and the files on disk"""
+        return self.catalog.reconcile(
+            self.base_upload_dir,
+            ['images', 'documents', 'videos', 'audio', 'archives'],
+            self._calculate_content_hashes,
+            self.hash_algorithm
+        )
+    
     def _validate_file(self, file: UploadFile):
         """Validate uploaded file"""
-        # Check file size
+        # Reject early when the size is declared; stream_to_temp enforces it regardless
         if file.size and file.size > self.max_file_size:
             raise HTTPException(
                 status_code=413, 
@@ -221,13 +406,15 @@ class LocalFileService:
         
         return "documents"  # Default category
     
-    def _get_file_info(self, file_path: Path, original_name: str, user_id: int) -> Dict[str, Any]:
+    def _get_file_info(self, file_path: Path, original_name: str, user_id: int,
+                       file_hash: Optional[str] = None, fingerprint: Optional[str] = None) -> Dict[str, Any]:
         """Get comprehensive file information"""
         stat = file_path.stat()
         relative_path = file_path.relative_to(self.base_upload_dir)
         
-        # Calculate file hash for deduplication
-        file_hash = self._calculate_file_hash(file_path)
+        # Calculate the hashes for deduplication, unless they were computed while streaming
+        if file_hash is None:
+            file_hash, fingerprint = self._calculate_content_hashes(file_path)
         
         return {
             "name": original_name,
@@ -239,19 +426,40 @@ class LocalFileService:
             "category": file_path.parent.name,
             "uploaded_by": user_id,
             "uploaded_at": datetime.fromtimestamp(stat.st_ctime),
-            "hash": file_hash
+            "hash": file_hash,
+            "fingerprint": fingerprint,
+            "fingerprint_algorithm": self.hash_algorithm
         }
     
+    def _calculate_content_hashes(self, file_path: Path) -> Tuple[str, str]:
+        """Storage hash and fingerprint of a file already on disk, in one read"""
+        hasher = ContentHashes(self.hash_algorithm)
+        try:
+            with open(file_path, "rb", buffering=0) as f:
+                for chunk in self._read_chunks(f):
+                    hasher.update(chunk)
+            return hasher.storage_key, hasher.fingerprint
+        except Exception:
+            return "", ""
+    
     def _calculate_file_hash(self, file_path: Path) -> str:
-        """Calculate MD5 hash of file"""
-        hash_md5 = hashlib.md5()
+        """Calculate the storage hash of a file already on disk"""
+        hasher = hashlib.new(STORAGE_HASH_ALGORITHM)
         try:
-            with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+            with open(file_path, "rb", buffering=0) as f:
+                for chunk in self._read_chunks(f):
+                    hasher.update(chunk)
+            return hasher.hexdigest()
         except Exception:
             return ""
 
 # Global service instance
-file_service = LocalFileService()
\ No newline at end of file
+file_service = LocalFileService()
+
+if __name__ == "__main__":
+    import sys
+    
+    if sys.argv[1:] == ["reconcile"]:
+        print(file_service.reconcile_catalog())
+    else:
+        print("Usage: python file_service.py reconcile")
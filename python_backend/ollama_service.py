@@ -3,17 +3,66 @@ Ollama AI Service for Educational Content Platform
 Replaces OpenAI and Anthropic with local Ollama integration
 """
 
+import os
+import time
+import threading
 import requests
 import json
-from typing import Dict, List, Any, Optional
+from collections import deque
+from typing import Dict, List, Any, Optional, Tuple
 import logging
 
+from services.prompt_budget import PromptBudget, CONTEXT_TOKENS
+from services.circuit_breaker import CircuitBreaker
+from services.json_output import JSONObjectScanner, parse_json_object
+from services.generation_profiles import profile_options, generation_stats
+from services.percentiles import percentile_summary
+from services.british_standards import find_american_spellings
+
 logger = logging.getLogger(__name__)
 
+# Long generations run with timeout=3000 and routinely take many minutes, so they only count
+# towards the breaker's slow-call rate well past what is normal for them.
+# Override with OLLAMA_SLOW_CALL_SECONDS_<TASK>; other tasks use OLLAMA_SLOW_CALL_SECONDS
+TASK_SLOW_CALL_SECONDS = {
+    "lesson": 1200.0,
+    "course_outline": 1200.0,
+    "quiz": 900.0,
+}
+
 class OllamaService:
     def __init__(self, base_url: str = "http://localhost:11434"):
         self.base_url = base_url
         self.model = "llama3.2"  # Default model, can be configured
+        # How long Ollama keeps the model (and its prompt cache) loaded after a request
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        # How often the keep-alive thread checks the model is still loaded
+        self.warmup_interval = int(os.getenv("OLLAMA_WARMUP_INTERVAL", 240))
+        # Whether ensure_keep_alive starts the keep-alive thread in each serving process
+        self.keep_alive_enabled = os.getenv("OLLAMA_KEEP_ALIVE_THREAD", "true").lower() != "false"
+        # A request whose load_duration exceeds this had to load the model first
+        self.cold_load_threshold = 1.0
+        
+        self._model_loaded = False
+        self._loaded_until: Optional[str] = None
+        self._last_warmup: Optional[Dict[str, Any]] = None
+        self._latencies = {"cold": deque(maxlen=200), "warm": deque(maxlen=200)}
+        self._metrics_lock = threading.Lock()
+        self._keep_alive_thread: Optional[threading.Thread] = None
+        self._stop_keep_alive = threading.Event()
+        self._keep_alive_lock = threading.Lock()
+        self.task_slow_call_seconds = {
+            task: float(os.getenv(f"OLLAMA_SLOW_CALL_SECONDS_{task.upper()}", seconds))
+            for task, seconds in TASK_SLOW_CALL_SECONDS.items()
+        }
+        # During an outage, calls fail fast into the fallback generators instead of waiting for timeouts
+        self.breaker = CircuitBreaker(
+            "ollama",
+            failure_rate_threshold=float(os.getenv("OLLAMA_BREAKER_FAILURE_RATE", 0.5)),
+            slow_call_seconds=float(os.getenv("OLLAMA_SLOW_CALL_SECONDS", 180)),
+            open_seconds=float(os.getenv("OLLAMA_BREAKER_OPEN_SECONDS", 30)),
+            health_check=self.is_available
+        )
         
     def is_available(self) -> bool:
         """Check if Ollama service is running"""
@@ -23,6 +72,113 @@ class OllamaService:
         except requests.exceptions.RequestException:
             return False
     
+    def is_model_loaded(self) -> bool:
+        """Ask Ollama (/api/ps) whether the model is resident in memory right now"""
+        try:
+            response = requests.get(f"{self.base_url}/api/ps", timeout=5)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            self._model_loaded = False
+            return False
+        
+        loaded = None
+        for model in response.json().get("models", []):
+            # /api/ps reports tagged names such as "llama3.2:latest"
+            if model.get("name", "").split(":")[0] == self.model.split(":")[0]:
+                loaded = model
+                break
+        self._model_loaded = loaded is not None
+        self._loaded_until = loaded.get("expires_at") if loaded else None
+        return self._model_loaded
+    
+    def warm_up(self) -> Dict[str, Any]:
+        """Load the model with an empty prompt so the next real request starts warm"""
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/generate",
+                # Same num_ctx as the generation profiles, or the first real request reloads the model
+                json={"model": self.model, "keep_alive": self.keep_alive,
+                      "options": {"num_ctx": CONTEXT_TOKENS}},
+                timeout=600
+            )
+            response.raise_for_status()
+            data = response.json()
+            result = {
+                "success": True,
+                "seconds": round(time.perf_counter() - started, 3),
+                "load_seconds": round(data.get("load_duration", 0) / 1e9, 3)
+            }
+            self._model_loaded = True
+        except requests.exceptions.RequestException as e:
+            result = {"success": False, "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+            self._model_loaded = False
+        
+        result["at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self._last_warmup = result
+        if result["success"]:
+            logger.info(f"Ollama model {self.model} warm (load {result['load_seconds']}s)")
+        else:
+            logger.warning(f"Ollama warm-up failed: {result['error']}")
+        return result
+    
+    def _keep_alive_running(self) -> bool:
+        return bool(self._keep_alive_thread and self._keep_alive_thread.is_alive())
+    
+    def start_keep_alive(self):
+        """Warm the model now and re-warm it whenever Ollama has unloaded it (idempotent)"""
+        with self._keep_alive_lock:
+            self.keep_alive_enabled = True
+            # A forked worker inherits the Thread object but not the thread, so this also restarts it there
+            if self._keep_alive_running():
+                return
+            self._stop_keep_alive.clear()
+            
+            def loop():
+                self.warm_up()
+                while not self._stop_keep_alive.wait(self.warmup_interval):
+                    if not self.is_model_loaded():
+                        self.warm_up()
+            
+            self._keep_alive_thread = threading.Thread(target=loop, name="ollama-keep-alive", daemon=True)
+            self._keep_alive_thread.start()
+    
+    def ensure_keep_alive(self):
+        """Start the keep-alive thread once per process unless disabled; cheap enough to call per request"""
+        if self.keep_alive_enabled and not self._keep_alive_running():
+            self.start_keep_alive()
+    
+    def stop_keep_alive(self):
+        self.keep_alive_enabled = False
+        self._stop_keep_alive.set()
+    
+    def _record_latency(self, data: Dict[str, Any], seconds: float):
+        """Classify a finished request as cold or warm from Ollama's reported load time"""
+        load_seconds = data.get("load_duration", 0) / 1e9
+        kind = "cold" if load_seconds > self.cold_load_threshold else "warm"
+        with self._metrics_lock:
+            self._latencies[kind].append(seconds)
+        self._model_loaded = True
+    
+    def get_status(self) -> Dict[str, Any]:
+        """Availability, loaded state and cold vs warm request latency"""
+        available = self.is_available()
+        with self._metrics_lock:
+            # Seconds per request, cold (model loaded first) and warm
+            latency = {kind: {"count": len(samples), **percentile_summary(samples, (0.5, 0.95), digits=3)}
+                       for kind, samples in self._latencies.items()}
+        return {
+            "available": available,
+            "model": self.model,
+            "model_loaded": self.is_model_loaded() if available else False,
+            "loaded_until": self._loaded_until,
+            "keep_alive": self.keep_alive,
+            "keep_alive_running": self._keep_alive_running(),
+            "last_warmup": self._last_warmup,
+            "latency": latency,
+            "circuit": self.breaker.get_state()
+        }
+    
     def generate_content(self, 
                         content_type: str, 
                         qaqf_level: int, 
@@ -38,7 +194,7 @@ class OllamaService:
         )
         
         try:
-            response = self._make_request(prompt)
+            response = self._make_request(prompt, task="lesson")
             return self._parse_content_response(response)
         except Exception as e:
             logger.error(f"Content generation failed: {e}")
@@ -77,7 +233,7 @@ class OllamaService:
         """
         
         try:
-            response = self._make_request(prompt)
+            response = self._make_request(prompt, task="course_outline")
             return self._parse_json_response(response)
         except Exception as e:
             logger.error(f"Course generation failed: {e}")
@@ -86,6 +242,8 @@ class OllamaService:
     def verify_content(self, content: str, qaqf_level: int) -> Dict[str, Any]:
         """Verify content against QAQF standards"""
         
+        budget = PromptBudget("ollama_verification", "verification")
+        content = budget.fit("content", content)
         prompt = f"""
         Analyze the following educational content against QAQF Level {qaqf_level} standards:
         
@@ -115,7 +273,7 @@ class OllamaService:
         """
         
         try:
-            response = self._make_request(prompt)
+            response = self._make_request(budget.finalize(prompt), task="verification")
             return self._parse_json_response(response)
         except Exception as e:
             logger.error(f"Content verification failed: {e}")
@@ -124,13 +282,20 @@ class OllamaService:
     def check_british_standards(self, content: str) -> Dict[str, Any]:
         """Check content compliance with British educational standards"""
         
+        # Spelling is checked locally against the full text; the model only judges the rest
+        spellings = find_american_spellings(content)
+        spelling_issues = [f"American spelling detected: '{finding['word']}' instead of '{finding['suggestion']}'"
+                           for finding in {finding["word"].lower(): finding for finding in spellings}.values()]
+        
+        budget = PromptBudget("ollama_british_standards", "verification")
+        content = budget.fit("content", content)
         prompt = f"""
         Analyze the following content for compliance with British educational standards:
         
         Content: {content}
         
         Check for:
-        1. Use of British English spelling and terminology
+        1. Use of British terminology (spelling is checked separately)
         2. Alignment with UK curriculum standards
         3. Cultural appropriateness for UK context
         4. Accessibility guidelines compliance
@@ -144,30 +309,143 @@ class OllamaService:
         """
         
         try:
-            response = self._make_request(prompt)
-            return self._parse_json_response(response)
+            response = self._make_request(budget.finalize(prompt), task="verification")
+            result = self._parse_json_response(response)
         except Exception as e:
             logger.error(f"British standards check failed: {e}")
-            return {"compliant": True, "issues": [], "suggestions": []}
+            result = {"compliant": True, "issues": [], "suggestions": []}
+        
+        result["issues"] = spelling_issues + list(result.get("issues") or [])
+        result["compliant"] = bool(result.get("compliant", True)) and not spellings
+        result["spellings"] = spellings
+        return result
     
-    def _make_request(self, prompt: str) -> str:
-        """Make request to Ollama API"""
+    def generate(self, prompt: str, options: Optional[Dict[str, Any]] = None, timeout: int = 60,
+                 task: Optional[str] = None) -> str:
+        """Run a raw prompt and return the completion text; raises on API errors.
+
+        With a task, that generation profile supplies the default options.
+        """
         payload = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": False,
+            "keep_alive": self.keep_alive
+        }
+        options = profile_options(task, options) if task else options
+        if options:
+            payload["options"] = options
+        
+        data = self.breaker.call(self._post, "/api/generate", payload, timeout,
+                                 slow_call_seconds=self.task_slow_call_seconds.get(task))
+        self._record_generation(task, data.get("eval_count", 0), options)
+        return data.get("response", "")
+    
+    def chat(self, system: str, user: str, options: Optional[Dict[str, Any]] = None,
+             timeout: int = 60, task: Optional[str] = None) -> str:
+        """Run a system + user message pair through /api/chat and return the reply text.
+
+        Keep the system message byte-identical between calls: Ollama reuses the
+        KV cache for a matching prompt prefix, so only the user part is evaluated.
+        """
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user}
+            ],
+            "stream": False,
+            "keep_alive": self.keep_alive
+        }
+        options = profile_options(task, options) if task else options
+        if options:
+            payload["options"] = options
+        
+        data = self.breaker.call(self._post, "/api/chat", payload, timeout,
+                                 slow_call_seconds=self.task_slow_call_seconds.get(task))
+        self._record_generation(task, data.get("eval_count", 0), options)
+        return data.get("message", {}).get("content", "")
+    
+    def chat_json(self, system: str, user: str, schema: Dict[str, Any],
+                  options: Optional[Dict[str, Any]] = None, timeout: int = 60,
+                  task: str = "verification") -> Dict[str, Any]:
+        """Like chat(), but constrains the reply to a JSON schema and returns it parsed.
+
+        The reply is streamed and the connection closed as soon as the top-level
+        object is complete, so no tokens are generated after the closing brace.
+        Raises ValueError if the reply can't be parsed even after repair.
+        """
+        options = profile_options(task, options)
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user}
+            ],
+            "format": schema,
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": options
         }
         
+        text, eval_count = self.breaker.call(self._post_json_stream, "/api/chat", payload, timeout,
+                                             slow_call_seconds=self.task_slow_call_seconds.get(task))
+        self._record_generation(task, eval_count, options)
+        return parse_json_object(text)
+    
+    def _post_json_stream(self, path: str, payload: Dict[str, Any], timeout: int) -> Tuple[str, int]:
+        """Stream a reply until its JSON object closes (or generation ends).
+
+        Returns the text and the number of tokens generated.
+        """
+        started = time.perf_counter()
+        scanner = JSONObjectScanner()
+        final: Dict[str, Any] = {}
+        chunks = 0
+        with requests.post(f"{self.base_url}{path}", json=payload, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise Exception(f"Ollama API error: {response.status_code}")
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise Exception(f"Ollama API error: {chunk['error']}")
+                piece = chunk.get("message", {}).get("content") or chunk.get("response", "")
+                chunks += bool(piece)
+                # Leaving the block closes the connection, which makes Ollama stop generating
+                if scanner.feed(piece):
+                    break
+                if chunk.get("done"):
+                    final = chunk
+                    break
+        
+        self._record_latency(final, time.perf_counter() - started)
+        # A stream stopped early has no final summary; Ollama streams one token per chunk
+        return scanner.text, final.get("eval_count", chunks)
+    
+    def _record_generation(self, task: Optional[str], eval_count: int, options: Optional[Dict[str, Any]]):
+        generation_stats.record(task or "untagged", eval_count, (options or {}).get("num_predict"))
+    
+    def _post(self, path: str, payload: Dict[str, Any], timeout: int) -> Dict[str, Any]:
+        """POST to Ollama and return the decoded reply, recording its latency"""
+        started = time.perf_counter()
         response = requests.post(
-            f"{self.base_url}/api/generate",
+            f"{self.base_url}{path}",
             json=payload,
-            timeout=60
+            timeout=timeout
         )
         
         if response.status_code != 200:
             raise Exception(f"Ollama API error: {response.status_code}")
         
-        return response.json().get("response", "")
+        data = response.json()
+        self._record_latency(data, time.perf_counter() - started)
+        return data
+    
+    def _make_request(self, prompt: str, task: Optional[str] = None) -> str:
+        """Make request to Ollama API"""
+        return self.generate(prompt, task=task)
     
     def _build_content_prompt(self, content_type: str, qaqf_level: int, 
                              subject: str, characteristics: List[str],
@@ -175,6 +453,10 @@ class OllamaService:
                              source_content: Optional[str] = None) -> str:
         """Build prompt for content generation"""
         
+        budget = PromptBudget("ollama_content", "lesson")
+        additional_instructions = budget.fit("additional_instructions", additional_instructions, strategy="head")
+        source_content = budget.fit("source_content", source_content, strategy="extractive",
+                                    query=f"{subject} {content_type}")
         characteristics_text = ", ".join(characteristics) if characteristics else "clarity, completeness, accuracy"
         
         prompt = f"""
@@ -203,7 +485,7 @@ class OllamaService:
         }}
         """
         
-        return prompt
+        return budget.finalize(prompt)
     
     def _parse_content_response(self, response: str) -> Dict[str, str]:
         """Parse content generation response"""
@@ -239,17 +521,9 @@ class OllamaService:
     def _parse_json_response(self, response: str) -> Dict[str, Any]:
         """Parse JSON response from Ollama"""
         try:
-            # Extract JSON from response
-            start_idx = response.find('{')
-            end_idx = response.rfind('}') + 1
-            
-            if start_idx != -1 and end_idx != -1:
-                json_str = response[start_idx:end_idx]
-                return json.loads(json_str)
-        except json.JSONDecodeError:
-            pass
-        
-        return {}
+            return parse_json_object(response)
+        except ValueError:
+            return {}
     
     def _fallback_content_generation(self, content_type: str, subject: str, qaqf_level: int) -> Dict[str, str]:
         """Fallback content generation when Ollama is unavailable"""
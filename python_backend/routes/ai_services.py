@@ -11,8 +11,9 @@ from schemas import (
     BritishStandardsRequest, BritishStandardsResponse
 )
 from services.ai_service import AIService
+from routes.auth import rate_limited
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limited("ai"))])
 ai_service = AIService()
 
 @router.post("/generate/content", response_model=ContentGenerationResponse)
@@ -2,17 +2,20 @@
 Authentication routes for Educational Content Platform
 Handles login, signup, password reset with user roles (admin/user)
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 import secrets
 import os
+from typing import Optional
 
 from database import get_db
 from models import User
+from services.rate_limiter import rate_limiter
+from services.user_cache import user_cache, UserSnapshot
+from services.password_hashing import password_hasher, PasswordHasherBusy
 from schemas import (
     UserLogin, UserSignup, UserResponse, Token, 
     PasswordReset, PasswordResetConfirm, UserUpdate
@@ -25,16 +28,29 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
-def verify_password(plain_password, hashed_password):
-    """Verify a plaintext password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+def _hashing_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many password checks in progress, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password(plain_password, hashed_password):
+    """Verify a plaintext password against its hash in the hashing pool; returns (valid, new_hash)"""
+    try:
+        return await password_hasher.verify_async(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hashing_busy()
 
-def get_password_hash(password):
-    """Hash a password for storing"""
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    """Hash a password for storing, in the hashing pool"""
+    try:
+        return await password_hasher.hash_async(password)
+    except PasswordHasherBusy:
+        raise _hashing_busy()
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     """Create JWT access token"""
@@ -55,17 +71,26 @@ def get_user_by_email(db: Session, email: str):
     """Get user by email"""
     return db.query(User).filter(User.email == email).first()
 
-def authenticate_user(db: Session, username: str, password: str):
-    """Authenticate user credentials"""
-    user = get_user_by_username(db, username)
-    if not user:
-        return False
-    if not verify_password(password, user.password_hash):
-        return False
-    return user
+async def authenticate_user(db: Session, username: str, password: str):
+    """Authenticate user credentials, upgrading a hash made at an older BCRYPT_ROUNDS"""
+    with password_hasher.login_timer():
+        user = get_user_by_username(db, username)
+        if not user:
+            return False
+        valid, new_hash = await verify_password(password, user.password_hash)
+        if not valid:
+            return False
+        if new_hash:
+            user.password_hash = new_hash
+            db.commit()
+        return user
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Get current authenticated user"""
+    """Get current authenticated user, as a snapshot cached per token for AUTH_CACHE_TTL seconds"""
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -81,7 +106,35 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user = get_user_by_username(db, username=username)
     if user is None:
         raise credentials_exception
-    return user
+    snapshot = UserSnapshot.from_user(user)
+    user_cache.put(token, snapshot, token_expires_at=payload.get("exp"))
+    return snapshot
+
+def rate_limited(policy: str):
+    """Dependency charging each request to the caller's token bucket for policy ("ai" or "crud").
+
+    Callers are keyed on the token's user, or on the client address without one;
+    the token is only decoded here, authentication stays with get_current_user.
+    """
+    async def check_rate_limit(request: Request, response: Response,
+                               token: Optional[str] = Depends(optional_oauth2_scheme)):
+        caller = f"ip:{request.client.host if request.client else 'unknown'}"
+        if token:
+            try:
+                username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+                if username:
+                    caller = f"user:{username}"
+            except JWTError:
+                pass
+        decision = rate_limiter.hit(policy, caller)
+        if not decision.allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please slow down",
+                headers=decision.headers(),
+            )
+        response.headers.update(decision.headers())
+    return check_rate_limit
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     """Get current active user"""
@@ -116,7 +169,7 @@ async def signup(user_data: UserSignup, db: Session = Depends(get_db)):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash(user_data.password)
     db_user = User(
         username=user_data.username,
         email=user_data.email,
@@ -150,7 +203,7 @@ async def signup(user_data: UserSignup, db: Session = Depends(get_db)):
 @router.post("/login", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """User login"""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -178,7 +231,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
 @router.post("/login-json", response_model=Token)
 async def login_json(user_login: UserLogin, db: Session = Depends(get_db)):
     """User login with JSON payload"""
-    user = authenticate_user(db, user_login.username, user_login.password)
+    user = await authenticate_user(db, user_login.username, user_login.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -222,42 +275,51 @@ async def update_user_profile(
     db: Session = Depends(get_db)
 ):
     """Update current user profile"""
+    # current_user is a cached snapshot; changes go through the database row
+    user = db.query(User).filter(User.id == current_user.id).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
     # Check username availability if changing
-    if user_update.username and user_update.username != current_user.username:
+    if user_update.username and user_update.username != user.username:
         if get_user_by_username(db, user_update.username):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already taken"
             )
-        current_user.username = user_update.username
+        user.username = user_update.username
     
     # Check email availability if changing
-    if user_update.email and user_update.email != current_user.email:
+    if user_update.email and user_update.email != user.email:
         if get_user_by_email(db, user_update.email):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already taken"
             )
-        current_user.email = user_update.email
+        user.email = user_update.email
     
     # Update other fields
     if user_update.name is not None:
-        current_user.name = user_update.name
+        user.name = user_update.name
     if user_update.avatar is not None:
-        current_user.avatar = user_update.avatar
+        user.avatar = user_update.avatar
     
-    current_user.updated_at = datetime.utcnow()
+    user.updated_at = datetime.utcnow()
     db.commit()
-    db.refresh(current_user)
+    db.refresh(user)
+    user_cache.invalidate_user(user.id)
     
     return UserResponse(
-        id=current_user.id,
-        username=current_user.username,
-        email=current_user.email,
-        name=current_user.name,
-        role=current_user.role,
-        avatar=current_user.avatar,
-        is_active=current_user.is_active
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        name=user.name,
+        role=user.role,
+        avatar=user.avatar,
+        is_active=user.is_active
     )
 
 @router.post("/forgot-password")
@@ -293,12 +355,13 @@ async def reset_password(reset_data: PasswordResetConfirm, db: Session = Depends
         )
     
     # Update password
-    user.password_hash = get_password_hash(reset_data.new_password)
+    user.password_hash = await get_password_hash(reset_data.new_password)
     user.reset_token = None
     user.reset_token_expires = None
     user.updated_at = datetime.utcnow()
     
     db.commit()
+    user_cache.invalidate_user(user.id)
     
     return {"message": "Password reset successfully"}
 
@@ -347,5 +410,34 @@ async def update_user_role(
     user.role = role
     user.updated_at = datetime.utcnow()
     db.commit()
+    user_cache.invalidate_user(user.id)
+    
+    return {"message": f"User role updated to {role}"}
+
+@router.get("/login-stats")
+async def login_stats(current_user: User = Depends(get_admin_user)):
+    """Login latency percentiles and password hashing pool counters (admin only)"""
+    return password_hasher.get_stats()
+
+@router.put("/users/{user_id}/active")
+async def update_user_active(
+    user_id: int,
+    is_active: bool,
+    current_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Activate or deactivate a user (admin only)"""
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    user.is_active = is_active
+    user.updated_at = datetime.utcnow()
+    db.commit()
+    # Cached snapshots would otherwise keep a deactivated user signed in until they expire
+    user_cache.invalidate_user(user.id)
     
-    return {"message": f"User role updated to {role}"}
\ No newline at end of file
+    return {"message": f"User {'activated' if is_active else 'deactivated'}"}
@@ -8,8 +8,9 @@ from typing import List
 from database import get_db
 from models import Content
 from schemas import Content as ContentSchema, ContentCreate, ContentUpdate
+from routes.auth import rate_limited
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limited("crud"))])
 
 @router.get("/", response_model=List[ContentSchema])
 async def get_contents(db: Session = Depends(get_db)):
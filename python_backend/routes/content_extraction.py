@@ -7,12 +7,27 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 from pydantic import BaseModel, HttpUrl
 import os
-import tempfile
+import time
+import asyncio
 import mimetypes
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from database import get_db
+from file_service import file_service
+from services.ocr_service import ocr_service
 
 router = APIRouter()
 
+# Bounded pool for the blocking extractors (PyPDF2, python-docx, pytesseract)
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", min(4, os.cpu_count() or 1)))
+_extraction_executor = ThreadPoolExecutor(
+    max_workers=EXTRACTION_WORKERS, thread_name_prefix="content-extraction"
+)
+
+# Extracted text keyed by (content hash, extractor), so re-uploads of a known file skip extraction
+EXTRACTION_CACHE_SIZE = 128
+_extraction_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
 class WebsiteExtractionRequest(BaseModel):
     url: HttpUrl
 
@@ -40,54 +55,21 @@ async def extract_content_from_files(
         "processing_errors": []
     }
     
-    for file in files:
-        try:
-            # Validate file size (50MB limit)
-            content = await file.read()
-            file_size_mb = len(content) / (1024 * 1024)
-            
-            if file_size_mb > 50:
-                metadata["processing_errors"].append(f"{file.filename}: File too large (>50MB)")
-                continue
-            
-            metadata["total_size_mb"] += file_size_mb
-            
-            # Determine file type and extract accordingly
-            file_type, _ = mimetypes.guess_type(file.filename)
-            
-            extracted_text = ""
-            processing_method = "unknown"
-            
-            if source_type == "pdf" and file_type == "application/pdf":
-                extracted_text, processing_method = await extract_from_pdf(content, file.filename)
-            elif source_type == "pdf" and file_type in ["application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
-                extracted_text, processing_method = await extract_from_document(content, file.filename)
-            elif source_type == "pdf" and file_type == "text/plain":
-                extracted_text = content.decode('utf-8', errors='ignore')
-                processing_method = "plain_text"
-            elif source_type == "scanned_doc" and file_type and file_type.startswith("image/"):
-                extracted_text, processing_method = await extract_from_image_ocr(content, file.filename)
-            else:
-                # Fallback: try to read as text
-                try:
-                    extracted_text = content.decode('utf-8', errors='ignore')
-                    processing_method = "text_fallback"
-                except:
-                    metadata["processing_errors"].append(f"{file.filename}: Unsupported file type or corrupted")
-                    continue
-            
-            if extracted_text.strip():
-                extracted_texts.append(f"=== {file.filename} ===\n{extracted_text}\n")
-                metadata["files_processed"].append({
-                    "filename": file.filename,
-                    "size_mb": round(file_size_mb, 2),
-                    "type": file_type or "unknown",
-                    "method": processing_method,
-                    "text_length": len(extracted_text)
-                })
-            
-        except Exception as e:
-            metadata["processing_errors"].append(f"{file.filename}: {str(e)}")
+    # Files are processed concurrently; gather keeps results in upload order
+    results = await asyncio.gather(
+        *(process_uploaded_file(file, source_type) for file in files)
+    )
+    
+    for result in results:
+        if result.get("error"):
+            metadata["processing_errors"].append(result["error"])
+            continue
+        
+        metadata["total_size_mb"] += result["size_mb"]
+        
+        if result["text"].strip():
+            extracted_texts.append(f"=== {result['filename']} ===\n{result['text']}\n")
+            metadata["files_processed"].append(result["file_info"])
     
     if not extracted_texts:
         raise HTTPException(status_code=400, detail="No text could be extracted from uploaded files")
@@ -101,6 +83,86 @@ async def extract_content_from_files(
         metadata=metadata
     )
 
+async def process_uploaded_file(file: UploadFile, source_type: str) -> dict:
+    """Spool one upload to disk and extract its text off the event loop"""
+    started = time.perf_counter()
+    temp_path = None
+    try:
+        # Stream to uploads/temp; the 50MB limit aborts the copy as soon as it is exceeded
+        loop = asyncio.get_running_loop()
+        try:
+            temp_path, file_size, file_hash, _ = await loop.run_in_executor(
+                None, file_service.stream_to_temp, file.file, os.path.splitext(file.filename or "")[1].lower()
+            )
+        except HTTPException as e:
+            if e.status_code == 413:
+                return {"error": f"{file.filename}: File too large (>50MB)"}
+            raise
+        file_size_mb = file_size / (1024 * 1024)
+        
+        # Determine file type and extract accordingly
+        file_type, _ = mimetypes.guess_type(file.filename)
+        
+        if source_type == "pdf" and file_type == "application/pdf":
+            extractor = extract_from_pdf
+        elif source_type == "pdf" and file_type in ["application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
+            extractor = extract_from_document
+        elif source_type == "pdf" and file_type == "text/plain":
+            extractor = extract_from_plain_text
+        elif source_type == "scanned_doc" and file_type == "application/pdf":
+            extractor = extract_from_scanned_pdf
+        elif source_type == "scanned_doc" and file_type and file_type.startswith("image/"):
+            extractor = extract_from_image_ocr
+        else:
+            # Fallback: try to read as text
+            extractor = extract_from_text_fallback
+        
+        cache_key = (file_hash, extractor.__name__)
+        cached = _extraction_cache.get(cache_key)
+        if cached:
+            _extraction_cache.move_to_end(cache_key)
+            extracted_text, processing_method = cached
+            details = []
+        else:
+            # OCR extractors return a third element with page throughput stats
+            extracted_text, processing_method, *details = await loop.run_in_executor(
+                _extraction_executor, extractor, temp_path, file.filename
+            )
+            if processing_method not in ("error", "fallback"):
+                _extraction_cache[cache_key] = (extracted_text, processing_method)
+                while len(_extraction_cache) > EXTRACTION_CACHE_SIZE:
+                    _extraction_cache.popitem(last=False)
+        
+        file_info = {
+            "filename": file.filename,
+            "size_mb": round(file_size_mb, 2),
+            "type": file_type or "unknown",
+            "method": processing_method,
+            "text_length": len(extracted_text),
+            "processing_time_ms": round((time.perf_counter() - started) * 1000, 1),
+            "cached": bool(cached)
+        }
+        if details:
+            file_info["ocr"] = details[0]
+        
+        return {
+            "filename": file.filename,
+            "text": extracted_text,
+            "size_mb": file_size_mb,
+            "file_info": file_info
+        }
+    
+    except Exception as e:
+        return {"error": f"{file.filename}: {str(e)}"}
+    finally:
+        if temp_path:
+            temp_path.unlink(missing_ok=True)
+
+@router.get("/extract-content/ocr-stats")
+async def get_ocr_stats():
+    """OCR throughput (pages/sec) and cache usage, for sizing OCR_WORKERS"""
+    return ocr_service.get_stats()
+
 @router.post("/extract-website", response_model=ContentExtractionResponse)
 async def extract_website_content(
     request: WebsiteExtractionRequest,
@@ -123,20 +185,31 @@ async def extract_website_content(
         raise HTTPException(status_code=400, detail=f"Failed to extract website content: {str(e)}")
 
 # Content extraction helper functions
-async def extract_from_pdf(content: bytes, filename: str) -> tuple[str, str]:
-    """Extract text from PDF using PyPDF2 or similar"""
+# These are blocking and run inside _extraction_executor, never on the event loop
+def extract_from_pdf(file_path: str, filename: str) -> tuple:
+    """Extract text from PDF using PyPDF2, switching to OCR when there is (almost) no text layer.
+    
+    Returns (text, method), plus OCR page stats as a third element when OCR was used.
+    """
     try:
         import PyPDF2
-        import io
         
-        pdf_file = io.BytesIO(content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        with open(file_path, "rb") as pdf_file:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            
+            text_content = []
+            for page in pdf_reader.pages:
+                text_content.append(page.extract_text() or "")
         
-        text_content = []
-        for page in pdf_reader.pages:
-            text_content.append(page.extract_text())
+        text = "\n".join(text_content)
+        # Scanned PDFs have no text layer, so route them through OCR
+        if len(text.strip()) < ocr_service.min_text_chars_per_page * len(text_content):
+            ocr_text, method, *details = extract_from_scanned_pdf(file_path, filename)
+            # Without OCR (missing libraries, or a failure) what PyPDF2 found is still better than nothing
+            if method not in ("error", "fallback") and ocr_text.strip():
+                return (ocr_text, method, *details)
         
-        return "\n".join(text_content), "pypdf2"
+        return text, "pypdf2"
     
     except ImportError:
         # Fallback if PyPDF2 not available
@@ -144,13 +217,12 @@ async def extract_from_pdf(content: bytes, filename: str) -> tuple[str, str]:
     except Exception as e:
         return f"Error extracting PDF {filename}: {str(e)}", "error"
 
-async def extract_from_document(content: bytes, filename: str) -> tuple[str, str]:
+def extract_from_document(file_path: str, filename: str) -> tuple[str, str]:
     """Extract text from Word documents"""
     try:
         from docx import Document
-        import io
         
-        doc = Document(io.BytesIO(content))
+        doc = Document(file_path)
         text_content = []
         for paragraph in doc.paragraphs:
             text_content.append(paragraph.text)
@@ -162,23 +234,41 @@ async def extract_from_document(content: bytes, filename: str) -> tuple[str, str
     except Exception as e:
         return f"Error extracting document {filename}: {str(e)}", "error"
 
-async def extract_from_image_ocr(content: bytes, filename: str) -> tuple[str, str]:
+def extract_from_scanned_pdf(file_path: str, filename: str) -> tuple:
+    """Rasterise scanned PDF pages and OCR them in the process pool; (text, method[, OCR stats])"""
+    try:
+        extracted_text, stats = ocr_service.ocr_pdf(file_path)
+        return extracted_text, "pymupdf_tesseract_ocr", stats
+    
+    except ImportError:
+        return f"Scanned PDF content from {filename} (OCR requires PyMuPDF, pytesseract and PIL libraries)", "fallback"
+    except Exception as e:
+        return f"Error performing OCR on {filename}: {str(e)}", "error"
+
+def extract_from_image_ocr(file_path: str, filename: str) -> tuple:
     """Extract text from images using OCR"""
     try:
-        import pytesseract
-        from PIL import Image
-        import io
-        
-        image = Image.open(io.BytesIO(content))
-        extracted_text = pytesseract.image_to_string(image)
-        
-        return extracted_text, "tesseract_ocr"
+        extracted_text, stats = ocr_service.ocr_image_file(file_path)
+        return extracted_text, "tesseract_ocr", stats
     
     except ImportError:
         return f"Image content from {filename} (OCR requires pytesseract and PIL libraries)", "fallback"
     except Exception as e:
         return f"Error performing OCR on {filename}: {str(e)}", "error"
 
+def extract_from_plain_text(file_path: str, filename: str) -> tuple[str, str]:
+    """Read a plain text upload"""
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as text_file:
+        return text_file.read(), "plain_text"
+
+def extract_from_text_fallback(file_path: str, filename: str) -> tuple[str, str]:
+    """Best-effort read of an unrecognised upload as text"""
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as text_file:
+            return text_file.read(), "text_fallback"
+    except Exception:
+        raise Exception("Unsupported file type or corrupted")
+
 async def extract_from_website(url: str) -> tuple[str, dict]:
     """Extract content from website URL"""
     try:
@@ -2,17 +2,18 @@
 Course Generator API Routes
 Production-ready endpoints for course generation with Ollama integration
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from fastapi.responses import JSONResponse
 import asyncio
 import logging
 from services.ai_course_service import enhanced_course_generator, CourseRequest, CourseResponse
+from routes.auth import rate_limited
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limited("ai"))])
 
 @router.post("/generate/course", response_model=CourseResponse)
 async def generate_course(request: CourseRequest):
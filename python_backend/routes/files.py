@@ -3,18 +3,55 @@ File upload and management routes
 Local file storage instead of AWS S3
 """
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Response, status
 from fastapi.responses import FileResponse
+from starlette.datastructures import Headers
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import mimetypes
+import os
 
 from database import get_db
 from models import User
-from routes.auth import get_current_user
+from routes.auth import get_current_user, rate_limited
 from file_service import file_service
+from thumbnail_service import thumbnail_service
 from schemas import UserResponse
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limited("crud"))])
+
+class UploadedFileResponse(FileResponse):
+    """FileResponse that lets the server send whole files itself.
+    
+    When the ASGI server offers the http.response.pathsend extension (Granian
+    does), full-body responses are handed over as a path so the server can
+    sendfile() them without copying through Python. Uvicorn, which this repo
+    ships, does not offer it: there every response, like Range and HEAD
+    requests everywhere, goes through Starlette's streaming, in 1MB chunks
+    rather than the default 64KB.
+    """
+    chunk_size = 1024 * 1024
+    
+    async def __call__(self, scope, receive, send):
+        headers = Headers(scope=scope)
+        if (
+            "http.response.pathsend" in scope.get("extensions", {})
+            and headers.get("range") is None
+            and scope["method"].upper() != "HEAD"
+        ):
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            if self.background is not None:
+                await self.background()
+            return
+        await super().__call__(scope, receive, send)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 9110)"""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
 
 @router.post("/upload", status_code=status.HTTP_201_CREATED)
 async def upload_file(
@@ -27,11 +64,12 @@ async def upload_file(
     try:
         file_info = file_service.upload_file(file, current_user.id, category)
         
-        # Create thumbnail for images
+        # Thumbnails are rendered in the background; poll thumbnail_status_url for the variants
         if file_info["category"] == "images":
-            thumbnail_path = file_service.create_thumbnail(file_info["path"])
-            if thumbnail_path:
-                file_info["thumbnail_url"] = file_service.get_file_url(thumbnail_path)
+            thumbnail_service.schedule(file_info["path"], file_info["hash"])
+            file_info.update(thumbnail_service.status(file_info["hash"]))
+            file_info["thumbnail_status"] = file_info.pop("status")
+            file_info["thumbnail_status_url"] = f"/files/thumbnails/{file_info['hash']}"
         
         return {
             "message": "File uploaded successfully",
@@ -40,6 +78,14 @@ async def upload_file(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/thumbnails/{file_hash}")
+async def get_thumbnails(
+    file_hash: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Thumbnail generation status and variant URLs for an uploaded image"""
+    return thumbnail_service.status(file_hash)
+
 @router.get("/list")
 async def list_files(
     category: Optional[str] = None,
@@ -47,7 +93,9 @@ async def list_files(
     db: Session = Depends(get_db)
 ):
     """List uploaded files"""
-    files = file_service.list_files(category=category)
+    # Admins see every file; other users only their own uploads
+    owner_id = None if current_user.role == "admin" else current_user.id
+    files = file_service.list_files(category=category, user_id=owner_id)
     return {
         "files": files,
         "total": len(files)
@@ -68,6 +116,20 @@ async def get_storage_stats(
     stats = file_service.get_storage_stats()
     return stats
 
+@router.post("/reconcile")
+async def reconcile_catalog(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Resync the file catalogue with the upload directories"""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    
+    return file_service.reconcile_catalog()
+
 @router.delete("/delete/{file_path:path}")
 async def delete_file(
     file_path: str,
@@ -80,15 +142,71 @@ async def delete_file(
         # In a real app, you'd check if the file belongs to the current user
         pass
     
-    success = file_service.delete_file(file_path)
+    full_path = file_service.resolve_public_path(file_path)
+    if full_path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    relative_path = file_service.public_relative_path(full_path)
+    record = file_service.catalog.get(relative_path)
+    
+    success = file_service.delete_file(relative_path)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File not found"
         )
     
+    # Thumbnails are shared by every upload of the same image, so they go with the last one
+    file_hash = record["hash"] if record else None
+    if file_hash and not file_service.catalog.find_by_hash(file_hash):
+        thumbnail_service.remove(file_hash)
+    
     return {"message": "File deleted successfully"}
 
+@router.get("/download/{file_path:path}")
+async def download_file(
+    file_path: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Serve a stored file with Range support and content-hash ETags"""
+    full_path = file_service.resolve_public_path(file_path)
+    if full_path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    # Look up the normalised path: "images/./x.png" must not miss the record and skip the owner check
+    relative_path = file_service.public_relative_path(full_path)
+    record = file_service.catalog.get(relative_path)
+    # Files with no recorded owner (e.g. added by reconcile) are admin-only
+    if current_user.role != "admin" and current_user.id not in file_service.file_owners(relative_path):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this file"
+        )
+    
+    headers = {"Cache-Control": "private, no-cache"}
+    if record and record["hash"]:
+        # Content never changes under a given hash, so the ETag is strong
+        etag = f'"{record["hash"]}"'
+        headers["ETag"] = etag
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    return UploadedFileResponse(
+        full_path,
+        media_type=(record and record["mime_type"]) or mimetypes.guess_type(str(full_path))[0],
+        headers=headers,
+        stat_result=os.stat(full_path),
+        content_disposition_type="inline",
+        filename=(record and record["name"]) or full_path.name
+    )
+
 @router.get("/info/{file_path:path}")
 async def get_file_info(
     file_path: str,
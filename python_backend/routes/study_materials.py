@@ -21,9 +21,9 @@ from schemas import (
     Template as TemplateSchema,
     TemplateCreate, TemplateUpdate
 )
-from routes.auth import get_current_active_user, get_admin_user
+from routes.auth import get_current_active_user, get_admin_user, rate_limited
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limited("crud"))])
 
 # Ensure upload directory exists
 UPLOAD_DIR = "uploads"
@@ -314,6 +314,8 @@ class BritishStandardsResponse(BaseModel):
     compliant: bool
     issues: List[str]
     suggestions: List[str]
+    # American spellings found: word, suggestion and start/end offsets
+    spellings: List[Dict[str, Any]] = []
 
 # Dashboard stats schema
 class DashboardStats(BaseModel):
@@ -10,6 +10,8 @@ import logging
 from typing import Dict, Any, List, Optional
 from pydantic import BaseModel, Field
 
+from services.generation_profiles import profile_options, generation_profiles, generation_stats
+
 logger = logging.getLogger(__name__)
 
 class CourseRequest(BaseModel):
@@ -188,6 +190,7 @@ Return only valid JSON, no additional text."""
                     json={
                         "model": self.ollama_model,
                         "prompt": prompt,
+                        "options": profile_options("course_outline"),
                         "stream": False,
                         "format": "json"
                     }
@@ -195,6 +198,8 @@ Return only valid JSON, no additional text."""
                 
                 if response.status_code == 200:
                     result = response.json()
+                    generation_stats.record("course_outline", result.get("eval_count", 0),
+                                            generation_profiles["course_outline"]["num_predict"])
                     response_text = result.get("response", "")
                     return json.loads(response_text)
                 else:
@@ -4,11 +4,11 @@ Handles OpenAI, Anthropic, and Ollama integrations
 Migrated from TypeScript AI service files
 """
 import os
-from typing import Dict, List, Any
 from openai import OpenAI
 from anthropic import Anthropic
-import json
 from schemas import ContentGenerationRequest, ContentGenerationResponse, VerificationResponse, BritishStandardsResponse
+from services.british_standards import check_british_standards
+from services.qaqf_scoring import score_lesson
 
 class AIService:
     def __init__(self):
@@ -102,27 +102,13 @@ These foundational concepts from the source material are woven throughout the mo
         Verify content against QAQF framework
         Equivalent to verifyContent function in TypeScript backend
         """
-        # Generate realistic scores based on QAQF level
-        base_score = min(70 + (qaqf_level * 3), 95)
-        
-        characteristics = {
-            "Knowledge and understanding": min(max(4, qaqf_level + 1), 10),
-            "Applied knowledge": min(max(4, qaqf_level), 10),
-            "Cognitive skills": min(max(4, qaqf_level + 2), 10),
-            "Communication": min(max(4, qaqf_level), 10),
-            "Autonomy, accountability & working with others": min(max(4, qaqf_level - 1), 10),
-            "Digitalisation & AI": min(max(3, qaqf_level), 10),
-            "Sustainability & ecological": min(max(3, qaqf_level - 1), 10),
-            "Reflective & creative": min(max(4, qaqf_level), 10),
-            "Futuristic/Genius Skills": min(max(3, qaqf_level + 1), 10)
-        }
-        
-        feedback = f"This content demonstrates good alignment with QAQF Level {qaqf_level} requirements. The content structure is well-organized and covers the necessary academic elements. Some areas could be further enhanced, particularly in relation to critical analysis and practical application. Consider adding more examples and case studies to strengthen the connection between theory and practice."
+        # Scored from the text itself: readability, structure, objectives, assessment and keyword coverage
+        result = score_lesson(content, qaqf_level)
         
         return VerificationResponse(
-            score=base_score,
-            feedback=feedback,
-            characteristics=characteristics
+            score=result["score"],
+            feedback=result["feedback"],
+            characteristics=result["characteristics"]
         )
     
     async def check_british_standards(self, content: str) -> BritishStandardsResponse:
@@ -130,41 +116,6 @@ These foundational concepts from the source material are woven throughout the mo
         Check content against British academic standards
         Equivalent to checkBritishStandards function in TypeScript backend
         """
-        # Analyze content for British standards compliance
-        is_compliant = True
-        issues = []
-        suggestions = []
-        
-        # Basic checks for British spelling and formatting
-        if "color" in content and "colour" not in content:
-            is_compliant = False
-            issues.append("American spelling detected: 'color' instead of 'colour'")
-        
-        if "center" in content and "centre" not in content:
-            is_compliant = False
-            issues.append("American spelling detected: 'center' instead of 'centre'")
-        
-        if "learning outcomes" not in content.lower():
-            issues.append("Missing clearly defined learning outcomes")
-        
-        if "assessment" not in content.lower():
-            issues.append("Missing assessment strategy or criteria")
-        
-        # Generate appropriate suggestions
-        if issues:
-            suggestions = [
-                "Review spelling and replace American variants with British English",
-                "Standardize all citations to follow Harvard referencing format consistently",
-                "Ensure all learning outcomes are clearly stated and measurable"
-            ]
-        else:
-            suggestions = [
-                "Consider adding more British academic references to strengthen the content",
-                "Enhance formal academic tone throughout the document"
-            ]
+        result = check_british_standards(content)
         
-        return BritishStandardsResponse(
-            compliant=len(issues) == 0,
-            issues=issues,
-            suggestions=suggestions
-        )
\ No newline at end of file
+        return BritishStandardsResponse(**result)
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+American to British spelling dictionary and matcher
+Generates the US->UK map from word stems and spelling rules and finds American spellings in one pass over the words
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Any, Iterable, Tuple
+
+# -or -> -our (color -> colour). Suffixes are applied to every stem; forms that
+# don't exist are harmless because they never occur in text.
+OUR_STEMS = """
+arbor ardor armor behavior candor clamor color demeanor endeavor favor fervor flavor glamor harbor
+honor humor labor neighbor odor parlor rancor rigor rumor savior savor splendor succor tumor valor vapor vigor
+""".split()
+OUR_SUFFIXES = ["", "s", "ed", "ing", "ful", "fully", "less", "able", "ably", "er", "ers", "al", "ally",
+                "ite", "ites", "itism", "ism", "ist", "ists", "y", "ly", "hood", "hoods", "ings"]
+# Real words whose US and UK forms are the same despite matching the rule
+OUR_EXCEPTIONS = {"humorist", "humorists", "arborist", "arborists", "honorary", "glamorize"}
+
+# -er -> -re (center -> centre)
+RE_STEMS = """
+caliber center centimeter decimeter epicenter fiber goiter kilometer liter luster meager miter
+millimeter nanometer niter ocher reconnoiter saber sepulcher somber specter theater
+""".split()
+RE_VERB_STEMS = {"center", "miter", "reconnoiter", "epicenter"}
+RE_COMPOUNDS = {"centerpiece": "centrepiece", "centerpieces": "centrepieces", "fiberglass": "fibreglass",
+                "centerfold": "centrefold", "centerline": "centreline"}
+
+# -ize -> -ise and -yze -> -yse; British school and university style guides mostly use -ise
+IZE_STEMS = """
+agon apolog author baptiz brutal capital categor central character civil colon commercial computer
+conceptual contextual critic custom democrat demoral dramat econom emphas energ equal external
+familiar fertil final formal fossil general global harmon hospital hypothes ideal immun individual
+industrial internal international ital item jeopard legal legitim liberal local margin material
+maxim memor minim mobil modern monopol moral national natural neutral normal optim organ penal
+personal philosoph polar popular prior privat public rational real recogn revolution romantic
+sanit satir scrutin sensit serial social special stabil standard subsid summar symbol sympath
+synchron synthes terror theor trivial urban util vandal vapor verbal victim visual vocal western
+""".split()
+IZE_SUFFIXES = [("ize", "ise"), ("izes", "ises"), ("ized", "ised"), ("izing", "ising"), ("izer", "iser"),
+                ("izers", "isers"), ("ization", "isation"), ("izations", "isations"),
+                ("izational", "isational")]
+YZE_STEMS = ["anal", "catal", "dial", "electrol", "hydrol", "paral", "psychoanal"]
+YZE_SUFFIXES = [("yze", "yse"), ("yzes", "yses"), ("yzed", "ysed"), ("yzing", "ysing"), ("yzer", "yser"),
+                ("yzers", "ysers")]
+
+# Final l doubled before a suffix in British spelling (traveled -> travelled)
+DOUBLE_L_STEMS = """
+barrel bevel cancel carol channel chisel counsel cudgel dial dishevel duel enamel equal fuel funnel
+gravel grovel initial jewel kennel label level libel marvel model panel pedal pencil pummel quarrel
+ravel rival shovel signal snorkel spiral stencil swivel tassel total towel trammel travel tunnel
+unravel worship yodel
+""".split()
+DOUBLE_L_SUFFIXES = ["ed", "ing", "er", "ers"]
+
+# Families with only a few members, and one-off words
+SINGLE_WORDS = {
+    # -ense -> -ence
+    "defense": "defence", "defenses": "defences", "defenseless": "defenceless",
+    "offense": "offence", "offenses": "offences", "pretense": "pretence", "pretenses": "pretences",
+    # -og -> -ogue
+    "catalog": "catalogue", "catalogs": "catalogues", "cataloged": "catalogued", "cataloging": "cataloguing",
+    "dialog": "dialogue", "dialogs": "dialogues", "analog": "analogue", "analogs": "analogues",
+    "prolog": "prologue", "epilog": "epilogue", "monolog": "monologue", "travelog": "travelogue",
+    # Single l in US spelling
+    "enroll": "enrol", "enrolls": "enrols", "enrollment": "enrolment", "enrollments": "enrolments",
+    "fulfill": "fulfil", "fulfills": "fulfils", "fulfillment": "fulfilment",
+    "instill": "instil", "instills": "instils", "distill": "distil", "distills": "distils",
+    "skillful": "skilful", "skillfully": "skilfully", "willful": "wilful", "willfully": "wilfully",
+    "installment": "instalment", "installments": "instalments", "enthrall": "enthral",
+    "enthralls": "enthrals", "appall": "appal", "appalls": "appals",
+    "marvelous": "marvellous", "marvelously": "marvellously", "jewelry": "jewellery",
+    "woolen": "woollen", "libelous": "libellous", "counselor": "counsellor", "counselors": "counsellors",
+    # ae / oe
+    "pediatric": "paediatric", "pediatrics": "paediatrics", "pediatrician": "paediatrician",
+    "pediatricians": "paediatricians", "anemia": "anaemia", "anemic": "anaemic",
+    "anesthesia": "anaesthesia", "anesthetic": "anaesthetic", "anesthetics": "anaesthetics",
+    "anesthetist": "anaesthetist", "archeology": "archaeology", "archeological": "archaeological",
+    "archeologist": "archaeologist", "archeologists": "archaeologists", "estrogen": "oestrogen",
+    "fetus": "foetus", "fetuses": "foetuses", "fetal": "foetal", "esophagus": "oesophagus",
+    "diarrhea": "diarrhoea", "leukemia": "leukaemia", "hemoglobin": "haemoglobin",
+    "hemorrhage": "haemorrhage", "hematology": "haematology", "orthopedic": "orthopaedic",
+    "orthopedics": "orthopaedics", "encyclopedia": "encyclopaedia", "encyclopedias": "encyclopaedias",
+    "gynecology": "gynaecology", "edema": "oedema", "maneuver": "manoeuvre", "maneuvers": "manoeuvres",
+    "maneuvered": "manoeuvred", "maneuvering": "manoeuvring",
+    # Miscellaneous
+    "gray": "grey", "grays": "greys", "grayed": "greyed", "graying": "greying", "grayish": "greyish",
+    "mold": "mould", "molds": "moulds", "moldy": "mouldy", "molded": "moulded", "molding": "moulding",
+    "plow": "plough", "plows": "ploughs", "plowed": "ploughed", "plowing": "ploughing",
+    "skeptic": "sceptic", "skeptics": "sceptics", "skeptical": "sceptical", "skeptically": "sceptically",
+    "skepticism": "scepticism", "cozy": "cosy", "mustache": "moustache", "pajamas": "pyjamas",
+    "aluminum": "aluminium", "aging": "ageing", "artifact": "artefact", "artifacts": "artefacts",
+    "acknowledgment": "acknowledgement", "acknowledgments": "acknowledgements",
+    "practicing": "practising", "practiced": "practised", "math": "maths", "toward": "towards",
+    "percent": "per cent", "donut": "doughnut", "donuts": "doughnuts", "smolder": "smoulder",
+    "smoldering": "smouldering", "molt": "moult", "airplane": "aeroplane", "airplanes": "aeroplanes",
+    "behoove": "behove", "behooves": "behoves", "tidbit": "titbit", "tidbits": "titbits",
+}
+
+
+def _our_entries() -> Iterable[Tuple[str, str]]:
+    for stem in OUR_STEMS:
+        british = stem[:-2] + "our"
+        for suffix in OUR_SUFFIXES:
+            if stem + suffix not in OUR_EXCEPTIONS:
+                yield stem + suffix, british + suffix
+
+
+def _re_entries() -> Iterable[Tuple[str, str]]:
+    for stem in RE_STEMS:
+        british = stem[:-2] + "re"
+        yield stem, british
+        yield stem + "s", british + "s"
+        if stem in RE_VERB_STEMS:
+            yield stem + "ed", british + "d"
+            yield stem + "ing", stem[:-2] + "ring"
+    yield from RE_COMPOUNDS.items()
+
+
+def _ise_entries() -> Iterable[Tuple[str, str]]:
+    for stem in IZE_STEMS:
+        for american, british in IZE_SUFFIXES:
+            yield stem + american, stem + british
+    for stem in YZE_STEMS:
+        for american, british in YZE_SUFFIXES:
+            yield stem + american, stem + british
+
+
+def _double_l_entries() -> Iterable[Tuple[str, str]]:
+    for stem in DOUBLE_L_STEMS:
+        for suffix in DOUBLE_L_SUFFIXES:
+            yield stem + suffix, stem + "l" + suffix
+
+
+@lru_cache(maxsize=1)
+def spelling_map() -> Dict[str, str]:
+    """The compiled US -> UK spelling map, lower case"""
+    mapping: Dict[str, str] = {}
+    for entries in (_our_entries(), _re_entries(), _ise_entries(), _double_l_entries()):
+        mapping.update(entries)
+    mapping.update(SINGLE_WORDS)
+    return {american: british for american, british in mapping.items() if american != british}
+
+
+# Runs of letters (any script), so "coloré" is not read as "color"
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+
+def _match_case(source: str, replacement: str) -> str:
+    if source.isupper() and len(source) > 1:
+        return replacement.upper()
+    if source[0].isupper():
+        return replacement[0].upper() + replacement[1:]
+    return replacement
+
+
+def find_spellings(text: str) -> List[Dict[str, Any]]:
+    """Every American spelling in text with its position and the British replacement.
+
+    One pass over the words with a hash lookup each. In CPython this beats a
+    trie-shaped regex of the whole dictionary by about 1.5x and a flat
+    alternation by nearly 100x, with no regex to compile
+    (see benchmarks/spelling_benchmark.py).
+    """
+    if not text:
+        return []
+    mapping = spelling_map()
+    # Scan a lower-cased copy so no word needs a lower() of its own. Lower-casing
+    # changes the length of some non-ASCII text, and then offsets would drift,
+    # so such text is scanned as is.
+    lowered = text.lower()
+    lower_each = len(lowered) != len(text)
+    findings = []
+    for match in WORD_PATTERN.finditer(text if lower_each else lowered):
+        british = mapping.get(match.group().lower() if lower_each else match.group())
+        if british is not None:
+            start, end = match.span()
+            word = text[start:end]
+            findings.append({"word": word, "suggestion": _match_case(word, british), "start": start, "end": end})
+    return findings
+
+
+def to_british(text: str) -> str:
+    """text with every American spelling in the map replaced by its British form"""
+    parts = []
+    position = 0
+    for finding in find_spellings(text):
+        parts.append(text[position:finding["start"]])
+        parts.append(finding["suggestion"])
+        position = finding["end"]
+    parts.append((text or "")[position:])
+    return "".join(parts)
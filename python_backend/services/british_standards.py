@@ -0,0 +1,53 @@
+"""
+British academic standards checks
+Deterministic, no-LLM checks for British spelling and required lesson elements
+"""
+
+from collections import Counter
+from typing import Dict, List, Any
+
+from services.british_spelling import find_spellings
+
+# Distinct misspelt words listed as issues; the rest are summarised in one line
+MAX_SPELLING_ISSUES = 20
+
+
+def find_american_spellings(content: str) -> List[Dict[str, Any]]:
+    """American spellings in content, with positions and British suggestions"""
+    return find_spellings(content)
+
+
+def check_british_standards(content: str) -> Dict[str, Any]:
+    """Check content against British academic standards: compliant, issues and suggestions"""
+    issues = []
+    suggestions = []
+
+    # British spelling, from the compiled US -> UK dictionary
+    spellings = find_american_spellings(content)
+    counts = Counter((finding["word"].lower(), finding["suggestion"].lower()) for finding in spellings)
+    for (word, suggestion), count in counts.most_common(MAX_SPELLING_ISSUES):
+        times = f" ({count} times)" if count > 1 else ""
+        issues.append(f"American spelling detected: '{word}' instead of '{suggestion}'{times}")
+    if len(counts) > MAX_SPELLING_ISSUES:
+        issues.append(f"{len(counts) - MAX_SPELLING_ISSUES} more American spellings detected")
+
+    if "learning outcomes" not in content.lower():
+        issues.append("Missing clearly defined learning outcomes")
+
+    if "assessment" not in content.lower():
+        issues.append("Missing assessment strategy or criteria")
+
+    # Generate appropriate suggestions
+    if issues:
+        suggestions = [
+            "Review spelling and replace American variants with British English",
+            "Standardise all citations to follow Harvard referencing format consistently",
+            "Ensure all learning outcomes are clearly stated and measurable"
+        ]
+    else:
+        suggestions = [
+            "Consider adding more British academic references to strengthen the content",
+            "Enhance formal academic tone throughout the document"
+        ]
+
+    return {"compliant": len(issues) == 0, "issues": issues, "suggestions": suggestions, "spellings": spellings}
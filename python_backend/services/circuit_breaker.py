@@ -0,0 +1,190 @@
+"""
+Circuit breaker for calls to external services such as Ollama
+Trips on error rate or slow-call rate so callers fail over to fallbacks immediately during outages
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the service while the circuit is open"""
+
+
+class CircuitBreaker:
+    """Closed -> open when too many recent calls fail or are slow; open -> half-open
+    after open_seconds. With a health check, the first caller in half-open runs it
+    as the trial and a background probe closes the circuit as soon as it passes,
+    so nobody waits behind a long real call; without one, half-open lets one trial
+    call through. Either way success closes the circuit and failure re-opens it.
+    """
+
+    def __init__(self, name: str,
+                 failure_rate_threshold: float = 0.5,
+                 slow_call_seconds: Optional[float] = None,
+                 slow_call_rate_threshold: float = 0.8,
+                 window_size: int = 20,
+                 minimum_calls: int = 5,
+                 open_seconds: float = 30.0,
+                 health_check: Optional[Callable[[], bool]] = None,
+                 probe_interval: float = 5.0):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.health_check = health_check
+        self.probe_interval = probe_interval
+
+        self._outcomes: deque = deque(maxlen=window_size)  # (failed, slow) per call
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def call(self, func: Callable, *args, slow_call_seconds: Optional[float] = None, **kwargs):
+        """Run func through the breaker; raises CircuitOpenError without calling it while open.
+
+        slow_call_seconds overrides the breaker's threshold for this call, for
+        work that is expected to take much longer than the usual call.
+        """
+        self._before_call()
+        if slow_call_seconds is None:
+            slow_call_seconds = self.slow_call_seconds
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self._after_call(failed=True, slow=self._is_slow(started, slow_call_seconds))
+            raise
+        self._after_call(failed=False, slow=self._is_slow(started, slow_call_seconds))
+        return result
+
+    @staticmethod
+    def _is_slow(started: float, slow_call_seconds: Optional[float]) -> bool:
+        return slow_call_seconds is not None and time.perf_counter() - started > slow_call_seconds
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            logger.info(f"Circuit '{self.name}' half-open after {self.open_seconds}s")
+
+    def _before_call(self):
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == OPEN or (self._state == HALF_OPEN and self._trial_in_flight):
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(f"Circuit '{self.name}' is open; failing fast")
+            probe = self._state == HALF_OPEN and self.health_check is not None
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = True
+            if not probe:
+                self._stats["calls"] += 1
+        if probe:
+            self._trial_probe()
+
+    def _healthy(self) -> bool:
+        try:
+            return bool(self.health_check())
+        except Exception:
+            return False
+
+    def _trial_probe(self):
+        """Decide a half-open circuit with the health check, then let the caller's own call run closed"""
+        healthy = self._healthy()
+        with self._lock:
+            self._trial_in_flight = False
+            if not healthy:
+                self._stats["rejected"] += 1
+                self._open()
+                raise CircuitOpenError(f"Circuit '{self.name}' is open; health check failed")
+            self._close("health check passed")
+            self._stats["calls"] += 1
+
+    def _close(self, reason: str):
+        """Close the circuit (caller holds the lock)"""
+        self._state = CLOSED
+        self._outcomes.clear()
+        logger.info(f"Circuit '{self.name}' closed: {reason}")
+
+    def _after_call(self, failed: bool, slow: bool):
+        with self._lock:
+            if failed:
+                self._stats["failures"] += 1
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = False
+                if failed or slow:
+                    self._open()
+                else:
+                    self._close("trial call succeeded")
+                return
+
+            self._outcomes.append((failed, slow))
+            if self._state == CLOSED and len(self._outcomes) >= self.minimum_calls:
+                calls = len(self._outcomes)
+                failure_rate = sum(1 for f, _ in self._outcomes if f) / calls
+                slow_rate = sum(1 for _, s in self._outcomes if s) / calls
+                if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                    logger.warning(f"Circuit '{self.name}' opening: failure rate {failure_rate:.0%}, "
+                                   f"slow rate {slow_rate:.0%} over {calls} calls")
+                    self._open()
+
+    def _open(self):
+        """Trip the breaker (caller holds the lock) and start probing for recovery"""
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._stats["opened"] += 1
+        if self.health_check and not (self._probe_thread and self._probe_thread.is_alive()):
+            self._probe_thread = threading.Thread(target=self._probe, name=f"{self.name}-probe", daemon=True)
+            self._probe_thread.start()
+
+    def _probe(self):
+        """While open, poll the health check so recovery is noticed before open_seconds elapse"""
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                if self._state != OPEN:
+                    return
+            if self._healthy():
+                with self._lock:
+                    if self._state == OPEN:
+                        self._close("health check passed")
+                return
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._outcomes.clear()
+            self._trial_in_flight = False
+
+    def get_state(self) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_half_open()
+            calls = len(self._outcomes)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "window_calls": calls,
+                "window_failure_rate": round(sum(1 for f, _ in self._outcomes if f) / calls, 3) if calls else 0.0,
+                "open_for_seconds": round(time.monotonic() - self._opened_at, 1) if self._state != CLOSED else 0.0,
+                **self._stats
+            }
@@ -10,6 +10,8 @@ from pydantic import BaseModel, Field
 import httpx
 from dotenv import load_dotenv
 
+from services.generation_profiles import profile_options, generation_profiles, generation_stats
+
 load_dotenv()
 
 class CourseRequest(BaseModel):
@@ -148,6 +150,7 @@ Return only valid JSON, no additional text."""
                     json={
                         "model": self.model_name,
                         "prompt": prompt,
+                        "options": profile_options("course_outline"),
                         "format": "json",
                         "stream": False
                     }
@@ -155,6 +158,8 @@ Return only valid JSON, no additional text."""
                 response.raise_for_status()
                 
                 result = response.json()
+                generation_stats.record("course_outline", result.get("eval_count", 0),
+                                        generation_profiles["course_outline"]["num_predict"])
                 
                 # Parse the JSON response from Ollama
                 if "response" in result:
@@ -0,0 +1,100 @@
+"""
+Per-task generation settings for Ollama calls
+Central token caps, stop sequences, temperature and context size per task, plus tokens generated per task
+"""
+
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Any, Optional
+
+from services.prompt_budget import CONTEXT_TOKENS, RESERVED_OUTPUT_TOKENS
+from services.percentiles import percentile_summary
+
+# Keep the model from writing the next "turn" itself when prompted through /api/generate
+TURN_STOPS = ["\nUser:", "\nHuman:", "\n### Instruction"]
+
+# num_ctx is part of how Ollama loads the model: a request with a different value
+# reloads it, so every profile shares one context size unless deliberately overridden.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # Schema-constrained review verdicts: a handful of fields and a short comment
+    "verification": {"num_predict": 400, "temperature": 0.0, "stop": [], "num_ctx": CONTEXT_TOKENS},
+    "moderation": {"num_predict": 400, "temperature": 0.0, "stop": [], "num_ctx": CONTEXT_TOKENS},
+    # Pre-screening answer: one boolean and a one-line reason
+    "triage": {"num_predict": 60, "temperature": 0.0, "stop": [], "num_ctx": CONTEXT_TOKENS},
+    "quiz": {"num_predict": 1500, "temperature": 0.4, "stop": TURN_STOPS, "num_ctx": CONTEXT_TOKENS},
+    "lesson": {"num_predict": RESERVED_OUTPUT_TOKENS, "temperature": 0.7, "stop": TURN_STOPS,
+               "num_ctx": CONTEXT_TOKENS},
+    "course_outline": {"num_predict": 3072, "temperature": 0.5, "stop": TURN_STOPS, "num_ctx": CONTEXT_TOKENS},
+    "summary": {"num_predict": 600, "temperature": 0.2, "stop": TURN_STOPS, "num_ctx": CONTEXT_TOKENS},
+}
+
+# Rolling window of generated token counts per task
+STATS_WINDOW = 1000
+
+
+def _env_override(task: str, option: str, default: Any) -> Any:
+    """OLLAMA_PROFILE_<TASK>_<OPTION>, e.g. OLLAMA_PROFILE_QUIZ_NUM_PREDICT=1200; stops are '|'-separated"""
+    value = os.getenv(f"OLLAMA_PROFILE_{task.upper()}_{option.upper()}")
+    if value is None:
+        return default
+    if option == "stop":
+        return [stop.replace("\\n", "\n") for stop in value.split("|") if stop]
+    if option == "temperature":
+        return float(value)
+    return int(value)
+
+
+def _load_profiles() -> Dict[str, Dict[str, Any]]:
+    return {
+        task: {option: _env_override(task, option, default) for option, default in profile.items()}
+        for task, profile in PROFILES.items()
+    }
+
+
+generation_profiles = _load_profiles()
+
+
+def profile_options(task: str, overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Ollama `options` for a task; per-call overrides win over the profile"""
+    options = dict(generation_profiles.get(task, {}))
+    if not options.get("stop"):
+        options.pop("stop", None)
+    options.update(overrides or {})
+    return options
+
+
+class GenerationStats:
+    """Thread-safe rolling distribution of tokens generated per task"""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._tokens: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"calls": 0, "hit_cap": 0})
+        self._lock = threading.Lock()
+
+    def record(self, task: str, eval_count: int, num_predict: Optional[int] = None):
+        """Record one reply; replies that used the whole num_predict were probably cut off"""
+        with self._lock:
+            self._tokens[task].append(eval_count)
+            self._counts[task]["calls"] += 1
+            self._counts[task]["hit_cap"] += int(bool(num_predict) and eval_count >= num_predict)
+
+    def summary(self) -> Dict[str, Any]:
+        """p50/p90/p99/max generated tokens per task next to its current cap"""
+        with self._lock:
+            tasks = {task: (list(tokens), dict(self._counts[task])) for task, tokens in self._tokens.items()}
+
+        return {
+            "profiles": generation_profiles,
+            "tasks": {
+                task: {
+                    **counts,
+                    "num_predict": generation_profiles.get(task, {}).get("num_predict"),
+                    **percentile_summary(tokens),
+                }
+                for task, (tokens, counts) in tasks.items() if tokens
+            }
+        }
+
+# Global stats instance
+generation_stats = GenerationStats()
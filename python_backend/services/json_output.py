@@ -0,0 +1,187 @@
+"""
+Structured JSON output from Ollama
+Review schemas for format mode, an incremental JSON object scanner and a repair pass for near-valid output
+"""
+
+import re
+import json
+from typing import Dict, Any, Callable, Optional
+
+REVIEW_SCORE_FIELDS = ("clarity", "completeness", "accuracy", "qaqf_alignment")
+
+
+def review_schema(kind: str) -> Dict[str, Any]:
+    """JSON schema of a verification or moderation verdict, passed as Ollama's `format`"""
+    properties: Dict[str, Any] = {
+        f"{kind}_status": {"type": "string", "enum": ["approved", "rejected"]},
+    }
+    for field in REVIEW_SCORE_FIELDS:
+        properties[f"{kind}_{field}"] = {"type": "integer", "minimum": 1, "maximum": 4}
+    properties[f"{kind}_british_standard"] = {"type": "string", "enum": ["yes", "no"]}
+    properties[f"{kind}_comments"] = {"type": "string"}
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+class JSONObjectScanner:
+    """Finds the first complete top-level JSON object in text fed piece by piece.
+
+    Tracks brace depth outside of strings in a single pass, so each character is
+    looked at once however the text is split. `complete` turns true as soon as
+    the object's closing brace arrives, letting the caller stop generation there.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+        self.complete = False
+
+    def feed(self, text: str) -> bool:
+        """Consume more text; returns True once the object is complete"""
+        if self.complete:
+            return True
+        start = 0
+        if not self._started:
+            start = text.find("{")
+            if start < 0:
+                return False
+            self._started = True
+
+        for index in range(start, len(text)):
+            char = text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(text[start:index + 1])
+                    self.complete = True
+                    return True
+        self._parts.append(text[start:])
+        return False
+
+    @property
+    def text(self) -> str:
+        """The object text seen so far (possibly unterminated)"""
+        return "".join(self._parts)
+
+
+# Python literals and typographic quotes small models like to emit
+LITERAL_FIXES = ((re.compile(r"\bTrue\b"), "true"), (re.compile(r"\bFalse\b"), "false"),
+                 (re.compile(r"\bNone\b"), "null"))
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+UNQUOTED_KEY = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)(\s*:)')
+# A double-quoted string, possibly cut off at the end of the text
+STRING_LITERAL = re.compile(r'"(?:[^"\\]|\\.)*"?', re.DOTALL)
+
+
+def _outside_strings(text: str, fix: Callable[[str], str]) -> str:
+    """Apply fix to the text between string literals, leaving the strings' contents alone"""
+    parts = []
+    position = 0
+    for match in STRING_LITERAL.finditer(text):
+        parts.append(fix(text[position:match.start()]))
+        parts.append(match.group())
+        position = match.end()
+    parts.append(fix(text[position:]))
+    return "".join(parts)
+
+
+def _drop_trailing_commas(segment: str) -> str:
+    return TRAILING_COMMA.sub(r"\1", segment)
+
+
+def _fix_syntax(segment: str) -> str:
+    for pattern, replacement in LITERAL_FIXES:
+        segment = pattern.sub(replacement, segment)
+    return _drop_trailing_commas(UNQUOTED_KEY.sub(r'\1"\2"\3', segment))
+
+
+def repair_json(text: str) -> Optional[Dict[str, Any]]:
+    """Best-effort fix of almost-valid JSON: fences, smart quotes, literals,
+    trailing commas, unquoted keys and unterminated strings/objects."""
+    if not text:
+        return None
+    text = text.strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = text[start:]
+    text = text.replace("“", '"').replace("”", '"').replace("’", "'")
+    # Only the JSON syntax gets fixed: a comment saying "True, None: x," must come through as written
+    text = _outside_strings(text, _fix_syntax)
+
+    # Close whatever the model left open when it stopped early
+    scanner = JSONObjectScanner()
+    scanner.feed(text)
+    if not scanner.complete:
+        text = text.rstrip().rstrip(",")
+        if scanner._in_string:
+            text += '"'
+        text += "}" * max(1, scanner._depth)
+        text = _outside_strings(text, _drop_trailing_commas)
+    else:
+        text = scanner.text
+
+    try:
+        result = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return result if isinstance(result, dict) else None
+
+
+def parse_json_object(text: str) -> Dict[str, Any]:
+    """Parse the first JSON object in a model reply, repairing it if needed"""
+    scanner = JSONObjectScanner()
+    scanner.feed(text or "")
+    if scanner.complete:
+        try:
+            result = json.loads(scanner.text)
+            if isinstance(result, dict):
+                return result
+        except json.JSONDecodeError:
+            pass
+    result = repair_json(scanner.text or text)
+    if result is None:
+        raise ValueError("AI response does not contain valid JSON")
+    return result
+
+
+def coerce_to_schema(data: Dict[str, Any], schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalise values to the schema (numeric strings, out-of-range scores, enum case).
+
+    Raises ValueError if a required field is missing.
+    """
+    result = dict(data)
+    for name, spec in schema.get("properties", {}).items():
+        if name not in result:
+            continue
+        value = result[name]
+        if spec.get("type") == "integer":
+            try:
+                value = int(float(value))
+            except (TypeError, ValueError):
+                raise ValueError(f"Field {name} is not a number: {value!r}")
+            value = max(spec.get("minimum", value), min(spec.get("maximum", value), value))
+        elif spec.get("type") == "string":
+            value = "" if value is None else str(value)
+            if "enum" in spec and value.strip().lower() in spec["enum"]:
+                value = value.strip().lower()
+        result[name] = value
+
+    missing = [name for name in schema.get("required", []) if name not in result]
+    if missing:
+        raise ValueError(f"AI response is missing fields: {', '.join(missing)}")
+    return result
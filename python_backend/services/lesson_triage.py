@@ -0,0 +1,160 @@
+"""
+Pre-screening of lessons before full AI verification
+Cheap heuristics plus a tiny triage prompt decide whether the full evaluation is worth running, cached per content hash
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import sqlite3
+from typing import Dict, List, Any
+
+from ollama_service import ollama_service
+from services.british_standards import find_american_spellings
+from services.json_output import REVIEW_SCORE_FIELDS
+from services.prompt_budget import truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# Below this a lesson can't meet any QAQF level, whatever the model says
+TRIAGE_MIN_WORDS = int(os.getenv("TRIAGE_MIN_WORDS", 80))
+# Share of paragraphs that are exact repeats of an earlier one
+TRIAGE_MAX_DUPLICATE_RATIO = 0.5
+# The triage prompt only needs enough of the lesson to see what it is
+TRIAGE_EXCERPT_TOKENS = 600
+
+FULL_REVIEW = "full_review"
+REJECT = "reject"
+
+TRIAGE_SYSTEM_PROMPT = """You screen draft lessons before a detailed QAQF review.
+Answer whether the excerpt is a genuine, coherent lesson worth reviewing in detail.
+It is not if it is placeholder or filler text, gibberish, off-topic, an error message, or obviously unfinished.
+Reply with JSON only."""
+
+TRIAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "worth_review": {"type": "boolean"},
+        "reason": {"type": "string"}
+    },
+    "required": ["worth_review", "reason"]
+}
+
+HEADING_PATTERN = re.compile(r"^\s*(#{1,6}\s+\S|\d+(\.\d+)*[.)]?\s+[A-Z]|[A-Z][^.!?\n]{2,60}:\s*$)", re.MULTILINE)
+LIST_ITEM_PATTERN = re.compile(r"^\s*([-*•]|\d+[.)])\s+\S", re.MULTILINE)
+
+
+def init_triage_table(conn: sqlite3.Connection):
+    """Create the triage cache table"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lesson_triage (
+            content_hash VARCHAR(40) PRIMARY KEY,
+            decision VARCHAR(20) NOT NULL,
+            stage VARCHAR(20) NOT NULL,
+            reasons TEXT NOT NULL,
+            metrics TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def lesson_metrics(content: str) -> Dict[str, Any]:
+    """Structural measurements of a lesson, all computed without the model"""
+    paragraphs = [" ".join(paragraph.split()).lower() for paragraph in re.split(r"\n\s*\n", content)]
+    paragraphs = [paragraph for paragraph in paragraphs if paragraph]
+    duplicates = len(paragraphs) - len(set(paragraphs))
+    return {
+        "words": len(content.split()),
+        "paragraphs": len(paragraphs),
+        "headings": len(HEADING_PATTERN.findall(content)),
+        "list_items": len(LIST_ITEM_PATTERN.findall(content)),
+        "duplicate_paragraph_ratio": round(duplicates / len(paragraphs), 3) if paragraphs else 0.0,
+        "american_spellings": len(find_american_spellings(content)),
+    }
+
+
+def heuristic_screen(metrics: Dict[str, Any]) -> List[str]:
+    """Reasons the lesson can be rejected outright; empty if it passes"""
+    reasons = []
+    if metrics["words"] < TRIAGE_MIN_WORDS:
+        reasons.append(f"Lesson is too short to assess ({metrics['words']} words, minimum {TRIAGE_MIN_WORDS})")
+    if metrics["paragraphs"] > 1 and metrics["duplicate_paragraph_ratio"] > TRIAGE_MAX_DUPLICATE_RATIO:
+        reasons.append(f"{metrics['duplicate_paragraph_ratio']:.0%} of paragraphs are repeated")
+    return reasons
+
+
+def heuristic_concerns(metrics: Dict[str, Any]) -> List[str]:
+    """Signs of a weak lesson that are not enough to reject it; the triage prompt weighs them"""
+    concerns = []
+    # Pasted or plain-text lessons often lose their formatting but can still be genuine
+    if metrics["words"] >= 300 and metrics["headings"] == 0 and metrics["list_items"] == 0 \
+            and metrics["paragraphs"] <= 1:
+        concerns.append("Lesson has no visible structure: no headings, lists or paragraph breaks")
+    return concerns
+
+
+def _triage_call(content: str, metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """Tiny schema-constrained prompt on an excerpt of the lesson"""
+    excerpt = truncate_to_tokens(content, TRIAGE_EXCERPT_TOKENS)
+    user_message = (f"Lesson statistics: {metrics['words']} words, {metrics['headings']} headings, "
+                    f"{metrics['paragraphs']} paragraphs.\n")
+    concerns = heuristic_concerns(metrics)
+    if concerns:
+        user_message += "Automated checks noted: " + "; ".join(concerns) + ".\n"
+    user_message += f'Excerpt:\n"""{excerpt}"""'
+    return ollama_service.chat_json(TRIAGE_SYSTEM_PROMPT, user_message, TRIAGE_SCHEMA, timeout=60, task="triage")
+
+
+def triage_lesson(conn: sqlite3.Connection, content: str) -> Dict[str, Any]:
+    """Decide whether a lesson needs the full evaluation.
+
+    Returns decision (full_review or reject), the stage that decided
+    (heuristic, triage or cache), reasons and the lesson metrics.
+    """
+    content = content or ""
+    content_hash = hashlib.sha1(content.encode("utf-8", "replace")).hexdigest()
+    row = conn.execute(
+        'SELECT decision, stage, reasons, metrics FROM lesson_triage WHERE content_hash = ?', (content_hash,)
+    ).fetchone()
+    if row:
+        return {"decision": row["decision"], "stage": "cache", "decided_by": row["stage"],
+                "reasons": json.loads(row["reasons"]), "metrics": json.loads(row["metrics"])}
+
+    metrics = lesson_metrics(content)
+    reasons = heuristic_screen(metrics)
+    if reasons:
+        result = {"decision": REJECT, "stage": "heuristic", "reasons": reasons, "metrics": metrics}
+    else:
+        try:
+            verdict = _triage_call(content, metrics)
+        except Exception as e:
+            # Without a triage answer the full evaluation decides; not cached so triage is retried
+            logger.warning(f"Lesson triage call failed, running full review: {e}")
+            return {"decision": FULL_REVIEW, "stage": "heuristic", "reasons": [], "metrics": metrics}
+        worth_review = verdict.get("worth_review")
+        if isinstance(worth_review, str):
+            worth_review = worth_review.strip().lower() not in ("false", "no", "0")
+        decision = FULL_REVIEW if worth_review is not False else REJECT
+        reason = str(verdict.get("reason") or "").strip()
+        result = {"decision": decision, "stage": "triage", "reasons": [reason] if reason else [],
+                  "metrics": metrics}
+
+    conn.execute('''
+        INSERT OR REPLACE INTO lesson_triage (content_hash, decision, stage, reasons, metrics)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (content_hash, result["decision"], result["stage"], json.dumps(result["reasons"]), json.dumps(metrics)))
+    conn.commit()
+    return result
+
+
+def rejection_verdict(kind: str, triage: Dict[str, Any]) -> Dict[str, Any]:
+    """A review verdict in the full evaluation's shape for a lesson rejected at triage"""
+    verdict: Dict[str, Any] = {f"{kind}_status": "rejected"}
+    for field in REVIEW_SCORE_FIELDS:
+        verdict[f"{kind}_{field}"] = 1
+    verdict[f"{kind}_british_standard"] = "no" if triage["metrics"].get("american_spellings") else "yes"
+    verdict[f"{kind}_comments"] = "Rejected at pre-screening: " + (
+        "; ".join(triage["reasons"]) or "not a reviewable lesson")
+    return verdict
@@ -0,0 +1,295 @@
+"""
+Near-duplicate detection for generated lessons and study materials
+MinHash signatures computed at insert time, with LSH band buckets in SQLite for sub-linear similarity lookup
+"""
+
+import os
+import re
+import zlib
+import hashlib
+import logging
+import sqlite3
+from typing import Dict, List, Any, Iterable, Optional
+
+import numpy as np
+
+from services.json_output import review_schema
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs above ~0.7 Jaccard almost always share a bucket, pairs below ~0.5 rarely do
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", 0.8))
+# Reusing another lesson's verification needs the texts to be practically identical
+REUSE_VERIFICATION_THRESHOLD = float(os.getenv("REUSE_VERIFICATION_THRESHOLD", 0.95))
+
+# Where each kind of item keeps its text
+SOURCES = {
+    "lesson": {"table": "generatedlesson", "text": "description", "title": "title", "owner": "userid"},
+    "material": {"table": "study_materials", "text": "content", "title": "title", "owner": "created_by_user_id"},
+}
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes; a < 2**31 keeps a * x inside uint64
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(20240601)
+PERM_A = _rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+# Shingles hashed per block, so a whole textbook doesn't need a NUM_PERM x shingles matrix at once
+HASH_BLOCK = 8192
+
+
+def init_near_duplicate_index(conn: sqlite3.Connection):
+    """Create the signature and band tables and cleanup triggers, indexing existing rows if they are new"""
+    is_new = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'minhash_signatures'"
+    ).fetchone() is None
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS minhash_signatures (
+            kind VARCHAR(20) NOT NULL,
+            item_id INTEGER NOT NULL,
+            content_hash VARCHAR(40) NOT NULL,
+            signature BLOB NOT NULL,
+            PRIMARY KEY (kind, item_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS minhash_bands (
+            kind VARCHAR(20) NOT NULL,
+            bucket INTEGER NOT NULL,
+            item_id INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_minhash_bands_bucket ON minhash_bands (kind, bucket)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_minhash_bands_item ON minhash_bands (kind, item_id)')
+    for kind, source in SOURCES.items():
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{source["table"]}_minhash_cleanup
+            AFTER DELETE ON {source["table"]}
+            BEGIN
+                DELETE FROM minhash_signatures WHERE kind = '{kind}' AND item_id = old.id;
+                DELETE FROM minhash_bands WHERE kind = '{kind}' AND item_id = old.id;
+            END;
+        ''')
+    if is_new:
+        backfill(conn)
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """Distinct 32-bit hashes of the overlapping SHINGLE_WORDS-word runs in text.
+
+    Case, punctuation and spacing are ignored, so reformatting a lesson doesn't hide a duplicate.
+    """
+    words = WORD_PATTERN.findall((text or "").lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    word_hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in words), dtype=np.uint64,
+                              count=len(words))
+    width = min(SHINGLE_WORDS, len(words))
+    count = len(words) - width + 1
+    # Polynomial combination of the word hashes in each window (uint64 arithmetic wraps)
+    combined = np.zeros(count, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(width):
+            combined = combined * np.uint64(1_000_003) + word_hashes[offset:offset + count]
+    folded = (combined ^ (combined >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+    return np.unique(folded)
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """NUM_PERM-value MinHash signature of text, or None if it has no words"""
+    hashes = shingle_hashes(text)
+    if not len(hashes):
+        return None
+    signature = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), HASH_BLOCK):
+        block = hashes[start:start + HASH_BLOCK]
+        permuted = (PERM_A[:, None] * block[None, :] + PERM_B[:, None]) % MERSENNE_PRIME
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature
+
+
+def band_buckets(signature: np.ndarray) -> List[int]:
+    """One bucket id per LSH band; items sharing any bucket are duplicate candidates"""
+    rows = signature.reshape(BANDS, ROWS)
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + rows[band].tobytes(), digest_size=8).digest(),
+                       "little", signed=True)
+        for band in range(BANDS)
+    ]
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(first == second))
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+
+
+def index_item(conn: sqlite3.Connection, kind: str, item_id: int, text: Optional[str]) -> bool:
+    """(Re)compute an item's signature if its text changed; returns True if it was (re)indexed"""
+    text = text or ""
+    content_hash = _content_hash(text)
+    row = conn.execute('SELECT content_hash FROM minhash_signatures WHERE kind = ? AND item_id = ?',
+                       (kind, item_id)).fetchone()
+    if row and row[0] == content_hash:
+        return False
+    conn.execute('DELETE FROM minhash_signatures WHERE kind = ? AND item_id = ?', (kind, item_id))
+    conn.execute('DELETE FROM minhash_bands WHERE kind = ? AND item_id = ?', (kind, item_id))
+    signature = minhash(text)
+    if signature is None:
+        return False
+    conn.execute('INSERT INTO minhash_signatures (kind, item_id, content_hash, signature) VALUES (?, ?, ?, ?)',
+                 (kind, item_id, content_hash, signature.tobytes()))
+    conn.executemany('INSERT INTO minhash_bands (kind, bucket, item_id) VALUES (?, ?, ?)',
+                     [(kind, bucket, item_id) for bucket in band_buckets(signature)])
+    return True
+
+
+def backfill(conn: sqlite3.Connection, kinds: Iterable[str] = tuple(SOURCES)) -> int:
+    """Index every item without a signature (rows from before indexing existed); returns how many"""
+    indexed = 0
+    for kind in kinds:
+        source = SOURCES[kind]
+        rows = conn.execute(f'''
+            SELECT id, {source["text"]} AS text FROM {source["table"]}
+            WHERE id NOT IN (SELECT item_id FROM minhash_signatures WHERE kind = ?)
+        ''', (kind,)).fetchall()
+        for row in rows:
+            indexed += index_item(conn, kind, row[0], row[1])
+    if indexed:
+        logger.info(f"Indexed {indexed} items for near-duplicate detection")
+    return indexed
+
+
+def _signatures(conn: sqlite3.Connection, kind: str, item_ids: Iterable[int]) -> Dict[int, np.ndarray]:
+    ids = list(dict.fromkeys(item_ids))
+    if not ids:
+        return {}
+    placeholders = ",".join("?" * len(ids))
+    return {
+        row[0]: np.frombuffer(row[1], dtype=np.uint64)
+        for row in conn.execute(
+            f'SELECT item_id, signature FROM minhash_signatures WHERE kind = ? AND item_id IN ({placeholders})',
+            [kind, *ids]
+        )
+    }
+
+
+def find_similar(conn: sqlite3.Connection, kind: str, text: str, threshold: float = DUPLICATE_THRESHOLD,
+                 exclude_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Items whose text is at least threshold-similar to text, most similar first.
+
+    Only items sharing an LSH bucket are compared, so the cost doesn't grow with the table.
+    """
+    signature = minhash(text)
+    if signature is None:
+        return []
+    buckets = band_buckets(signature)
+    placeholders = ",".join("?" * len(buckets))
+    candidates = [
+        row[0] for row in conn.execute(
+            f'SELECT DISTINCT item_id FROM minhash_bands WHERE kind = ? AND bucket IN ({placeholders})',
+            [kind, *buckets]
+        ) if row[0] != exclude_id
+    ]
+    matches = []
+    for item_id, other in _signatures(conn, kind, candidates).items():
+        score = similarity(signature, other)
+        if score >= threshold:
+            matches.append({"id": item_id, "similarity": round(score, 3)})
+    return sorted(matches, key=lambda match: -match["similarity"])
+
+
+def duplicate_clusters(conn: sqlite3.Connection, kind: str, threshold: float = DUPLICATE_THRESHOLD,
+                       owner_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Groups of near-duplicate items, largest first.
+
+    Candidate pairs come from shared buckets; pairs at or above threshold are
+    joined with union-find, so A~B and B~C put A, B and C in one cluster.
+    """
+    source = SOURCES[kind]
+    owner_filter = f" AND item_id IN (SELECT id FROM {source['table']} WHERE {source['owner']} = ?)" \
+        if owner_id is not None else ""
+    rows = conn.execute(f'SELECT bucket, item_id FROM minhash_bands WHERE kind = ?{owner_filter} ORDER BY bucket',
+                        [kind] + ([owner_id] if owner_id is not None else [])).fetchall()
+    if not rows:
+        return []
+    data = np.array([(row[0], row[1]) for row in rows], dtype=np.int64)
+    buckets, items = data[:, 0], data[:, 1]
+    # Boundaries of runs of equal buckets; only runs of two or more hold candidates
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)]
+    pairs = set()
+    for start, end in zip(starts, ends):
+        if end - start > 1:
+            members = sorted(set(items[start:end].tolist()))
+            pairs.update((a, b) for index, a in enumerate(members) for b in members[index + 1:])
+    if not pairs:
+        return []
+
+    signatures = _signatures(conn, kind, (item for pair in pairs for item in pair))
+    parent: Dict[int, int] = {}
+
+    def find(item: int) -> int:
+        parent.setdefault(item, item)
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    pair_scores = {}
+    for a, b in pairs:
+        if a in signatures and b in signatures:
+            score = similarity(signatures[a], signatures[b])
+            if score >= threshold:
+                pair_scores[(a, b)] = score
+                parent[find(a)] = find(b)
+
+    groups: Dict[int, List[int]] = {}
+    for item in list(parent):
+        groups.setdefault(find(item), []).append(item)
+    clusters = [sorted(members) for members in groups.values() if len(members) > 1]
+    if not clusters:
+        return []
+
+    ids = [item for members in clusters for item in members]
+    placeholders = ",".join("?" * len(ids))
+    titles = {
+        row[0]: row[1] for row in conn.execute(
+            f'SELECT id, {source["title"]} FROM {source["table"]} WHERE id IN ({placeholders})', ids)
+    }
+    result = []
+    for members in clusters:
+        scores = [score for (a, b), score in pair_scores.items() if a in members and b in members]
+        result.append({
+            "size": len(members),
+            "min_similarity": round(min(scores), 3),
+            "items": [{"id": item, "title": titles.get(item)} for item in members],
+        })
+    return sorted(result, key=lambda cluster: (-cluster["size"], -cluster["min_similarity"]))
+
+
+def find_verified_duplicate(conn: sqlite3.Connection, text: str,
+                            threshold: float = REUSE_VERIFICATION_THRESHOLD) -> Optional[Dict[str, Any]]:
+    """The most similar already-verified lesson at or above threshold, with its verification fields"""
+    matches = find_similar(conn, "lesson", text, threshold)
+    if not matches:
+        return None
+    similarities = {match["id"]: match["similarity"] for match in matches}
+    fields = list(review_schema("verification")["properties"])
+    placeholders = ",".join("?" * len(similarities))
+    rows = conn.execute(f'''
+        SELECT id, {", ".join(fields)} FROM generatedlesson
+        WHERE id IN ({placeholders}) AND verification_status IN ('approved', 'rejected')
+    ''', list(similarities)).fetchall()
+    if not rows:
+        return None
+    best = max(rows, key=lambda row: similarities[row[0]])
+    return {"lesson_id": best[0], "similarity": similarities[best[0]],
+            "verdict": dict(zip(fields, best[1:]))}
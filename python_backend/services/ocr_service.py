@@ -0,0 +1,180 @@
+"""
+OCR Service for scanned documents and images
+Rasterises scanned PDF pages with PyMuPDF and runs Tesseract across a process pool, a bounded batch at a time
+"""
+
+import os
+import io
+import time
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _ocr_page_image(image_bytes: bytes) -> str:
+    """Run Tesseract on one page image (executes inside a worker process)"""
+    import pytesseract
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return pytesseract.image_to_string(image)
+
+
+class OCRService:
+    def __init__(self, workers: Optional[int] = None, dpi: int = 200, cache_size: int = 2048):
+        self.workers = workers or int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+        self.dpi = int(os.getenv("OCR_DPI", dpi))
+        self.cache_size = cache_size
+        # Pages with fewer extractable characters than this are treated as scanned
+        self.min_text_chars_per_page = 25
+
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._stats = {"pages": 0, "cache_hits": 0, "ocr_seconds": 0.0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Create the Tesseract process pool on first use"""
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn avoids forking a process that already runs extraction threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def ocr_pdf(self, file_path: str) -> Tuple[str, Dict[str, Any]]:
+        """OCR the pages of a PDF that have no usable text layer.
+
+        Pages are rendered one at a time and submitted as they go; rendering
+        waits once two batches (one page per worker each) are in flight, so
+        only a bounded number of page images is held in memory at once.
+        """
+        import fitz  # PyMuPDF
+
+        started = time.perf_counter()
+        zoom = self.dpi / 72
+        max_in_flight = self.workers * 2
+        page_texts: List[str] = []
+        in_flight: "deque[Tuple[int, str, Future]]" = deque()
+        ocr_pages = cache_hits = 0
+
+        try:
+            with fitz.open(file_path) as pdf:
+                for index, page in enumerate(pdf):
+                    text = page.get_text()
+                    page_texts.append(text)
+                    if len(text.strip()) >= self.min_text_chars_per_page:
+                        continue
+
+                    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+                    image = pixmap.tobytes("png")
+                    image_hash = hashlib.sha256(image).hexdigest()
+                    ocr_pages += 1
+                    cached = self._cache_get(image_hash)
+                    if cached is not None:
+                        page_texts[index] = cached
+                        cache_hits += 1
+                        continue
+
+                    in_flight.append((index, image_hash, self._get_executor().submit(_ocr_page_image, image)))
+                    if len(in_flight) >= max_in_flight:
+                        self._collect(in_flight.popleft(), page_texts)
+
+            while in_flight:
+                self._collect(in_flight.popleft(), page_texts)
+        except BaseException:
+            for _, _, future in in_flight:
+                future.cancel()
+            raise
+
+        stats = self._record(ocr_pages, cache_hits, time.perf_counter() - started)
+        stats["total_pages"] = len(page_texts)
+        return "\n".join(page_texts), stats
+
+    def _collect(self, job: Tuple[int, str, Future], page_texts: List[str]):
+        """Wait for one submitted page and store its text"""
+        index, image_hash, future = job
+        text = future.result()
+        self._cache_put(image_hash, text)
+        page_texts[index] = text
+
+    def ocr_image_file(self, file_path: str) -> Tuple[str, Dict[str, Any]]:
+        """OCR a single image file"""
+        with open(file_path, "rb") as image_file:
+            texts, stats = self.ocr_images([image_file.read()])
+        stats["total_pages"] = 1
+        return texts[0], stats
+
+    def ocr_images(self, images: List[bytes]) -> Tuple[List[str], Dict[str, Any]]:
+        """OCR page images in parallel, reusing cached results by image hash"""
+        started = time.perf_counter()
+        hashes = [hashlib.sha256(image).hexdigest() for image in images]
+        results: List[Optional[str]] = [self._cache_get(image_hash) for image_hash in hashes]
+
+        pending = [index for index, text in enumerate(results) if text is None]
+        if pending:
+            executor = self._get_executor()
+            for index, text in zip(pending, executor.map(_ocr_page_image, [images[i] for i in pending])):
+                results[index] = text
+                self._cache_put(hashes[index], text)
+
+        stats = self._record(len(images), len(images) - len(pending), time.perf_counter() - started)
+        return [text or "" for text in results], stats
+
+    def _record(self, pages: int, cache_hits: int, elapsed: float) -> Dict[str, Any]:
+        """Add one run to the cumulative totals and return its stats"""
+        with self._cache_lock:
+            self._stats["pages"] += pages
+            self._stats["cache_hits"] += cache_hits
+            self._stats["ocr_seconds"] += elapsed
+
+        stats = {
+            "ocr_pages": pages,
+            "cache_hits": cache_hits,
+            "workers": self.workers,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "pages_per_sec": round(pages / elapsed, 2) if elapsed > 0 and pages else 0.0
+        }
+        if pages:
+            logger.info(f"OCR processed {pages} pages ({cache_hits} cached) at {stats['pages_per_sec']} pages/sec")
+        return stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cumulative OCR throughput, used to size the worker pool"""
+        with self._cache_lock:
+            pages = self._stats["pages"]
+            seconds = self._stats["ocr_seconds"]
+            return {
+                "workers": self.workers,
+                "dpi": self.dpi,
+                "pages": pages,
+                "cache_hits": self._stats["cache_hits"],
+                "cached_pages": len(self._cache),
+                "pages_per_sec": round(pages / seconds, 2) if seconds > 0 else 0.0
+            }
+
+    def _cache_get(self, image_hash: str) -> Optional[str]:
+        with self._cache_lock:
+            text = self._cache.get(image_hash)
+            if text is not None:
+                self._cache.move_to_end(image_hash)
+            return text
+
+    def _cache_put(self, image_hash: str, text: str):
+        with self._cache_lock:
+            self._cache[image_hash] = text
+            self._cache.move_to_end(image_hash)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+# Global service instance
+ocr_service = OCRService()
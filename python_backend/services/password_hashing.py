@@ -0,0 +1,144 @@
+"""
+Password hashing off the request thread
+bcrypt runs in a small bounded pool with a configurable cost; hashes made at an old cost are upgraded on login
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple, Union
+
+import bcrypt
+
+from services.percentiles import percentile_summary
+
+logger = logging.getLogger(__name__)
+
+# Each step doubles the work: 12 rounds is ~250 ms of CPU, 10 is ~60 ms
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# bcrypt releases the GIL while hashing, so threads use separate cores without a process pool
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# Hashes allowed to wait for a worker before callers are turned away instead of queueing
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", PASSWORD_HASH_WORKERS * 8))
+LATENCY_WINDOW = 1000
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool's queue is full; callers should answer 503"""
+
+
+def _to_bytes(value: Union[str, bytes]) -> bytes:
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+def hash_rounds(password_hash: Union[str, bytes]) -> Optional[int]:
+    """The cost factor in a bcrypt hash ($2b$12$...), or None if it isn't one"""
+    parts = _to_bytes(password_hash).split(b"$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification in a dedicated thread pool.
+
+    The pool bounds how many CPU-heavy hashes run at once, so a burst of
+    logins can't starve request workers; the queue limit makes the excess
+    fail fast instead of piling up behind it.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, workers: int = PASSWORD_HASH_WORKERS,
+                 queue_size: int = PASSWORD_HASH_QUEUE):
+        self.rounds = rounds
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._login_seconds: deque = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {"hashes": 0, "verifications": 0, "rehashes": 0, "rejected": 0}
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise PasswordHasherBusy("Password hashing queue is full")
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _hash(self, password: str) -> str:
+        with self._lock:
+            self._stats["hashes"] += 1
+        return bcrypt.hashpw(_to_bytes(password), bcrypt.gensalt(self.rounds)).decode("utf-8")
+
+    def _verify(self, password: str, password_hash: Union[str, bytes]) -> Tuple[bool, Optional[str]]:
+        with self._lock:
+            self._stats["verifications"] += 1
+        try:
+            valid = bcrypt.checkpw(_to_bytes(password), _to_bytes(password_hash))
+        except ValueError:
+            # Not a bcrypt hash (e.g. a legacy sha256 hex digest)
+            return False, None
+        if not valid or hash_rounds(password_hash) == self.rounds:
+            return valid, None
+        # The password is at hand only now, so this is the moment to move it to the current cost
+        with self._lock:
+            self._stats["rehashes"] += 1
+        return True, self._hash(password)
+
+    def hash(self, password: str) -> str:
+        """bcrypt hash of password at the configured cost"""
+        return self._submit(self._hash, password).result()
+
+    def verify(self, password: str, password_hash: Union[str, bytes]) -> Tuple[bool, Optional[str]]:
+        """(valid, new_hash): new_hash is set when the stored hash used another cost and should be replaced"""
+        return self._submit(self._verify, password, password_hash).result()
+
+    async def hash_async(self, password: str) -> str:
+        """hash() without blocking the event loop"""
+        return await asyncio.wrap_future(self._submit(self._hash, password))
+
+    async def verify_async(self, password: str, password_hash: Union[str, bytes]) -> Tuple[bool, Optional[str]]:
+        """verify() without blocking the event loop"""
+        return await asyncio.wrap_future(self._submit(self._verify, password, password_hash))
+
+    def record_login(self, seconds: float):
+        with self._lock:
+            self._login_seconds.append(seconds)
+
+    def login_timer(self) -> "_LoginTimer":
+        """Context manager recording a login's duration"""
+        return _LoginTimer(self)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = list(self._login_seconds)
+            stats = dict(self._stats)
+
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            **stats,
+            "login_ms": {"samples": len(samples), **percentile_summary(samples, scale=1000, digits=1)},
+        }
+
+
+class _LoginTimer:
+    def __init__(self, hasher: PasswordHasher):
+        self._hasher = hasher
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hasher.record_login(time.perf_counter() - self._started)
+        return False
+
+
+# Global service instance
+password_hasher = PasswordHasher()
@@ -0,0 +1,31 @@
+"""
+Percentile summaries for the rolling stats windows
+One nearest-rank implementation behind every p50/p90/p99/max reported by the stats endpoints
+"""
+
+from typing import Dict, Any, Iterable, Optional, Sequence, Tuple
+
+
+def percentile(ordered: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted, non-empty samples; fraction 1.0 is the max"""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def percentile_summary(samples: Iterable[float], fractions: Tuple[float, ...] = (0.5, 0.9, 0.99),
+                       scale: float = 1.0, digits: Optional[int] = None) -> Dict[str, Any]:
+    """{"p50": ..., "p90": ..., "p99": ..., "max": ...} for the given fractions.
+
+    Values are multiplied by scale (e.g. 1000 for seconds to ms) and rounded
+    to digits when given; all are None when there are no samples.
+    """
+    ordered = sorted(samples)
+
+    def value(fraction: float) -> Optional[float]:
+        if not ordered:
+            return None
+        result = percentile(ordered, fraction) * scale
+        return round(result, digits) if digits is not None else result
+
+    summary = {f"p{round(fraction * 100)}": value(fraction) for fraction in fractions}
+    summary["max"] = value(1.0)
+    return summary
@@ -0,0 +1,225 @@
+"""
+Prompt assembly with token budgets for Ollama calls
+Estimates prompt tokens, trims oversized sections to fit the context window and records prompt sizes
+"""
+
+import os
+import re
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Dict, List, Any, Optional
+
+from services.percentiles import percentile_summary
+
+logger = logging.getLogger(__name__)
+
+# llama3.2 is run with Ollama's num_ctx; the prompt gets what is left after the reply
+CONTEXT_TOKENS = int(os.getenv("OLLAMA_NUM_CTX", 8192))
+# Output reserve for prompts not tied to a generation profile; profiled ones reserve their num_predict
+RESERVED_OUTPUT_TOKENS = int(os.getenv("PROMPT_RESERVED_OUTPUT_TOKENS", 2048))
+PROMPT_TOKEN_BUDGET = CONTEXT_TOKENS - RESERVED_OUTPUT_TOKENS
+
+# Default caps for the variable parts of prompts; the fixed instructions use the rest
+SECTION_BUDGETS = {
+    "source_content": int(os.getenv("PROMPT_SOURCE_TOKENS", 3000)),
+    "material": int(os.getenv("PROMPT_MATERIAL_TOKENS", 3000)),
+    "content": int(os.getenv("PROMPT_CONTENT_TOKENS", 4000)),
+    "additional_instructions": 400,
+    "user_query": 300,
+}
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+OMISSION_MARKER = "\n[... {tokens} tokens omitted ...]\n"
+
+# Rolling window of prompt sizes per task, for the size distribution endpoint
+STATS_WINDOW = 1000
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Approximate the llama tokenizer: one token per word piece or punctuation mark.
+
+    Long words are split into several sub-word tokens, roughly one per 8 characters.
+    """
+    if not text:
+        return 0
+    return sum(1 + (len(match) - 1) // 8 for match in TOKEN_PATTERN.findall(text))
+
+
+def _cut_at_tokens(text: str, max_tokens: int, from_end: bool = False) -> str:
+    """Cut text to about max_tokens, at a sentence or word boundary"""
+    if max_tokens <= 0:
+        return ""
+    chars_per_token = len(text) / max(1, estimate_tokens(text))
+    limit = int(max_tokens * chars_per_token)
+    if limit >= len(text):
+        return text
+
+    if from_end:
+        piece = text[-limit:]
+        boundary = SENTENCE_BOUNDARY.search(piece)
+        if boundary and boundary.end() < len(piece) // 2:
+            return piece[boundary.end():]
+        return piece.split(None, 1)[-1] if " " in piece else piece
+
+    piece = text[:limit]
+    boundaries = [match.end() for match in SENTENCE_BOUNDARY.finditer(piece)]
+    if boundaries and boundaries[-1] > len(piece) // 2:
+        return piece[:boundaries[-1]].rstrip()
+    return piece.rsplit(None, 1)[0] if " " in piece else piece
+
+
+def truncate_head_tail(text: str, max_tokens: int, head_share: float = 0.7) -> str:
+    """Keep the opening and the ending, which usually carry the framing and conclusions"""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    marker_tokens = estimate_tokens(OMISSION_MARKER.format(tokens=total))
+    available = max(0, max_tokens - marker_tokens)
+    head = _cut_at_tokens(text, int(available * head_share))
+    tail = _cut_at_tokens(text, available - estimate_tokens(head), from_end=True)
+    omitted = total - estimate_tokens(head) - estimate_tokens(tail)
+    return head + OMISSION_MARKER.format(tokens=omitted) + tail
+
+
+def truncate_extractive(text: str, max_tokens: int, query: str) -> str:
+    """Keep the sentences sharing the most words with query, in their original order.
+
+    A cheap extractive summary: no model call, and the kept text is verbatim.
+    """
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    query_terms = {term for term in re.findall(r"\w+", (query or "").lower()) if len(term) > 2}
+    if not query_terms:
+        return truncate_head_tail(text, max_tokens)
+
+    sentences = [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+    scored = []
+    for position, sentence in enumerate(sentences):
+        words = set(re.findall(r"\w+", sentence.lower()))
+        # Earlier sentences win ties (introductions define the topic) and fill any leftover budget
+        scored.append((len(words & query_terms), -position, position, sentence))
+    scored.sort(reverse=True)
+
+    chosen = []
+    used = 0
+    for score, _, position, sentence in scored:
+        tokens = estimate_tokens(sentence) + 1
+        if used + tokens > max_tokens:
+            continue
+        chosen.append(position)
+        used += tokens
+
+    if not chosen:
+        return truncate_head_tail(text, max_tokens)
+    chosen.sort()
+    parts = [sentences[chosen[0]]]
+    for previous, position in zip(chosen, chosen[1:]):
+        parts.append(("" if position == previous + 1 else "… ") + sentences[position])
+    return " ".join(parts)
+
+
+def truncate_to_tokens(text: Optional[str], max_tokens: int, strategy: str = "head_tail",
+                       query: str = "") -> str:
+    """Fit text into max_tokens with the given strategy: head, head_tail or extractive"""
+    if not text:
+        return ""
+    if strategy == "extractive":
+        return truncate_extractive(text, max_tokens, query)
+    if strategy == "head":
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        return _cut_at_tokens(text, max_tokens) + OMISSION_MARKER.format(
+            tokens=estimate_tokens(text) - max_tokens).rstrip()
+    return truncate_head_tail(text, max_tokens)
+
+
+def prompt_token_budget(generation_task: Optional[str] = None) -> int:
+    """Context left for the prompt once the generation task's reply (its num_predict) is reserved"""
+    if not generation_task:
+        return PROMPT_TOKEN_BUDGET
+    # Imported here because generation_profiles builds its profiles from this module's constants
+    from services.generation_profiles import generation_profiles
+    profile = generation_profiles.get(generation_task, {})
+    return profile.get("num_ctx", CONTEXT_TOKENS) - profile.get("num_predict", RESERVED_OUTPUT_TOKENS)
+
+
+class PromptBudget:
+    """Per-prompt budget: fit() each variable section, then finalize() the assembled prompt.
+
+    Sections are capped by their own budget and by what is left of the total
+    prompt budget, so several large inputs can't jointly overflow the context.
+    The total is what generation_task's profile leaves after its num_predict.
+    """
+
+    def __init__(self, task: str, generation_task: Optional[str] = None,
+                 total_tokens: Optional[int] = None, template_tokens: int = 400):
+        self.task = task
+        self.total_tokens = total_tokens if total_tokens is not None else prompt_token_budget(generation_task)
+        self.remaining = self.total_tokens - template_tokens
+        self.truncated: List[str] = []
+
+    def fit(self, section: str, text: Optional[str], max_tokens: Optional[int] = None,
+            strategy: str = "head_tail", query: str = "") -> str:
+        """Return text trimmed to this section's budget"""
+        if not text:
+            return text or ""
+        cap = min(max_tokens or SECTION_BUDGETS.get(section, self.remaining), max(0, self.remaining))
+        original_tokens = estimate_tokens(text)
+        fitted = truncate_to_tokens(text, cap, strategy, query)
+        fitted_tokens = estimate_tokens(fitted) if fitted is not text else original_tokens
+        if fitted is not text:
+            self.truncated.append(section)
+            logger.info(f"[{self.task}] {section} trimmed from {original_tokens} to {fitted_tokens} tokens ({strategy})")
+        self.remaining -= fitted_tokens
+        return fitted
+
+    def finalize(self, prompt: str, system: str = "") -> str:
+        """Record the final prompt size and warn if it still exceeds the budget.
+
+        For chat calls pass the system message too: both count towards the context.
+        """
+        tokens = estimate_tokens(system) + estimate_tokens(prompt)
+        prompt_stats.record(self.task, tokens, bool(self.truncated))
+        if tokens > self.total_tokens:
+            logger.warning(f"[{self.task}] prompt of ~{tokens} tokens exceeds the {self.total_tokens} token budget")
+        else:
+            logger.debug(f"[{self.task}] prompt ~{tokens} tokens")
+        return prompt
+
+
+class PromptStats:
+    """Thread-safe rolling distribution of prompt sizes per task"""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._sizes: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"prompts": 0, "truncated": 0})
+        self._lock = threading.Lock()
+
+    def record(self, task: str, tokens: int, truncated: bool):
+        with self._lock:
+            self._sizes[task].append(tokens)
+            self._counts[task]["prompts"] += 1
+            self._counts[task]["truncated"] += int(truncated)
+
+    def summary(self) -> Dict[str, Any]:
+        """p50/p90/p99/max prompt tokens per task over the recent window"""
+        with self._lock:
+            tasks = {task: (list(sizes), dict(self._counts[task])) for task, sizes in self._sizes.items()}
+
+        return {
+            "budget_tokens": PROMPT_TOKEN_BUDGET,
+            "context_tokens": CONTEXT_TOKENS,
+            "tasks": {
+                task: {
+                    **counts,
+                    **percentile_summary(sizes),
+                }
+                for task, (sizes, counts) in tasks.items() if sizes
+            }
+        }
+
+# Global stats instance
+prompt_stats = PromptStats()
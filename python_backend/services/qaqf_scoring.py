@@ -0,0 +1,293 @@
+"""
+Deterministic QAQF scoring of lesson text
+Readability, vocabulary, structure, objective and assessment features from one tokenisation pass, scored with NumPy in batches
+"""
+
+import re
+import math
+from functools import lru_cache
+from typing import Dict, List, Any, Sequence, Tuple
+
+import numpy as np
+
+# The characteristic names VerificationResponse has always used
+CHARACTERISTICS = [
+    "Knowledge and understanding",
+    "Applied knowledge",
+    "Cognitive skills",
+    "Communication",
+    "Autonomy, accountability & working with others",
+    "Digitalisation & AI",
+    "Sustainability & ecological",
+    "Reflective & creative",
+    "Futuristic/Genius Skills",
+]
+
+# Keyword stems per characteristic; a word counts if it starts with a stem
+CHARACTERISTIC_STEMS = {
+    "Knowledge and understanding": "concept theor principle defin knowledge understand framework model fact terminolog",
+    "Applied knowledge": "appl practi example scenario case real implement exercise workplace industr",
+    "Cognitive skills": "analy evaluat critiq compar contrast synthes argu reason interpret problem",
+    "Communication": "communicat present discuss report writ explain audience debate articulat",
+    "Autonomy, accountability & working with others": "team collaborat group peer independen responsib accountab "
+                                                      "leader ethic",
+    "Digitalisation & AI": "digital artificial ai technolog data online software algorithm automat computer",
+    "Sustainability & ecological": "sustainab environment ecolog climate green carbon renewable biodivers",
+    "Reflective & creative": "reflect creat innovat design imagin original journal insight",
+    "Futuristic/Genius Skills": "future emerging trend foresight transform disrupt visionar entrepreneur",
+}
+# Keyword hits per 1000 words at which a characteristic scores about 8/10
+CHARACTERISTIC_TARGET_DENSITY = 12.0
+
+# Measurable verbs by Bloom's taxonomy level (1 remember ... 6 create)
+BLOOM_STEMS = {
+    1: "defin list recall identif name state recogni memori label",
+    2: "explain describ summari classif discuss interpret outlin paraphras",
+    3: "appl demonstrat use implement solv calculat operat illustrat",
+    4: "analy compar contrast examin differentiat investigat categori distinguish",
+    5: "evaluat justif critiqu assess argu judg apprais defend",
+    6: "creat design develop formulat construct propos synthes compos",
+}
+
+ASSESSMENT_TERMS = ["assessment", "quiz", "exam", "rubric", "criteria", "assignment", "feedback", "formative",
+                    "summative", "grade", "test", "portfolio", "presentation", "project", "marking", "question"]
+
+# Word pairs that announce learning objectives
+OBJECTIVE_BIGRAMS = [("learning", "outcomes"), ("learning", "outcome"), ("learning", "objectives"),
+                     ("learning", "objective"), ("intended", "outcomes"), ("be", "able"), ("learning", "aims")]
+
+# Headings, list items, sentence ends and words, all in one regex
+TOKEN_PATTERN = re.compile(r"^[ \t]*#{1,6}(?=[ \t])|^[ \t]*(?:[-*•]|\d+[.)])(?=[ \t])|[.!?]+(?=\s|$)|[^\W\d_]+",
+                           re.MULTILINE)
+VOWEL_GROUPS = re.compile(r"[aeiouy]+")
+
+# Per-word feature columns
+SYLLABLES, LETTERS, COMPLEX, LONG, BLOOM, BLOOM_VERB = range(6)
+CATEGORY_COLUMNS = 6
+ASSESSMENT_COLUMN = CATEGORY_COLUMNS + len(CHARACTERISTICS)
+WORD_FEATURES = ASSESSMENT_COLUMN + len(ASSESSMENT_TERMS)
+
+
+def _build_stem_index(groups: Dict[Any, str]) -> Dict[str, Any]:
+    return {stem: key for key, stems in groups.items() for stem in stems.split()}
+
+
+CATEGORY_STEMS = _build_stem_index({index: CHARACTERISTIC_STEMS[name] for index, name in enumerate(CHARACTERISTICS)})
+BLOOM_STEM_LEVELS = _build_stem_index(BLOOM_STEMS)
+ASSESSMENT_INDEX = {term: index for index, term in enumerate(ASSESSMENT_TERMS)}
+
+
+def _stem_candidates(word: str) -> List[str]:
+    """Prefixes a stem could match; stems under three letters ("ai") must be the whole word"""
+    return [word[:length] for length in range(3, min(len(word), 13) + 1)] + ([word] if len(word) < 3 else [])
+
+
+def count_syllables(word: str) -> int:
+    """Vowel-group estimate with a silent final e"""
+    count = len(VOWEL_GROUPS.findall(word))
+    if word.endswith("e") and not word.endswith(("le", "ee")) and count > 1:
+        count -= 1
+    return max(1, count)
+
+
+@lru_cache(maxsize=200_000)
+def word_features(word: str) -> Tuple[float, ...]:
+    """Feature row of one lower-case word; cached because vocabularies repeat across lessons"""
+    row = [0.0] * WORD_FEATURES
+    syllables = count_syllables(word)
+    row[SYLLABLES] = syllables
+    row[LETTERS] = len(word)
+    row[COMPLEX] = float(syllables >= 3)
+    row[LONG] = float(len(word) >= 7)
+    for prefix in _stem_candidates(word):
+        level = BLOOM_STEM_LEVELS.get(prefix)
+        if level:
+            row[BLOOM] = level
+            row[BLOOM_VERB] = 1.0
+        category = CATEGORY_STEMS.get(prefix)
+        if category is not None:
+            row[CATEGORY_COLUMNS + category] = 1.0
+    term = ASSESSMENT_INDEX.get(word, ASSESSMENT_INDEX.get(word[:-1]) if word.endswith("s") else None)
+    if term is not None:
+        row[ASSESSMENT_COLUMN + term] = 1.0
+    return tuple(row)
+
+
+def tokenize(text: str) -> List[str]:
+    """The single tokenisation pass: lower-case words plus heading ('#'), list ('-') and sentence ('.') marks"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        first = token.lstrip()[:1]
+        if first.isalpha():
+            tokens.append(token)
+        elif first == "#":
+            tokens.append("#")
+        elif first in ".!?":
+            tokens.append(".")
+        else:
+            tokens.append("-")
+    return tokens
+
+
+def _lesson_features(texts: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Per-lesson totals for a batch, computed from one flat token array"""
+    token_lists = [tokenize(text or "") for text in texts]
+    lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(texts))
+    n = len(texts)
+    all_tokens = [token for tokens in token_lists for token in tokens]
+    lesson_of = np.repeat(np.arange(n), lengths)
+
+    if not all_tokens:
+        zeros = np.zeros(n)
+        return {"words": zeros, "sentences": zeros, "headings": zeros, "list_items": zeros, "unique": zeros,
+                "word_sums": np.zeros((n, WORD_FEATURES)), "objective_phrases": zeros, "objective_items": zeros}
+
+    vocabulary, token_ids = np.unique(np.array(all_tokens, dtype=object), return_inverse=True)
+    token_ids = token_ids.ravel()
+    marks = {mark: np.searchsorted(vocabulary, mark) for mark in ("#", "-", ".")}
+    marks = {mark: index if index < len(vocabulary) and vocabulary[index] == mark else -1
+             for mark, index in marks.items()}
+    is_heading = token_ids == marks["#"]
+    is_item = token_ids == marks["-"]
+    is_end = token_ids == marks["."]
+    is_word = ~(is_heading | is_item | is_end)
+
+    # Feature rows for each distinct token, weighted by how often each lesson uses it. Working on
+    # (lesson, token) pairs keeps memory proportional to vocabulary, not to total text length.
+    size = len(vocabulary)
+    feature_table = np.array([word_features(str(token)) if str(token) not in ("#", "-", ".")
+                              else (0.0,) * WORD_FEATURES for token in vocabulary])
+    pair_keys, pair_counts = np.unique(lesson_of * size + token_ids, return_counts=True)
+    pair_lesson, pair_token = pair_keys // size, pair_keys % size
+    pair_features = feature_table[pair_token]
+    word_sums = np.stack([np.bincount(pair_lesson, weights=pair_features[:, column] * pair_counts, minlength=n)
+                          for column in range(WORD_FEATURES)], axis=1)
+
+    # Distinct words per lesson, for the type-token ratio
+    marks_ids = [index for index in marks.values() if index >= 0]
+    unique = np.bincount(pair_lesson[~np.isin(pair_token, marks_ids)], minlength=n)
+
+    # Consecutive pairs within a lesson: objective phrases, and list items opening with a measurable verb
+    same_lesson = lesson_of[:-1] == lesson_of[1:]
+    index_of = {str(token): position for position, token in enumerate(vocabulary)}
+    bigram_keys = token_ids[:-1] * size + token_ids[1:]
+    phrase_keys = [index_of[first] * size + index_of[second]
+                   for first, second in OBJECTIVE_BIGRAMS if first in index_of and second in index_of]
+    phrase_hits = same_lesson & np.isin(bigram_keys, phrase_keys)
+    item_verbs = same_lesson & is_item[:-1] & (feature_table[token_ids[1:], BLOOM_VERB] > 0)
+
+    return {
+        "words": np.bincount(lesson_of[is_word], minlength=n).astype(float),
+        "sentences": np.bincount(lesson_of[is_end], minlength=n).astype(float),
+        "headings": np.bincount(lesson_of[is_heading], minlength=n).astype(float),
+        "list_items": np.bincount(lesson_of[is_item], minlength=n).astype(float),
+        "unique": unique.astype(float),
+        "word_sums": word_sums,
+        "objective_phrases": np.bincount(lesson_of[:-1][phrase_hits], minlength=n).astype(float),
+        "objective_items": np.bincount(lesson_of[:-1][item_verbs], minlength=n).astype(float),
+    }
+
+
+def score_lessons(texts: Sequence[str], qaqf_levels: Sequence[int]) -> List[Dict[str, Any]]:
+    """Score a batch of lessons: 0-100 score, 1-10 characteristics, feedback and the raw metrics"""
+    if not len(texts):
+        return []
+    features = _lesson_features(texts)
+    levels = np.clip(np.asarray(qaqf_levels, dtype=float), 1, 9)
+    sums = features["word_sums"]
+    words = np.maximum(features["words"], 1)
+    sentences = np.maximum(features["sentences"], 1)
+
+    # Readability indices
+    words_per_sentence = words / sentences
+    syllables_per_word = sums[:, SYLLABLES] / words
+    reading_ease = 206.835 - 1.015 * words_per_sentence - 84.6 * syllables_per_word
+    fk_grade = 0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59
+    fog = 0.4 * (words_per_sentence + 100 * sums[:, COMPLEX] / words)
+    coleman_liau = 0.0588 * (100 * sums[:, LETTERS] / words) - 0.296 * (100 * sentences / words) - 15.8
+
+    # Vocabulary level
+    type_token = features["unique"] / words
+    long_word_share = sums[:, LONG] / words
+    bloom_verbs = sums[:, BLOOM_VERB]
+    bloom_mean = np.where(bloom_verbs > 0, sums[:, BLOOM] / np.maximum(bloom_verbs, 1), 0)
+
+    # Targets rise with the QAQF level: grade 7 text and Bloom level 1 at Level 1, grade 15 and level 6 at Level 9
+    grade_target = 6 + levels
+    bloom_target = 1 + (levels - 1) * 5 / 8
+
+    category_density = sums[:, CATEGORY_COLUMNS:ASSESSMENT_COLUMN] / words[:, None] * 1000
+    assessment_coverage = (sums[:, ASSESSMENT_COLUMN:] > 0).sum(axis=1) / len(ASSESSMENT_TERMS)
+    has_objectives = (features["objective_phrases"] > 0) | (features["objective_items"] >= 2)
+    structure = np.clip(features["headings"] / np.maximum(words / 250, 1), 0, 1) * 0.7 \
+        + np.clip(features["list_items"] / 5, 0, 1) * 0.3
+
+    # Keyword density saturates: the target density gives about 8/10
+    scores = 1 + 9 * (1 - np.exp(-category_density / CHARACTERISTIC_TARGET_DENSITY * 1.6))
+    knowledge, cognitive, communication = 0, 2, 3
+    scores[:, knowledge] = 0.6 * scores[:, knowledge] + 2 * has_objectives + 2 * np.clip(type_token * 2, 0, 1)
+    bloom_fit = np.where(bloom_verbs > 0, 1 - np.clip(np.abs(bloom_mean - bloom_target) / 3, 0, 1), 0)
+    scores[:, cognitive] = 0.5 * scores[:, cognitive] + 5 * bloom_fit
+    readability_fit = 1 - np.clip(np.abs(fk_grade - grade_target) / 6, 0, 1)
+    scores[:, communication] = 0.4 * scores[:, communication] + 4 * readability_fit + 2 * structure
+    # Too little text to judge anything
+    scores[features["words"] < 50] = 1
+    characteristics = np.clip(np.rint(scores), 1, 10).astype(int)
+
+    overall = (0.6 * characteristics.mean(axis=1) * 10 + 15 * structure + 15 * assessment_coverage
+               + 10 * has_objectives)
+    overall = np.clip(np.rint(overall), 0, 100).astype(int)
+
+    results = []
+    for index in range(len(texts)):
+        metrics = {
+            "words": int(features["words"][index]),
+            "sentences": int(features["sentences"][index]),
+            "headings": int(features["headings"][index]),
+            "list_items": int(features["list_items"][index]),
+            "flesch_reading_ease": round(float(reading_ease[index]), 1),
+            "flesch_kincaid_grade": round(float(fk_grade[index]), 1),
+            "gunning_fog": round(float(fog[index]), 1),
+            "coleman_liau": round(float(coleman_liau[index]), 1),
+            "type_token_ratio": round(float(type_token[index]), 3),
+            "long_word_share": round(float(long_word_share[index]), 3),
+            "bloom_level": round(float(bloom_mean[index]), 2),
+            "learning_objectives": bool(has_objectives[index]),
+            "assessment_coverage": round(float(assessment_coverage[index]), 2),
+        }
+        scores_by_name = dict(zip(CHARACTERISTICS, (int(value) for value in characteristics[index])))
+        results.append({
+            "score": int(overall[index]),
+            "characteristics": scores_by_name,
+            "feedback": _feedback(metrics, scores_by_name, int(levels[index]), float(grade_target[index])),
+            "metrics": metrics,
+        })
+    return results
+
+
+def score_lesson(text: str, qaqf_level: int) -> Dict[str, Any]:
+    """Score one lesson; see score_lessons"""
+    return score_lessons([text], [qaqf_level])[0]
+
+
+def _feedback(metrics: Dict[str, Any], characteristics: Dict[str, int], level: int, grade_target: float) -> str:
+    if metrics["words"] < 50:
+        return f"The content is too short ({metrics['words']} words) to meet QAQF Level {level} requirements."
+    ordered = sorted(characteristics.items(), key=lambda item: item[1])
+    weakest = ", ".join(name for name, _ in ordered[:2])
+    parts = [
+        f"Readability is at Flesch-Kincaid grade {metrics['flesch_kincaid_grade']} "
+        f"(around {grade_target:.0f} suits QAQF Level {level}).",
+    ]
+    if ordered[-1][1] > ordered[0][1]:
+        parts.append(f"Strongest characteristic: {ordered[-1][0]}. Areas to strengthen: {weakest}.")
+    if not metrics["learning_objectives"]:
+        parts.append("No learning objectives or outcomes were detected; state them with measurable verbs.")
+    if metrics["headings"] == 0:
+        parts.append("Add headings to divide the content into clear sections.")
+    if metrics["assessment_coverage"] < 0.2:
+        parts.append("Describe how learning will be assessed.")
+    if metrics["bloom_level"] and math.fabs(metrics["bloom_level"] - (1 + (level - 1) * 5 / 8)) > 1.5:
+        direction = "higher" if metrics["bloom_level"] < 1 + (level - 1) * 5 / 8 else "lower"
+        parts.append(f"Task verbs suggest a cognitive level {direction} than Level {level} expects.")
+    return " ".join(parts)
@@ -0,0 +1,218 @@
+"""
+Token-bucket rate limiting per user and per route group
+Keeps one user from monopolising Ollama; buckets live in process or in a shared SQLite file for multi-worker deployments
+"""
+
+import os
+import time
+import math
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RatePolicy:
+    """A bucket holding up to `burst` requests, refilled at `per_minute` requests a minute"""
+    name: str
+    per_minute: float
+    burst: int
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.per_minute / 60.0
+
+
+def _policy(name: str, per_minute: float, burst: int) -> RatePolicy:
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    return RatePolicy(name, float(os.getenv(f"{prefix}_PER_MINUTE", per_minute)),
+                      int(os.getenv(f"{prefix}_BURST", burst)))
+
+
+# Model calls take seconds of GPU time each; CRUD calls are cheap but still worth a ceiling
+POLICIES: Dict[str, RatePolicy] = {
+    "ai": _policy("ai", per_minute=6, burst=5),
+    "crud": _policy("crud", per_minute=120, burst=60),
+}
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "false"
+# Set to a file path to share buckets between worker processes
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB")
+
+
+@dataclass(frozen=True)
+class RateDecision:
+    policy: RatePolicy
+    allowed: bool
+    remaining: int
+    retry_after: float  # seconds until a request would be allowed (0 when allowed)
+    reset_after: float  # seconds until the bucket is full again
+
+    def headers(self) -> Dict[str, str]:
+        """Standard rate-limit response headers"""
+        headers = {
+            "X-RateLimit-Limit": str(self.policy.burst),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+            "X-RateLimit-Policy": f"{self.policy.burst};w=60;r={self.policy.per_minute:g};name={self.policy.name}",
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+def _take(policy: RatePolicy, tokens: float, elapsed: float) -> Tuple[float, bool]:
+    """Refill a bucket for elapsed seconds and try to take one token; returns (tokens left, allowed)"""
+    tokens = min(float(policy.burst), tokens + max(0.0, elapsed) * policy.refill_per_second)
+    if tokens >= 1.0:
+        return tokens - 1.0, True
+    return tokens, False
+
+
+class MemoryBucketStore:
+    """Buckets in a dict; exact within one process"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated at)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, policy: RatePolicy) -> Tuple[float, bool]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(policy.burst), now))
+            tokens, allowed = _take(policy, tokens, now - updated)
+            self._buckets[key] = (tokens, now)
+            # Buckets that have refilled completely carry no state; drop them now and then
+            if len(self._buckets) > 10000:
+                self._prune(now)
+        return tokens, allowed
+
+    def _prune(self, now: float):
+        slowest = min(policy.refill_per_second for policy in POLICIES.values())
+        longest_refill = max(policy.burst for policy in POLICIES.values()) / slowest
+        self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < longest_refill}
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite table shared by every worker; each take is one IMMEDIATE transaction"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode so the explicit BEGIN IMMEDIATE below controls the transaction
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, policy: RatePolicy) -> Tuple[float, bool]:
+        # Wall-clock time, since monotonic clocks aren't comparable between processes
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket_key = ?",
+                               (key,)).fetchone()
+            tokens, updated = row if row else (float(policy.burst), now)
+            tokens, allowed = _take(policy, tokens, now - updated)
+            conn.execute('''
+                INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (bucket_key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+            ''', (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return tokens, allowed
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limit_buckets")
+
+
+class RateLimiter:
+    """Charges requests to per-(policy, caller) token buckets and counts throttled requests"""
+
+    def __init__(self, store=None, enabled: bool = True):
+        self.store = store or MemoryBucketStore()
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {name: {"allowed": 0, "throttled": 0} for name in POLICIES}
+        self._throttled_callers: Counter = Counter()
+
+    def hit(self, policy_name: str, caller: str) -> RateDecision:
+        """Take one request from caller's bucket for the policy"""
+        policy = POLICIES[policy_name]
+        if not self.enabled:
+            return RateDecision(policy, True, policy.burst, 0.0, 0.0)
+        try:
+            tokens, allowed = self.store.take(f"{policy.name}:{caller}", policy)
+        except sqlite3.Error as e:
+            # A locked or unavailable shared store shouldn't take the API down with it
+            logger.warning(f"Rate limit store unavailable, allowing request: {e}")
+            return RateDecision(policy, True, policy.burst, 0.0, 0.0)
+
+        with self._lock:
+            self._stats[policy.name]["allowed" if allowed else "throttled"] += 1
+            if not allowed:
+                self._throttled_callers[f"{policy.name}:{caller}"] += 1
+        rate = policy.refill_per_second
+        return RateDecision(
+            policy=policy,
+            allowed=allowed,
+            remaining=int(tokens),
+            retry_after=0.0 if allowed else (1.0 - tokens) / rate,
+            reset_after=(policy.burst - tokens) / rate,
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "shared": isinstance(self.store, SQLiteBucketStore),
+                "policies": {
+                    name: {"per_minute": policy.per_minute, "burst": policy.burst, **self._stats[name]}
+                    for name, policy in POLICIES.items()
+                },
+                "most_throttled": [{"caller": caller, "throttled": count}
+                                   for caller, count in self._throttled_callers.most_common(10)],
+            }
+
+    def reset(self):
+        self.store.clear()
+        with self._lock:
+            self._stats = {name: {"allowed": 0, "throttled": 0} for name in POLICIES}
+            self._throttled_callers.clear()
+
+
+def _create_store():
+    if RATE_LIMIT_DB:
+        try:
+            return SQLiteBucketStore(RATE_LIMIT_DB)
+        except sqlite3.Error as e:
+            logger.warning(f"Cannot open rate limit database {RATE_LIMIT_DB}, using in-process buckets: {e}")
+    return MemoryBucketStore()
+
+
+# Global service instance
+rate_limiter = RateLimiter(_create_store(), enabled=RATE_LIMIT_ENABLED)
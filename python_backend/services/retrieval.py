@@ -0,0 +1,212 @@
+"""
+Chunk-and-retrieve stage for AI generation from study materials
+Splits material text into overlapping chunks with a BM25 index so prompts carry only the relevant passages
+"""
+
+import os
+import re
+import hashlib
+import sqlite3
+from typing import Dict, List, Any, Iterable, Optional
+
+CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", 200))
+CHUNK_OVERLAP_WORDS = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP_WORDS", 40))
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 6))
+
+# Query words too common to say anything about relevance
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "into", "is", "it",
+    "of", "on", "or", "that", "the", "their", "this", "to", "understand", "use", "using", "what",
+    "when", "which", "with", "will", "students", "learners", "apply", "knowledge", "concepts",
+}
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def init_retrieval_index(conn: sqlite3.Connection):
+    """Create the chunk table, its FTS5 index and the triggers keeping them in step"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS study_material_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            material_id INTEGER NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            source_hash VARCHAR(40) NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_study_material_chunks_material
+        ON study_material_chunks (material_id, chunk_index)
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS study_material_chunks_fts USING fts5(
+            content,
+            content='study_material_chunks',
+            content_rowid='id',
+            tokenize='porter unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_study_material_chunks_insert
+        AFTER INSERT ON study_material_chunks
+        BEGIN
+            INSERT INTO study_material_chunks_fts (rowid, content) VALUES (new.id, new.content);
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_study_material_chunks_delete
+        AFTER DELETE ON study_material_chunks
+        BEGIN
+            INSERT INTO study_material_chunks_fts (study_material_chunks_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_study_materials_chunks_cleanup
+        AFTER DELETE ON study_materials
+        BEGIN
+            DELETE FROM study_material_chunks WHERE material_id = old.id;
+        END;
+    ''')
+
+
+def _source_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+
+
+def chunk_text(text: str, chunk_words: int = CHUNK_WORDS, overlap_words: int = CHUNK_OVERLAP_WORDS) -> List[str]:
+    """Pack whole sentences into ~chunk_words chunks, repeating ~overlap_words between neighbours.
+
+    Sentences longer than a chunk are split on word boundaries.
+    """
+    sentences: List[List[str]] = []
+    for sentence in SENTENCE_BOUNDARY.split(text or ""):
+        words = sentence.split()
+        for start in range(0, len(words), chunk_words):
+            sentences.append(words[start:start + chunk_words])
+
+    chunks: List[str] = []
+    current: List[List[str]] = []
+    current_words = 0
+    for sentence in sentences:
+        if current and current_words + len(sentence) > chunk_words:
+            chunks.append(" ".join(word for part in current for word in part))
+            # Carry trailing sentences forward so an idea split across chunks is still found
+            carried: List[List[str]] = []
+            carried_words = 0
+            for part in reversed(current):
+                if carried_words + len(part) > overlap_words:
+                    break
+                carried.insert(0, part)
+                carried_words += len(part)
+            current, current_words = carried, carried_words
+        current.append(sentence)
+        current_words += len(sentence)
+
+    if current:
+        chunks.append(" ".join(word for part in current for word in part))
+    return chunks
+
+
+def index_material(conn: sqlite3.Connection, material_id: int, text: Optional[str]) -> int:
+    """(Re)chunk one material's text; returns the number of chunks stored"""
+    conn.execute("DELETE FROM study_material_chunks WHERE material_id = ?", (material_id,))
+    if not text or not text.strip():
+        return 0
+    source_hash = _source_hash(text)
+    chunks = chunk_text(text)
+    conn.executemany(
+        "INSERT INTO study_material_chunks (material_id, chunk_index, content, source_hash) VALUES (?, ?, ?, ?)",
+        [(material_id, index, chunk, source_hash) for index, chunk in enumerate(chunks)]
+    )
+    return len(chunks)
+
+
+def ensure_chunks(conn: sqlite3.Connection, material_ids: Iterable[int]) -> Dict[int, str]:
+    """Make sure each material's chunks match its current text; returns {id: title}.
+
+    Materials uploaded before chunking existed, or edited since, are re-chunked here.
+    """
+    ids = list(dict.fromkeys(int(material_id) for material_id in material_ids))
+    if not ids:
+        return {}
+    placeholders = ",".join("?" * len(ids))
+    materials = conn.execute(
+        f"SELECT id, title, content FROM study_materials WHERE id IN ({placeholders})", ids
+    ).fetchall()
+    indexed = {
+        row["material_id"]: row["source_hash"]
+        for row in conn.execute(
+            f"SELECT material_id, source_hash FROM study_material_chunks "
+            f"WHERE chunk_index = 0 AND material_id IN ({placeholders})", ids
+        )
+    }
+
+    changed = False
+    for material in materials:
+        content = material["content"] or ""
+        if content.strip() and indexed.get(material["id"]) != _source_hash(content):
+            index_material(conn, material["id"], content)
+            changed = True
+    if changed:
+        conn.commit()
+    return {material["id"]: material["title"] for material in materials}
+
+
+def _match_query(text: str) -> Optional[str]:
+    """OR together the distinct meaningful query words; BM25 rewards chunks matching more of them"""
+    terms = []
+    for term in re.findall(r"\w+", (text or "").lower()):
+        if len(term) > 2 and term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def retrieve_chunks(conn: sqlite3.Connection, material_ids: Iterable[int], query: str,
+                    top_k: int = TOP_K) -> List[Dict[str, Any]]:
+    """Return the top_k chunks of the given materials most relevant to query.
+
+    Falls back to the opening chunks of each material when nothing matches the
+    query. Results are put back in document order so the excerpts read naturally.
+    """
+    titles = ensure_chunks(conn, material_ids)
+    if not titles:
+        return []
+    ids = list(titles)
+    placeholders = ",".join("?" * len(ids))
+
+    rows = []
+    match_query = _match_query(query)
+    if match_query:
+        rows = conn.execute(f'''
+            SELECT c.material_id, c.chunk_index, c.content, bm25(study_material_chunks_fts) AS score
+            FROM study_material_chunks_fts
+            JOIN study_material_chunks c ON c.id = study_material_chunks_fts.rowid
+            WHERE study_material_chunks_fts MATCH ? AND c.material_id IN ({placeholders})
+            ORDER BY score
+            LIMIT ?
+        ''', [match_query, *ids, top_k]).fetchall()
+
+    if not rows:
+        per_material = max(1, top_k // len(ids))
+        rows = conn.execute(f'''
+            SELECT material_id, chunk_index, content, NULL AS score
+            FROM study_material_chunks
+            WHERE material_id IN ({placeholders}) AND chunk_index < ?
+            ORDER BY chunk_index, material_id
+            LIMIT ?
+        ''', [*ids, per_material, top_k]).fetchall()
+
+    chunks = [dict(row, title=titles[row["material_id"]]) for row in rows]
+    chunks.sort(key=lambda chunk: (ids.index(chunk["material_id"]), chunk["chunk_index"]))
+    return chunks
+
+
+def format_chunks(chunks: List[Dict[str, Any]]) -> str:
+    """Render retrieved chunks as labelled excerpts for a prompt"""
+    return "\n\n".join(
+        f"[{chunk['title']} - excerpt {chunk['chunk_index'] + 1}]\n{chunk['content']}"
+        for chunk in chunks
+    )
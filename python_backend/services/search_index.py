@@ -0,0 +1,235 @@
+"""
+Full-text search over study materials and generated lessons
+SQLite FTS5 external-content indexes kept in sync by triggers, ranked with BM25
+"""
+
+import html
+import re
+import sqlite3
+from typing import Dict, List, Any, Optional
+
+# Column weights for bm25(): a hit in the title counts for more than one in the body
+STUDY_MATERIAL_WEIGHTS = (10.0, 4.0, 1.0)  # title, description, content
+LESSON_WEIGHTS = (10.0, 2.0)  # title, description
+
+SNIPPET_TOKENS = 24
+MAX_RESULTS = 100
+
+# highlight()/snippet() wrap matches in these control characters rather than in markup, so the
+# indexed text can be HTML-escaped before the <mark> tags go in
+MARK_OPEN = "\x02"
+MARK_CLOSE = "\x03"
+
+# Each index mirrors its source table without storing a second copy of the text
+SEARCH_INDEXES = {
+    "study_materials_fts": {
+        "table": "study_materials",
+        "columns": ["title", "description", "content"]
+    },
+    "generatedlesson_fts": {
+        "table": "generatedlesson",
+        "columns": ["title", "description"]
+    }
+}
+
+
+def init_search_index(conn: sqlite3.Connection):
+    """Create the FTS5 indexes and sync triggers, building any new index from existing rows"""
+    for index_name, spec in SEARCH_INDEXES.items():
+        table = spec["table"]
+        columns = ", ".join(spec["columns"])
+        new_values = ", ".join(f"new.{column}" for column in spec["columns"])
+        old_values = ", ".join(f"old.{column}" for column in spec["columns"])
+
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (index_name,)
+        ).fetchone()
+
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {index_name} USING fts5(
+                {columns},
+                content='{table}',
+                content_rowid='id',
+                tokenize='porter unicode61 remove_diacritics 2'
+            )
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{index_name}_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {index_name} (rowid, {columns}) VALUES (new.id, {new_values});
+            END;
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{index_name}_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {index_name} ({index_name}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            END;
+        ''')
+        # Only text changes touch the index; status/score updates and the updateddate triggers don't
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{index_name}_update
+            AFTER UPDATE OF {columns} ON {table}
+            BEGIN
+                INSERT INTO {index_name} ({index_name}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {index_name} (rowid, {columns}) VALUES (new.id, {new_values});
+            END;
+        ''')
+
+        if not exists:
+            conn.execute(f"INSERT INTO {index_name} ({index_name}) VALUES ('rebuild')")
+
+
+def rebuild_search_index(conn: sqlite3.Connection):
+    """Rebuild every index from its source table (e.g. after bulk edits with triggers dropped)"""
+    for index_name in SEARCH_INDEXES:
+        conn.execute(f"INSERT INTO {index_name} ({index_name}) VALUES ('rebuild')")
+    conn.commit()
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """Turn free text into a safe FTS5 query: all words must match, the last one as a prefix.
+
+    Words are quoted so user input can never be parsed as FTS5 syntax.
+    """
+    terms = re.findall(r"\w+", text or "")
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def mark_matches(text: Optional[str]) -> Optional[str]:
+    """HTML-escape highlight()/snippet() output, then turn its markers into <mark> tags"""
+    if text is None:
+        return None
+    return html.escape(text).replace(MARK_OPEN, "<mark>").replace(MARK_CLOSE, "</mark>")
+
+
+def _search_study_materials(conn, match_query, user_id, qaqf_level, material_type, limit):
+    conditions = ["study_materials_fts MATCH ?", "sm.created_by_user_id = ?"]
+    params: List[Any] = [match_query, user_id]
+    if qaqf_level is not None:
+        conditions.append("sm.qaqf_level = ?")
+        params.append(qaqf_level)
+    if material_type:
+        conditions.append("sm.type = ?")
+        params.append(material_type)
+    where = " AND ".join(conditions)
+    total = conn.execute(f'''
+        SELECT COUNT(*) FROM study_materials_fts
+        JOIN study_materials sm ON sm.id = study_materials_fts.rowid
+        WHERE {where}
+    ''', params).fetchone()[0]
+    params.append(limit)
+
+    weights = ", ".join(str(weight) for weight in STUDY_MATERIAL_WEIGHTS)
+    rows = conn.execute(f'''
+        SELECT sm.id, sm.title, sm.type, sm.qaqf_level, sm.created_by_user_id AS owner_id,
+               sm.collectionid, sm.file_name, sm.created_at,
+               bm25(study_materials_fts, {weights}) AS score,
+               highlight(study_materials_fts, 0, '{MARK_OPEN}', '{MARK_CLOSE}') AS title_highlight,
+               snippet(study_materials_fts, -1, '{MARK_OPEN}', '{MARK_CLOSE}', '…', {SNIPPET_TOKENS}) AS snippet
+        FROM study_materials_fts
+        JOIN study_materials sm ON sm.id = study_materials_fts.rowid
+        WHERE {where}
+        ORDER BY score
+        LIMIT ?
+    ''', params).fetchall()
+    return [dict(row, kind="study_material") for row in rows], total
+
+
+def _search_lessons(conn, match_query, owner_id, qaqf_level, lesson_type, limit):
+    conditions = ["generatedlesson_fts MATCH ?"]
+    params: List[Any] = [match_query]
+    if owner_id is not None:
+        conditions.append("gl.userid = ?")
+        params.append(owner_id)
+    if qaqf_level is not None:
+        # Lessons store either the bare level or its label, e.g. "Qaqf Level 6 – Proficient Practitioner"
+        conditions.append("(gl.level = ? OR gl.level LIKE ?)")
+        params.extend([qaqf_level, f"Qaqf Level {qaqf_level} %"])
+    if lesson_type:
+        conditions.append("gl.type = ?")
+        params.append(lesson_type)
+    where = " AND ".join(conditions)
+    total = conn.execute(f'''
+        SELECT COUNT(*) FROM generatedlesson_fts
+        JOIN generatedlesson gl ON gl.id = generatedlesson_fts.rowid
+        WHERE {where}
+    ''', params).fetchone()[0]
+    params.append(limit)
+
+    weights = ", ".join(str(weight) for weight in LESSON_WEIGHTS)
+    rows = conn.execute(f'''
+        SELECT gl.id, gl.title, gl.type, gl.level AS qaqf_level, gl.userid AS owner_id,
+               gl.courseid, gl.status, gl.createddate AS created_at,
+               bm25(generatedlesson_fts, {weights}) AS score,
+               highlight(generatedlesson_fts, 0, '{MARK_OPEN}', '{MARK_CLOSE}') AS title_highlight,
+               snippet(generatedlesson_fts, -1, '{MARK_OPEN}', '{MARK_CLOSE}', '…', {SNIPPET_TOKENS}) AS snippet
+        FROM generatedlesson_fts
+        JOIN generatedlesson gl ON gl.id = generatedlesson_fts.rowid
+        WHERE {where}
+        ORDER BY score
+        LIMIT ?
+    ''', params).fetchall()
+    return [dict(row, kind="lesson") for row in rows], total
+
+
+def search(conn: sqlite3.Connection, text: str, user_id: int, scope: str = "all",
+           qaqf_level: Optional[int] = None, content_type: Optional[str] = None,
+           owner_id: Optional[int] = None, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """Search materials and/or lessons, best match first.
+
+    Study materials are private, so they are always limited to user_id (as in
+    the study materials listing); owner_id narrows lessons to one author.
+    bm25() scores are lower-is-better; they are negated in the response. The
+    two indexes have different columns, weights and corpus statistics, so
+    scores only compare within one kind: with scope "all" each kind is ranked
+    on its own and the two lists are interleaved rank by rank.
+    title_highlight and snippet are HTML: the text is escaped and matches are
+    wrapped in <mark>.
+
+    count is every match across the requested scope, returned the size of
+    this page and totals the matches per kind.
+    """
+    match_query = build_match_query(text)
+    if match_query is None:
+        return {"query": text, "match": None, "count": 0, "returned": 0, "totals": {}, "results": []}
+
+    limit = max(1, min(limit, MAX_RESULTS))
+    offset = max(0, offset)
+    # Each source returns enough rows for the requested page of the merged list
+    window = limit + offset
+
+    ranked: List[List[Dict[str, Any]]] = []
+    totals: Dict[str, int] = {}
+    if scope in ("all", "materials"):
+        rows, totals["study_material"] = _search_study_materials(
+            conn, match_query, user_id, qaqf_level, content_type, window)
+        ranked.append(rows)
+    if scope in ("all", "lessons"):
+        rows, totals["lesson"] = _search_lessons(conn, match_query, owner_id, qaqf_level, content_type, window)
+        ranked.append(rows)
+
+    # Round-robin by rank within each kind: best material, best lesson, second material, ...
+    results = [row for _, _, row in sorted(
+        (position, source, row)
+        for source, rows in enumerate(ranked)
+        for position, row in enumerate(rows)
+    )]
+    page = results[offset:offset + limit]
+    for row in page:
+        row["score"] = round(-row["score"], 4)
+        row["title_highlight"] = mark_matches(row["title_highlight"])
+        row["snippet"] = mark_matches(row["snippet"])
+    return {
+        "query": text,
+        "match": match_query,
+        "count": sum(totals.values()),
+        "returned": len(page),
+        "totals": totals,
+        "results": page
+    }
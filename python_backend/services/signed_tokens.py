@@ -0,0 +1,200 @@
+"""
+HMAC-signed stateless access tokens for the Flask backend
+Tokens carry user id, username, role and expiry, so requests are authorised without a users query
+"""
+
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import logging
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+TOKEN_TTL_SECONDS = int(os.getenv("TOKEN_TTL_SECONDS", 12 * 3600))
+# Every worker must sign with the same key: set TOKEN_SECRET, or they share the generated key file
+TOKEN_SECRET_FILE = os.getenv("TOKEN_SECRET_FILE", "token_secret.key")
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", 30))
+
+
+class InvalidTokenError(Exception):
+    """Raised for a token that is malformed, wrongly signed, expired or revoked"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+@lru_cache(maxsize=1)
+def _signing_key() -> bytes:
+    """The HMAC key, read once per process"""
+    secret = os.getenv("TOKEN_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    try:
+        with open(TOKEN_SECRET_FILE, "rb") as key_file:
+            return key_file.read()
+    except FileNotFoundError:
+        key = secrets.token_bytes(32)
+        # O_EXCL: if another worker created the file first, use its key instead
+        try:
+            fd = os.open(TOKEN_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(TOKEN_SECRET_FILE, "rb") as key_file:
+                return key_file.read()
+        with os.fdopen(fd, "wb") as key_file:
+            key_file.write(key)
+        logger.warning(f"TOKEN_SECRET not set; generated a signing key in {TOKEN_SECRET_FILE}")
+        return key
+
+
+@lru_cache(maxsize=1)
+def _keyed_hmac() -> "hmac.HMAC":
+    """HMAC with the key already absorbed; copy() per token skips re-deriving the key pads"""
+    return hmac.new(_signing_key(), digestmod=hashlib.sha256)
+
+
+def _signature(payload: str) -> str:
+    mac = _keyed_hmac().copy()
+    mac.update(payload.encode("ascii"))
+    return _b64encode(mac.digest())
+
+
+def create_token(user_id: int, username: str, role: str, ttl: int = TOKEN_TTL_SECONDS) -> str:
+    """A signed "<payload>.<signature>" token valid for ttl seconds"""
+    now = int(time.time())
+    claims = {"uid": user_id, "usr": username, "role": role or "user",
+              "iat": now, "exp": now + ttl, "jti": secrets.token_hex(8)}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_signature(payload)}"
+
+
+def verify_token(token: str, is_revoked: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Dict[str, Any]:
+    """The token's claims; raises InvalidTokenError unless it is well-formed, correctly signed, unexpired and not revoked"""
+    payload, _, signature = (token or "").partition(".")
+    # Real tokens are base64url ASCII; anything else would break the HMAC and compare_digest below
+    if not payload or not signature or not token.isascii():
+        raise InvalidTokenError("Malformed token")
+    # Constant-time, so response timing doesn't reveal how much of a forged signature matched
+    if not hmac.compare_digest(signature, _signature(payload)):
+        raise InvalidTokenError("Bad signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        raise InvalidTokenError("Malformed token")
+    if claims.get("exp", 0) <= time.time():
+        raise InvalidTokenError("Token expired")
+    if is_revoked and is_revoked(claims):
+        raise InvalidTokenError("Token revoked")
+    return claims
+
+
+def init_revoked_tokens_table(conn: sqlite3.Connection):
+    """Create the tables of revoked token ids and of per-user issue cutoffs"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti VARCHAR(32) PRIMARY KEY,
+            user_id INTEGER,
+            expires_at INTEGER NOT NULL,
+            revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Every token of user_id issued before issued_before is revoked, e.g. after a role change
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_user_tokens (
+            user_id INTEGER PRIMARY KEY,
+            issued_before INTEGER NOT NULL
+        )
+    ''')
+
+
+class RevocationList:
+    """Revoked token ids and per-user cutoffs held in memory, reloaded every refresh_seconds.
+
+    Checks are a set and a dict lookup; the tables are read at most once per
+    interval, which is also how long a revocation made by another worker can
+    take to apply.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 refresh_seconds: float = REVOCATION_REFRESH_SECONDS):
+        self._connect = connect
+        self.refresh_seconds = refresh_seconds
+        self._revoked: frozenset = frozenset()
+        self._issued_before: Dict[int, int] = {}
+        self._loaded_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        conn = self._connect()
+        try:
+            # Expired tokens fail verification anyway, so their rows can go
+            now = int(time.time())
+            conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM revoked_user_tokens WHERE issued_before <= ?", (now - TOKEN_TTL_SECONDS,))
+            conn.commit()
+            self._revoked = frozenset(row[0] for row in conn.execute("SELECT jti FROM revoked_tokens"))
+            self._issued_before = dict(conn.execute("SELECT user_id, issued_before FROM revoked_user_tokens"))
+        finally:
+            conn.close()
+        self._loaded_at = time.monotonic()
+
+    def is_revoked(self, claims: Dict[str, Any]) -> bool:
+        if time.monotonic() - self._loaded_at >= self.refresh_seconds:
+            # Only one thread reloads; the others keep using the current set meanwhile
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not refresh revoked tokens: {e}")
+                    self._loaded_at = time.monotonic()
+                finally:
+                    self._lock.release()
+        if claims.get("jti") in self._revoked:
+            return True
+        # Tokens from before iat was added count as issued at 0
+        return claims.get("iat", 0) < self._issued_before.get(claims.get("uid"), 0)
+
+    def revoke(self, claims: Dict[str, Any]):
+        """Revoke a token by its claims, effective immediately in this process"""
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR IGNORE INTO revoked_tokens (jti, user_id, expires_at) VALUES (?, ?, ?)",
+                         (claims["jti"], claims.get("uid"), claims["exp"]))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._revoked = self._revoked | {claims["jti"]}
+
+    def revoke_user(self, user_id: int):
+        """Revoke every token issued to user_id so far, effective immediately in this process.
+
+        iat has one-second resolution, so tokens issued later in the same second
+        are revoked too.
+        """
+        issued_before = int(time.time()) + 1
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO revoked_user_tokens (user_id, issued_before) VALUES (?, ?)",
+                         (user_id, issued_before))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._issued_before = {**self._issued_before, user_id: issued_before}
+
+    def invalidate(self):
+        """Reload from the table on the next check"""
+        self._loaded_at = float("-inf")
@@ -0,0 +1,252 @@
+"""
+Map-reduce summarisation of long study materials
+Summarises chunks in parallel with bounded Ollama concurrency, then merges them, caching per material and content hash
+"""
+
+import os
+import hashlib
+import logging
+import sqlite3
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Any, Iterable, Optional, Tuple
+
+from ollama_service import ollama_service
+from services.prompt_budget import estimate_tokens, truncate_to_tokens
+from services.retrieval import chunk_text
+
+logger = logging.getLogger(__name__)
+
+# Ollama serves OLLAMA_NUM_PARALLEL requests at once; more only queue up server-side
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", 2))
+MAP_CHUNK_WORDS = int(os.getenv("SUMMARY_CHUNK_WORDS", 1200))
+MAP_SUMMARY_WORDS = 150
+FINAL_SUMMARY_WORDS = int(os.getenv("SUMMARY_WORDS", 400))
+# How much summary text a single reduce prompt may merge
+REDUCE_INPUT_TOKENS = 3000
+SUMMARY_TIMEOUT = 300
+
+# Ad-hoc text (not a stored study material) is cached under this id
+ADHOC_MATERIAL_ID = 0
+# Ad-hoc summaries are never superseded by a newer version, so only the most recent ones are kept
+ADHOC_SUMMARY_LIMIT = int(os.getenv("SUMMARY_ADHOC_CACHE_SIZE", 200))
+
+MAP_PROMPT = """Summarise the following excerpt from "{title}" for a teacher preparing course material.
+Keep key definitions, facts, figures, named theories and terminology. Do not add information.
+Write at most {words} words of plain prose.
+
+Excerpt:
+\"\"\"{text}\"\"\"
+
+Summary:"""
+
+REDUCE_PROMPT = """Below are summaries of consecutive sections of "{title}".
+Merge them into one coherent summary of at most {words} words, in the order the topics appear.
+Remove repetition but keep every distinct key concept, definition and figure.
+
+Section summaries:
+{text}
+
+Combined summary:"""
+
+
+def init_summary_table(conn: sqlite3.Connection):
+    """Create the summary cache table"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS material_summaries (
+            material_id INTEGER NOT NULL,
+            content_hash VARCHAR(40) NOT NULL,
+            summary TEXT NOT NULL,
+            chunk_count INTEGER NOT NULL,
+            llm_calls INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (material_id, content_hash)
+        )
+    ''')
+
+
+class MaterialSummarizer:
+    def __init__(self, concurrency: int = SUMMARY_CONCURRENCY, adhoc_limit: int = ADHOC_SUMMARY_LIMIT):
+        self.concurrency = concurrency
+        self.adhoc_limit = adhoc_limit
+        # Shared by all requests so concurrent generations can't multiply the load on Ollama
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="summarizer")
+        # Summaries prepared for later requests, one material set at a time; their calls still go through _executor
+        self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer-background")
+        self._pending: set = set()
+        self._pending_lock = threading.Lock()
+
+    def _call(self, prompt: str, fallback_text: str, max_words: int) -> Tuple[str, bool]:
+        """One Ollama summary call; falls back to an extractive cut so the pipeline still completes"""
+        try:
+            summary = ollama_service.generate(
+                prompt,
+                options={"num_predict": int(max_words * 2)},
+                timeout=SUMMARY_TIMEOUT,
+                task="summary"
+            ).strip()
+            if summary:
+                return summary, True
+        except Exception as e:
+            logger.warning(f"Summary call failed, using extractive fallback: {e}")
+        return truncate_to_tokens(fallback_text, int(max_words * 1.5)), False
+
+    def summarize_text(self, text: str, title: str = "source material") -> Dict[str, Any]:
+        """Map: summarise each chunk in parallel. Reduce: merge batches of summaries until one remains."""
+        started = time.perf_counter()
+        chunks = chunk_text(text, chunk_words=MAP_CHUNK_WORDS, overlap_words=0)
+        if not chunks:
+            return {"summary": "", "chunk_count": 0, "llm_calls": 0, "complete": True}
+
+        jobs = [
+            self._executor.submit(self._call, MAP_PROMPT.format(title=title, words=MAP_SUMMARY_WORDS, text=chunk),
+                                  chunk, MAP_SUMMARY_WORDS)
+            for chunk in chunks
+        ]
+        results = [job.result() for job in jobs]
+        summaries = [summary for summary, _ in results]
+        complete = all(ok for _, ok in results)
+        calls = len(results)
+
+        # A single short chunk needs no reduce step
+        while len(summaries) > 1:
+            batches: List[List[str]] = [[]]
+            batch_tokens = 0
+            for summary in summaries:
+                tokens = estimate_tokens(summary)
+                if batches[-1] and batch_tokens + tokens > REDUCE_INPUT_TOKENS:
+                    batches.append([])
+                    batch_tokens = 0
+                batches[-1].append(summary)
+                batch_tokens += tokens
+
+            final_round = len(batches) == 1
+            words = FINAL_SUMMARY_WORDS if final_round else MAP_SUMMARY_WORDS * 2
+            jobs = []
+            for batch in batches:
+                if len(batch) == 1 and not final_round:
+                    jobs.append(None)
+                    continue
+                joined = "\n\n".join(f"Section {index + 1}: {summary}" for index, summary in enumerate(batch))
+                jobs.append(self._executor.submit(
+                    self._call, REDUCE_PROMPT.format(title=title, words=words, text=joined), joined, words
+                ))
+
+            next_summaries = []
+            for batch, job in zip(batches, jobs):
+                if job is None:
+                    next_summaries.append(batch[0])
+                    continue
+                summary, ok = job.result()
+                complete = complete and ok
+                calls += 1
+                next_summaries.append(summary)
+            summaries = next_summaries
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"Summarised '{title}': {len(chunks)} chunks, {calls} LLM calls in {elapsed:.1f}s")
+        return {"summary": summaries[0], "chunk_count": len(chunks), "llm_calls": calls, "complete": complete}
+
+    def summarize(self, conn: sqlite3.Connection, material_id: int, text: str,
+                  title: str = "source material") -> Optional[str]:
+        """Cached summary of one text, keyed by (material_id, content hash)"""
+        if not text or not text.strip():
+            return None
+        content_hash = hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+        cached = self.get_cached(conn, material_id, content_hash)
+        if cached is not None:
+            return cached
+
+        result = self.summarize_text(text, title)
+        # Fallback (extractive) summaries are served but not cached, so they're retried once Ollama is back
+        if result["complete"]:
+            conn.execute('''
+                INSERT OR REPLACE INTO material_summaries (material_id, content_hash, summary, chunk_count, llm_calls)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (material_id, content_hash, result["summary"], result["chunk_count"], result["llm_calls"]))
+            if material_id != ADHOC_MATERIAL_ID:
+                # Older summaries of this material are stale now
+                conn.execute('DELETE FROM material_summaries WHERE material_id = ? AND content_hash != ?',
+                             (material_id, content_hash))
+            else:
+                conn.execute('''
+                    DELETE FROM material_summaries WHERE material_id = ? AND rowid NOT IN (
+                        SELECT rowid FROM material_summaries WHERE material_id = ? ORDER BY rowid DESC LIMIT ?
+                    )
+                ''', (ADHOC_MATERIAL_ID, ADHOC_MATERIAL_ID, self.adhoc_limit))
+            conn.commit()
+        return result["summary"]
+
+    def get_cached(self, conn: sqlite3.Connection, material_id: int, content_hash: str) -> Optional[str]:
+        row = conn.execute(
+            'SELECT summary FROM material_summaries WHERE material_id = ? AND content_hash = ?',
+            (material_id, content_hash)
+        ).fetchone()
+        return row["summary"] if row else None
+
+    def summaries_for(self, conn: sqlite3.Connection, material_ids: Iterable[int],
+                      compute: bool = True) -> List[Dict[str, Any]]:
+        """Summaries of study materials, in the given order.
+
+        With compute=False only already-cached summaries are returned, which
+        never calls Ollama.
+        """
+        ids = list(dict.fromkeys(int(material_id) for material_id in material_ids))
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        rows = {
+            row["id"]: row
+            for row in conn.execute(
+                f"SELECT id, title, content FROM study_materials WHERE id IN ({placeholders})", ids
+            )
+        }
+
+        summaries = []
+        for material_id in ids:
+            row = rows.get(material_id)
+            if row is None or not (row["content"] or "").strip():
+                continue
+            if compute:
+                summary = self.summarize(conn, material_id, row["content"], row["title"])
+            else:
+                content_hash = hashlib.sha1(row["content"].encode("utf-8", "replace")).hexdigest()
+                summary = self.get_cached(conn, material_id, content_hash)
+            if summary:
+                summaries.append({"material_id": material_id, "title": row["title"], "summary": summary})
+        return summaries
+
+
+    def summarize_later(self, connect: Callable[[], sqlite3.Connection],
+                        material_ids: Iterable[int]) -> Optional[Future]:
+        """Compute the materials' missing summaries in the background, so later requests find them cached.
+
+        Materials already queued are skipped; returns None when there is nothing new to do.
+        """
+        with self._pending_lock:
+            ids = [material_id for material_id in dict.fromkeys(int(material_id) for material_id in material_ids)
+                   if material_id not in self._pending]
+            if not ids:
+                return None
+            self._pending.update(ids)
+        return self._background.submit(self._summarize_pending, connect, ids)
+
+    def _summarize_pending(self, connect: Callable[[], sqlite3.Connection], material_ids: List[int]):
+        conn = connect()
+        try:
+            self.summaries_for(conn, material_ids)
+        except Exception:
+            logger.exception(f"Background summaries failed for materials {material_ids}")
+        finally:
+            conn.close()
+            with self._pending_lock:
+                self._pending.difference_update(material_ids)
+
+
+def format_summaries(summaries: List[Dict[str, Any]]) -> str:
+    """Render material summaries as labelled sections for a prompt"""
+    return "\n\n".join(f"[Summary of {item['title']}]\n{item['summary']}" for item in summaries)
+
+# Global service instance
+material_summarizer = MaterialSummarizer()
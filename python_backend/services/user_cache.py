@@ -0,0 +1,102 @@
+"""
+Cache of verified access tokens for the FastAPI auth dependencies
+Maps a token to a snapshot of its user so authenticated requests skip the JWT decode and the users query
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Set, Tuple
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 1024))
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """The user fields request handlers read, detached from any database session"""
+    id: int
+    username: str
+    email: str
+    name: str
+    role: str
+    avatar: Optional[str]
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user) -> "UserSnapshot":
+        return cls(id=user.id, username=user.username, email=user.email, name=user.name,
+                   role=user.role, avatar=user.avatar, is_active=bool(user.is_active))
+
+
+class UserCache:
+    """Bounded LRU of token -> (snapshot, expiry).
+
+    An entry lives for at most `ttl` seconds and never past the token's own
+    expiry. Changes to a user drop their entries through invalidate_user; the
+    TTL bounds how stale another worker process's copy can get.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_entries: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[UserSnapshot, float]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, token: str) -> Optional[UserSnapshot]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._remove(token)
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(token)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, token: str, user: UserSnapshot, token_expires_at: Optional[float] = None):
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (user, expires_at)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        """Forget every cached token of a user, e.g. after a profile, role or password change"""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+            self._stats["invalidations"] += 1
+
+    def _remove(self, token: str):
+        """Drop one entry (caller holds the lock)"""
+        user, _ = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "ttl_seconds": self.ttl, **self._stats}
+
+
+# Global service instance
+user_cache = UserCache()
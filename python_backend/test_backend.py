@@ -6,6 +6,10 @@ Verifies that all components work correctly
 import os
 import sys
 sys.path.append('.')
+# Sign test tokens with a fixed key rather than generating token_secret.key
+os.environ.setdefault("TOKEN_SECRET", "test-secret")
+# Requests made through the Flask test client shouldn't start warming a model that isn't there
+os.environ.setdefault("OLLAMA_KEEP_ALIVE_THREAD", "false")
 
 from database import get_db
 from models import Base
@@ -55,6 +59,1041 @@ def test_imports():
         print(f"❌ Import test failed: {e}")
         return False
 
+def test_upload_streaming_size_cap():
+    """Test uploads are streamed with an incremental size limit"""
+    import io
+    import tempfile
+    from fastapi import HTTPException
+    from file_service import LocalFileService
+
+    service = LocalFileService(tempfile.mkdtemp())
+    service.max_file_size = 2 * service.chunk_size
+
+    temp_path, size, file_hash, fingerprint = service.stream_to_temp(io.BytesIO(b"abc"))
+    assert size == 3
+    # FILE_HASH_ALGORITHM (md5 by default) is only the fingerprint; storage is keyed by SHA-256
+    assert fingerprint == "900150983cd24fb0d6963f7d28e17f72"
+    assert file_hash == "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+    temp_path.unlink()
+
+    # Hash-on-write must agree with hashing the stored file, across chunk boundaries
+    service.hash_algorithm = "sha256"
+    temp_path, size, file_hash, fingerprint = service.stream_to_temp(io.BytesIO(b"y" * (service.chunk_size + 7)))
+    assert file_hash == fingerprint == service._calculate_file_hash(temp_path)
+    temp_path.unlink()
+
+    try:
+        service.stream_to_temp(io.BytesIO(b"x" * (3 * service.chunk_size)))
+        assert False, "oversized upload was accepted"
+    except HTTPException as e:
+        assert e.status_code == 413
+    assert not any((service.base_upload_dir / "temp").iterdir())
+    print("✅ Upload streaming size cap working")
+    return True
+
+def test_search_index():
+    """Test the FTS5 index follows inserts, updates and deletes"""
+    import sqlite3
+    from services.search_index import init_search_index, search
+
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute('''CREATE TABLE study_materials (id INTEGER PRIMARY KEY, title TEXT, description TEXT,
+                    collectionid INTEGER, type TEXT, qaqf_level INTEGER, created_by_user_id INTEGER,
+                    content TEXT, file_name TEXT, created_at TIMESTAMP)''')
+    conn.execute('''CREATE TABLE generatedlesson (id INTEGER PRIMARY KEY, courseid INTEGER, title TEXT,
+                    description TEXT, level INTEGER, userid INTEGER, type TEXT, status TEXT, createddate DATETIME)''')
+    conn.execute("INSERT INTO study_materials (title, type, qaqf_level, created_by_user_id, content) "
+                 "VALUES ('Cells', 'notes', 3, 1, 'Photosynthesis happens in chloroplasts')")
+    init_search_index(conn)  # builds the index from the existing row
+    conn.execute("INSERT INTO generatedlesson (courseid, title, description, level, userid) "
+                 "VALUES (1, 'Plant biology', 'Photosynthesis and respiration', 3, 2)")
+
+    assert search(conn, "photosynth", user_id=1)["count"] == 2
+    assert search(conn, "photosynth", user_id=2)["count"] == 1  # materials stay private
+    assert search(conn, "photosynthesis", user_id=1, scope="lessons", owner_id=1)["count"] == 0
+    assert search(conn, '" OR *', user_id=1)["count"] == 0
+
+    # count is every match, not the page; kinds are ranked separately and interleaved
+    page = search(conn, "photosynth", user_id=1, limit=1)
+    assert page["count"] == 2 and page["returned"] == 1
+    assert page["totals"] == {"study_material": 1, "lesson": 1}
+    assert page["results"][0]["kind"] == "study_material"
+    assert search(conn, "photosynth", user_id=1, limit=1, offset=1)["results"][0]["kind"] == "lesson"
+
+    # Indexed text is escaped before matches are marked up
+    conn.execute("INSERT INTO study_materials (title, type, qaqf_level, created_by_user_id, content) "
+                 "VALUES ('<script>alert(1)</script> Osmosis', 'notes', 3, 3, 'Osmosis & <b>diffusion</b>')")
+    hit = search(conn, "osmosis", user_id=3)["results"][0]
+    assert hit["title_highlight"] == "&lt;script&gt;alert(1)&lt;/script&gt; <mark>Osmosis</mark>"
+    assert "<script>" not in hit["snippet"] and "<mark>Osmosis</mark>" in hit["snippet"]
+
+    conn.execute("UPDATE study_materials SET content = 'Mitosis' WHERE id = 1")
+    assert search(conn, "mitosis", user_id=1)["results"][0]["kind"] == "study_material"
+    conn.execute("DELETE FROM generatedlesson")
+    assert search(conn, "photosynthesis", user_id=1)["count"] == 0
+    print("✅ Search index working")
+    return True
+
+def test_prompt_budget():
+    """Test oversized prompt sections are trimmed to their token budget"""
+    from services.prompt_budget import PromptBudget, estimate_tokens
+
+    text = " ".join(f"Sentence {i} covers topic{i % 40}." for i in range(5000))
+    budget = PromptBudget("test", total_tokens=1500, template_tokens=100)
+    source = budget.fit("source_content", text, max_tokens=1000, strategy="extractive", query="topic7")
+    assert estimate_tokens(source) <= 1000
+    assert "Sentence 7 covers topic7." in source
+    # Only what is left of the overall budget remains for later sections
+    content = budget.fit("content", text)
+    assert estimate_tokens(content) <= 1400 - estimate_tokens(source)
+    assert content.startswith("Sentence 0") and content.endswith("Sentence 4999 covers topic39.")
+    assert budget.fit("content", "short") == "short"
+
+    # Each generation profile's reply is reserved out of the context, not a fixed 2048 tokens
+    from services.prompt_budget import CONTEXT_TOKENS, PROMPT_TOKEN_BUDGET
+    from services.generation_profiles import generation_profiles
+    assert PromptBudget("course", "course_outline").total_tokens == \
+        CONTEXT_TOKENS - generation_profiles["course_outline"]["num_predict"]
+    assert PromptBudget("verify", "verification").total_tokens > PromptBudget("other").total_tokens == PROMPT_TOKEN_BUDGET
+
+    from services.percentiles import percentile_summary
+    assert percentile_summary(range(100, 0, -1)) == {"p50": 51, "p90": 91, "p99": 100, "max": 100}
+    assert percentile_summary([0.0012, 0.0034], (0.5,), scale=1000, digits=1) == {"p50": 3.4, "max": 3.4}
+    assert percentile_summary([]) == {"p50": None, "p90": None, "p99": None, "max": None}
+    print("✅ Prompt budgeting working")
+    return True
+
+def test_circuit_breaker():
+    """Test the breaker opens on failures and fails fast until a trial call succeeds"""
+    from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+    breaker = CircuitBreaker("test", minimum_calls=3, open_seconds=0.05)
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    for _ in range(5):
+        try:
+            breaker.call(failing)
+        except ConnectionError:
+            pass
+        except CircuitOpenError:
+            pass
+    assert len(calls) == 3 and breaker.state == "open"
+
+    import time
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+    # With a health check the half-open trial is the check, not a (possibly long) real call
+    import threading
+    probing, release, healthy = threading.Event(), threading.Event(), [False]
+
+    def health_check():
+        probing.set()
+        release.wait(2)
+        return healthy[0]
+
+    breaker = CircuitBreaker("probed", minimum_calls=1, open_seconds=0.01, health_check=health_check,
+                             probe_interval=60)
+    try:
+        breaker.call(failing)
+    except ConnectionError:
+        pass
+    time.sleep(0.02)
+    release.set()
+    try:
+        breaker.call(lambda: "unused")
+        assert False, "unhealthy probe should keep the circuit open"
+    except CircuitOpenError:
+        pass
+    assert breaker.state == "open"
+
+    time.sleep(0.02)
+    release.clear()
+    probing.clear()
+    healthy[0] = True
+    results = []
+    trial = threading.Thread(target=lambda: results.append(breaker.call(lambda: "slow generation")))
+    trial.start()
+    assert probing.wait(2)
+    try:
+        breaker.call(lambda: "unused")
+        assert False, "only one probe at a time"
+    except CircuitOpenError:
+        pass
+    release.set()
+    trial.join(2)
+    assert results == ["slow generation"] and breaker.state == "closed"
+    # Once closed, other callers no longer wait for the trial caller's own call
+    assert breaker.call(lambda: "next") == "next"
+
+    # Long tasks get their own slow-call threshold instead of tripping the short-call one
+    breaker = CircuitBreaker("slow", slow_call_seconds=0.001, slow_call_rate_threshold=0.5, minimum_calls=2)
+    for _ in range(2):
+        breaker.call(time.sleep, 0.01, slow_call_seconds=10)
+    assert breaker.state == "closed"
+    for _ in range(2):
+        breaker.call(time.sleep, 0.01)
+    assert breaker.state == "open"
+    from ollama_service import ollama_service
+    assert ollama_service.task_slow_call_seconds["lesson"] > ollama_service.breaker.slow_call_seconds
+    print("✅ Circuit breaker working")
+    return True
+
+def test_json_output():
+    """Test the streamed JSON scanner stops at the closing brace and near-valid output is repaired"""
+    from services.json_output import JSONObjectScanner, parse_json_object, review_schema, coerce_to_schema
+
+    scanner = JSONObjectScanner()
+    pieces = ['Sure: {"a": "}{', '", "b": {"c": 1}', '} trailing text', ' never read']
+    fed = 0
+    for piece in pieces:
+        fed += 1
+        if scanner.feed(piece):
+            break
+    assert fed == 3 and scanner.text == '{"a": "}{", "b": {"c": 1}}'
+
+    assert parse_json_object('```json\n{verification_status: "approved", "x": True,}\n```') == \
+        {"verification_status": "approved", "x": True}
+    assert parse_json_object('{"verification_comments": "cut off') == {"verification_comments": "cut off"}
+    # Repairs stay out of string values
+    assert parse_json_object('{"comments": "True story, None of it {x: 1,}", flag: True,}') == \
+        {"comments": "True story, None of it {x: 1,}", "flag": True}
+    assert parse_json_object('{"a": "say \\"None, ]\\" here", b: None, "c": "open, }') == \
+        {"a": 'say "None, ]" here', "b": None, "c": "open, }"}
+
+    schema = review_schema("verification")
+    verdict = coerce_to_schema({
+        "verification_status": "Approved", "verification_clarity": "3", "verification_completeness": 7,
+        "verification_accuracy": 2, "verification_qaqf_alignment": 4.0,
+        "verification_british_standard": "yes", "verification_comments": "Fine"
+    }, schema)
+    assert verdict["verification_status"] == "approved"
+    assert verdict["verification_clarity"] == 3 and verdict["verification_completeness"] == 4
+    print("✅ JSON output parsing working")
+    return True
+
+def test_generation_profiles():
+    """Test task profiles set Ollama options and generated tokens are recorded per task"""
+    from unittest import mock
+    from services.generation_profiles import profile_options, generation_stats
+    from ollama_service import ollama_service
+
+    options = profile_options("quiz", {"temperature": 0.9})
+    assert options["num_predict"] > 0 and options["temperature"] == 0.9 and "num_ctx" in options
+    assert "stop" not in profile_options("verification")
+
+    reply = mock.Mock(status_code=200)
+    reply.json.return_value = {"response": "Quiz", "eval_count": options["num_predict"]}
+    with mock.patch("ollama_service.requests.post", return_value=reply) as post:
+        assert ollama_service.generate("Write a quiz", task="quiz") == "Quiz"
+    assert post.call_args.kwargs["json"]["options"]["num_predict"] == options["num_predict"]
+    stats = generation_stats.summary()["tasks"]["quiz"]
+    assert stats["calls"] >= 1 and stats["hit_cap"] >= 1
+    print("✅ Generation profiles working")
+    return True
+
+def test_ollama_keep_alive():
+    """Test warm-up records the load time and the keep-alive thread starts once per process"""
+    import threading
+    import requests
+    from unittest import mock
+    from ollama_service import OllamaService, ollama_service
+    from app import app
+
+    service = OllamaService()
+    reply = mock.Mock(status_code=200)
+    reply.json.return_value = {"load_duration": 2_500_000_000}
+    with mock.patch("ollama_service.requests.post", return_value=reply) as post:
+        result = service.warm_up()
+    assert result["success"] and result["load_seconds"] == 2.5 and service._model_loaded
+    assert post.call_args.kwargs["json"]["keep_alive"] == service.keep_alive
+    with mock.patch("ollama_service.requests.post", side_effect=requests.exceptions.ConnectionError("down")):
+        assert not service.warm_up()["success"] and not service._model_loaded
+
+    service.keep_alive_enabled = True
+    service.warmup_interval = 0.01
+    warmed = threading.Semaphore(0)
+    callers = [threading.Thread(target=service.ensure_keep_alive) for _ in range(8)]
+    with mock.patch.object(service, "warm_up", side_effect=warmed.release), \
+            mock.patch.object(service, "is_model_loaded", return_value=False), \
+            mock.patch("ollama_service.threading.Thread", wraps=threading.Thread) as thread:
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        assert thread.call_count == 1 and service.get_status()["keep_alive_running"]
+        # The first warm-up, then re-warms while the model reports unloaded
+        for _ in range(3):
+            assert warmed.acquire(timeout=2)
+
+        service.stop_keep_alive()
+        service._keep_alive_thread.join(timeout=2)
+        service.ensure_keep_alive()
+        assert not service._keep_alive_running() and thread.call_count == 1
+
+    # Every Flask process starts it from its first request, however the app is run
+    assert ollama_service.ensure_keep_alive in app.before_request_funcs[None]
+    print("✅ Ollama warm-up and keep-alive working")
+    return True
+
+def test_retrieval_chunks():
+    """Test chunks overlap by whole sentences and materials are re-chunked when their text changes"""
+    import sqlite3
+    from services.retrieval import chunk_text, init_retrieval_index, retrieve_chunks
+
+    sentences = [f"Sentence {i} " + " ".join(f"w{i}x{j}" for j in range(8)) + "." for i in range(12)]
+    chunks = chunk_text(" ".join(sentences), chunk_words=50, overlap_words=20)
+    assert len(chunks) > 1 and all(len(chunk.split()) <= 50 for chunk in chunks)
+    for previous, following in zip(chunks, chunks[1:]):
+        # The last two 10-word sentences are repeated at the start of the next chunk
+        assert following.split()[:20] == previous.split()[-20:]
+    assert [len(chunk.split()) for chunk in chunk_text(" ".join(["long"] * 120), chunk_words=50, overlap_words=0)] \
+        == [50, 50, 20]
+
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE study_materials (id INTEGER PRIMARY KEY, title TEXT, content TEXT)")
+    init_retrieval_index(conn)
+    photosynthesis = "Plants use chlorophyll to capture light. " * 60 + "Stomata regulate gas exchange."
+    conn.execute("INSERT INTO study_materials VALUES (1, 'Biology', ?)", (photosynthesis,))
+
+    found = retrieve_chunks(conn, [1], "stomata")
+    assert found and "Stomata" in found[0]["content"] and found[0]["title"] == "Biology"
+    chunk_ids = [row[0] for row in conn.execute("SELECT id FROM study_material_chunks ORDER BY id")]
+    retrieve_chunks(conn, [1], "chlorophyll")
+    assert [row[0] for row in conn.execute("SELECT id FROM study_material_chunks ORDER BY id")] == chunk_ids
+
+    conn.execute("UPDATE study_materials SET content = ? WHERE id = 1", ("Mitochondria release energy.",))
+    assert "Mitochondria" in retrieve_chunks(conn, [1], "mitochondria")[0]["content"]
+    assert not retrieve_chunks(conn, [1], "stomata")[0]["content"].startswith("Plants")
+    assert conn.execute("SELECT COUNT(*) FROM study_material_chunks").fetchone()[0] == 1
+
+    conn.execute("DELETE FROM study_materials WHERE id = 1")
+    assert conn.execute("SELECT COUNT(*) FROM study_material_chunks").fetchone()[0] == 0
+    conn.close()
+    print("✅ Retrieval chunking working")
+    return True
+
+def test_review_prompt_prefix():
+    """Test reviews send the fixed instructions as the system message and only the lesson as the user message"""
+    import json
+    from unittest import mock
+    import app as flask_app
+
+    verdict = {"verification_status": "approved", "verification_clarity": 3, "verification_completeness": 3,
+               "verification_accuracy": 4, "verification_qaqf_alignment": 3,
+               "verification_british_standard": "yes", "verification_comments": "Clear"}
+    payloads = []
+
+    def fake_post(url, **kwargs):
+        payload = kwargs["json"]
+        payloads.append(payload)
+        kind = "moderation" if payload["format"] is flask_app.MODERATION_SCHEMA else "verification"
+        reply = json.dumps({key.replace("verification", kind): value for key, value in verdict.items()})
+        response = mock.MagicMock(status_code=200)
+        response.__enter__.return_value = response
+        # Streamed in two pieces, as Ollama's /api/chat does token by token
+        response.iter_lines.return_value = [json.dumps({"message": {"content": piece}}).encode()
+                                            for piece in (reply[:20], reply[20:])]
+        return response
+
+    flask_app.ollama_service.breaker.reset()
+    client = flask_app.app.test_client()
+    lessons = ["Lesson one explains photosynthesis step by step.", "Lesson two covers cell respiration."]
+    with mock.patch("ollama_service.requests.post", side_effect=fake_post), \
+            mock.patch.object(flask_app.rate_limiter, "enabled", False):
+        for lesson in lessons:
+            response = client.post("/api/autoverification_lessons", json={"content": lesson, "force_full_review": True})
+            assert response.get_json()["data"]["verification_clarity"] == 3
+            response = client.post("/api/automoderation_lessons", json={"content": lesson})
+            assert response.get_json()["data"]["moderation_status"] == "approved"
+
+    assert len(payloads) == 4
+    for payload, lesson in zip(payloads, [lesson for lesson in lessons for _ in range(2)]):
+        system, user = payload["messages"]
+        assert system["role"] == "system" and user["role"] == "user"
+        assert lesson in user["content"] and "QAQF standards" not in user["content"]
+    # The prefix is byte-identical between lessons, so Ollama can reuse its cached evaluation
+    assert payloads[0]["messages"][0] == payloads[2]["messages"][0] == \
+        {"role": "system", "content": flask_app.VERIFICATION_PROMPT_PREFIX}
+    assert payloads[1]["messages"][0] == payloads[3]["messages"][0] == \
+        {"role": "system", "content": flask_app.MODERATION_PROMPT_PREFIX}
+    # Prompt stats measure both messages as sent
+    from services.prompt_budget import prompt_stats, estimate_tokens
+    sent = [estimate_tokens(payload["messages"][0]["content"]) + estimate_tokens(payload["messages"][1]["content"])
+            for payload in payloads[::2]]
+    assert prompt_stats.summary()["tasks"]["verification"]["max"] >= max(sent)
+    print("✅ Review prompt prefix working")
+    return True
+
+def test_lesson_triage():
+    """Test short lessons are rejected without the model and triage answers are cached"""
+    import sqlite3
+    from unittest import mock
+    from services.lesson_triage import init_triage_table, triage_lesson, rejection_verdict
+
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    init_triage_table(conn)
+
+    with mock.patch("services.lesson_triage.ollama_service.chat_json") as chat_json:
+        short = triage_lesson(conn, "Lesson to follow.")
+        assert short["decision"] == "reject" and short["stage"] == "heuristic"
+        assert rejection_verdict("verification", short)["verification_status"] == "rejected"
+
+        chat_json.return_value = {"worth_review": True, "reason": "Coherent lesson"}
+        lesson = "\n\n".join(f"## Part {i}\nLearners compare method {i} with the previous one and justify "
+                              f"their choice using evidence from the case study." for i in range(8))
+        assert triage_lesson(conn, lesson)["decision"] == "full_review"
+        assert triage_lesson(conn, lesson)["stage"] == "cache"
+        assert chat_json.call_count == 1
+
+        # A long lesson pasted without formatting goes to the model, with the concern noted
+        unformatted = " ".join(f"Learners compare method {i} with the previous one." for i in range(50))
+        assert triage_lesson(conn, unformatted)["decision"] == "full_review"
+        assert chat_json.call_count == 2 and "no visible structure" in chat_json.call_args[0][1]
+    print("✅ Lesson triage working")
+    return True
+
+def test_material_summaries():
+    """Test map-reduce summaries are cached, ad-hoc ones bounded, and missing ones prepared in the background"""
+    import os
+    import sqlite3
+    import tempfile
+    from unittest import mock
+    from services.summarizer import MaterialSummarizer, init_summary_table, ADHOC_MATERIAL_ID, MAP_CHUNK_WORDS
+
+    with tempfile.TemporaryDirectory() as directory:
+        def connect():
+            conn = sqlite3.connect(os.path.join(directory, "summaries.db"))
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        conn = connect()
+        init_summary_table(conn)
+        conn.execute("CREATE TABLE study_materials (id INTEGER PRIMARY KEY, title TEXT, content TEXT)")
+        textbook = " ".join(f"word{i}" for i in range(MAP_CHUNK_WORDS * 3))
+        conn.execute("INSERT INTO study_materials VALUES (1, 'Ecology', ?)", (textbook,))
+        conn.commit()
+
+        summarizer = MaterialSummarizer(concurrency=2, adhoc_limit=2)
+        with mock.patch("services.summarizer.ollama_service.generate", return_value="Summary.") as generate:
+            result = summarizer.summarize_text(textbook, "Ecology")
+            # Three map calls, then one reduce merging them
+            assert result["complete"] and result["chunk_count"] == 3 and result["llm_calls"] == generate.call_count == 4
+
+            # Only the cache is read unless asked to compute; summarize_later fills it off the request
+            assert summarizer.summaries_for(conn, [1], compute=False) == []
+            summarizer.summarize_later(connect, [1, 1]).result()
+            assert summarizer.summaries_for(conn, [1], compute=False)[0]["summary"] == "Summary."
+            calls = generate.call_count
+            assert summarizer.summaries_for(conn, ["1"])[0]["title"] == "Ecology" and generate.call_count == calls
+
+            for text in ("first pasted text", "second pasted text", "third pasted text"):
+                summarizer.summarize(conn, ADHOC_MATERIAL_ID, text)
+            rows = conn.execute("SELECT COUNT(*) FROM material_summaries WHERE material_id = ?",
+                                (ADHOC_MATERIAL_ID,)).fetchone()[0]
+            assert rows == 2
+
+        # Extractive fallbacks are served but not cached, so Ollama is asked again later
+        with mock.patch("services.summarizer.ollama_service.generate", side_effect=ConnectionError("down")):
+            assert summarizer.summarize(conn, 7, "Unsaved fallback text.") == "Unsaved fallback text."
+        assert conn.execute("SELECT COUNT(*) FROM material_summaries WHERE material_id = 7").fetchone()[0] == 0
+        conn.close()
+    print("✅ Material summaries working")
+    return True
+
+def test_british_spelling():
+    """Test American spellings are found with positions and case-matched British suggestions"""
+    from services.british_spelling import spelling_map, find_spellings, to_british
+    from services.british_standards import check_british_standards
+
+    assert len(spelling_map()) > 1000
+    text = "Learners Analyzed the COLOR of the center; humorists traveled toward size."
+    findings = find_spellings(text)
+    assert [finding["word"] for finding in findings] == ["Analyzed", "COLOR", "center", "traveled", "toward"]
+    assert text[findings[1]["start"]:findings[1]["end"]] == "COLOR"
+    assert to_british(text) == "Learners Analysed the COLOUR of the centre; humorists travelled towards size."
+    assert find_spellings("coloré") == []
+
+    result = check_british_standards("The color of learning outcomes and assessment.")
+    assert not result["compliant"] and result["spellings"][0]["suggestion"] == "colour"
+    print("✅ British spelling checker working")
+    return True
+
+def test_qaqf_scoring():
+    """Test lessons are scored from their text, one batch at a time"""
+    from services.qaqf_scoring import score_lessons, CHARACTERISTICS
+
+    structured = ("# Data Ethics\n\n## Learning Outcomes\n- Analyse the ethics of AI in public services.\n"
+                  "- Evaluate frameworks for responsible data use.\n\n## Concepts\n"
+                  + "Learners compare theories, critique real case studies and collaborate in teams. " * 6
+                  + "\n\n## Assessment\nA group presentation receives formative feedback; the report is "
+                    "marked against a rubric.")
+    results = score_lessons([structured, "Stuff about things. " * 30, ""], [6, 6, 6])
+    assert list(results[0]["characteristics"]) == CHARACTERISTICS
+    assert results[0]["metrics"]["learning_objectives"] and results[0]["metrics"]["headings"] == 4
+    assert results[0]["score"] > results[1]["score"] > 0
+    assert all(value == 1 for value in results[2]["characteristics"].values())
+    print("✅ QAQF scoring working")
+    return True
+
+def test_near_duplicates():
+    """Test near-identical lessons cluster together and reuse an existing verdict"""
+    import sqlite3
+    from services.near_duplicates import (init_near_duplicate_index, index_item, find_similar,
+                                          duplicate_clusters, find_verified_duplicate)
+
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute('''CREATE TABLE generatedlesson (id INTEGER PRIMARY KEY, title TEXT, description TEXT, userid INTEGER,
+                    verification_status TEXT, verification_clarity INTEGER, verification_completeness INTEGER,
+                    verification_accuracy INTEGER, verification_qaqf_alignment INTEGER,
+                    verification_british_standard TEXT, verification_comments TEXT)''')
+    conn.execute("CREATE TABLE study_materials (id INTEGER PRIMARY KEY, title TEXT, content TEXT, created_by_user_id INTEGER)")
+    lesson = " ".join(f"Step {i}: learners compare source {i} with the previous evidence and record why it matters."
+                      for i in range(40))
+    conn.execute("INSERT INTO generatedlesson VALUES (1, 'Original', ?, 1, 'approved', 4, 3, 4, 3, 'yes', 'Good')",
+                 (lesson,))
+    init_near_duplicate_index(conn)  # indexes the existing row
+
+    copy = lesson.upper().replace("matters.", "matters!")  # case and punctuation are ignored
+    other = " ".join(f"Unrelated paragraph {i} about volcanoes and plate tectonics in Iceland." for i in range(40))
+    for item_id, text in ((2, copy), (3, other)):
+        conn.execute("INSERT INTO generatedlesson (id, title, description, userid) VALUES (?, 'Draft', ?, 1)",
+                     (item_id, text))
+        index_item(conn, "lesson", item_id, text)
+
+    assert [match["id"] for match in find_similar(conn, "lesson", lesson)] == [1, 2]
+    clusters = duplicate_clusters(conn, "lesson")
+    assert len(clusters) == 1 and [item["id"] for item in clusters[0]["items"]] == [1, 2]
+    reused = find_verified_duplicate(conn, copy)
+    assert reused["lesson_id"] == 1 and reused["verdict"]["verification_status"] == "approved"
+    assert find_verified_duplicate(conn, other) is None
+
+    conn.execute("DELETE FROM generatedlesson WHERE id = 1")
+    assert duplicate_clusters(conn, "lesson") == []
+    print("✅ Near-duplicate detection working")
+    return True
+
+def test_rate_limiter():
+    """Test buckets throttle past the burst, refill over time and can be shared through SQLite"""
+    import os
+    import tempfile
+    from unittest import mock
+    from services.rate_limiter import RateLimiter, MemoryBucketStore, SQLiteBucketStore, POLICIES
+
+    burst = POLICIES["ai"].burst
+    with tempfile.TemporaryDirectory() as directory:
+        shared = os.path.join(directory, "limits.db")
+        for limiter in (RateLimiter(MemoryBucketStore()), RateLimiter(SQLiteBucketStore(shared))):
+            decisions = [limiter.hit("ai", "user:1") for _ in range(burst + 1)]
+            assert all(d.allowed for d in decisions[:-1]) and not decisions[-1].allowed
+            assert "Retry-After" in decisions[-1].headers()
+            assert limiter.hit("ai", "user:2").allowed and limiter.hit("crud", "user:1").allowed
+            assert limiter.summary()["policies"]["ai"]["throttled"] == 1
+
+        # A second worker sees the first one's bucket
+        assert not RateLimiter(SQLiteBucketStore(shared)).hit("ai", "user:1").allowed
+
+    limiter = RateLimiter(MemoryBucketStore())
+    with mock.patch("services.rate_limiter.time.monotonic", return_value=1000.0):
+        for _ in range(burst):
+            limiter.hit("ai", "user:1")
+    with mock.patch("services.rate_limiter.time.monotonic", return_value=1000.0 + 60 / POLICIES["ai"].per_minute):
+        assert limiter.hit("ai", "user:1").allowed
+    print("✅ Rate limiter working")
+    return True
+
+def test_user_cache():
+    """Test authenticated requests reuse the user snapshot until the user changes"""
+    import asyncio
+    from types import SimpleNamespace
+    from unittest import mock
+    from routes.auth import get_current_user, create_access_token
+    from services.user_cache import user_cache
+
+    user = SimpleNamespace(id=7, username="ada", email="ada@example.com", name="Ada", role="user",
+                           avatar=None, is_active=True)
+    db = mock.MagicMock()
+    db.query.return_value.filter.return_value.first.return_value = user
+    token = create_access_token({"sub": "ada"})
+
+    user_cache.clear()
+    first = asyncio.run(get_current_user(token, db))
+    second = asyncio.run(get_current_user(token, db))
+    assert first is second and first.role == "user"
+    assert db.query.call_count == 1
+
+    user.role = "admin"
+    user_cache.invalidate_user(7)
+    assert asyncio.run(get_current_user(token, db)).role == "admin"
+    assert db.query.call_count == 2
+    user_cache.clear()
+    print("✅ User cache working")
+    return True
+
+def test_password_hashing():
+    """Test hashes made at another cost are upgraded on a successful login"""
+    import bcrypt
+    from services.password_hashing import PasswordHasher, hash_rounds
+
+    hasher = PasswordHasher(rounds=5, workers=2, queue_size=2)
+    stored = bcrypt.hashpw(b"secret", bcrypt.gensalt(4))
+    valid, new_hash = hasher.verify("secret", stored)
+    assert valid and hash_rounds(new_hash) == 5
+    assert hasher.verify("secret", new_hash) == (True, None)
+    assert hasher.verify("wrong", new_hash) == (False, None)
+    assert hasher.verify("secret", "5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8") == (False, None)
+
+    with hasher.login_timer():
+        pass
+    stats = hasher.get_stats()
+    assert stats["rehashes"] == 1 and stats["workers"] == 2 and stats["login_ms"]["samples"] == 1
+    assert stats["login_ms"]["p50"] == stats["login_ms"]["max"] is not None
+    print("✅ Password hashing working")
+    return True
+
+def test_signed_tokens():
+    """Test tokens are verified from their signature alone and can be revoked"""
+    import sqlite3
+    import tempfile
+    import time
+    from services.signed_tokens import (create_token, verify_token, init_revoked_tokens_table,
+                                        RevocationList, InvalidTokenError)
+
+    token = create_token(3, "ada", "admin")
+    claims = verify_token(token)
+    assert (claims["uid"], claims["usr"], claims["role"]) == (3, "ada", "admin")
+
+    payload, signature = token.split(".")
+    forged = payload.replace(payload[-2:], "xx") + "." + signature
+    for bad in (forged, payload + ".", "1:admin:x", "héllo.wörld", payload + "." + signature[:-1] + "é",
+                create_token(3, "ada", "admin", ttl=-1)):
+        try:
+            verify_token(bad)
+            assert False, bad
+        except InvalidTokenError:
+            pass
+
+    with tempfile.NamedTemporaryFile(suffix=".db") as db_file:
+        connect = lambda: sqlite3.connect(db_file.name)
+        conn = connect()
+        init_revoked_tokens_table(conn)
+        conn.close()
+        revocations = RevocationList(connect, refresh_seconds=3600)
+        assert not revocations.is_revoked(claims)
+        revocations.revoke(claims)
+        try:
+            verify_token(token, revocations.is_revoked)
+            assert False
+        except InvalidTokenError:
+            pass
+        # Another worker picks the revocation up from the table
+        assert RevocationList(connect).is_revoked(claims)
+
+        # Revoking a user withdraws every token issued to them so far, but not later ones
+        other = verify_token(create_token(3, "ada", "admin"))
+        revocations.revoke_user(3)
+        assert revocations.is_revoked(other) and RevocationList(connect).is_revoked(other)
+        assert not revocations.is_revoked(dict(other, uid=4))
+        assert not revocations.is_revoked(dict(other, iat=int(time.time()) + 1))
+    print("✅ Signed tokens working")
+    return True
+
+def test_registration_role():
+    """Test self-registration always signs a plain user token, whatever role is sent"""
+    import tempfile
+    from unittest import mock
+    import app as flask_app
+    from services.signed_tokens import verify_token
+
+    with tempfile.TemporaryDirectory() as directory, \
+            mock.patch.object(flask_app, "DATABASE", os.path.join(directory, "test.db")), \
+            mock.patch.object(flask_app.password_hasher, "rounds", 4):
+        flask_app.init_complete_db()
+        client = flask_app.app.test_client()
+        response = client.post("/api/auth/register", json={
+            "username": "eve", "email": "eve@example.com", "password": "pw", "name": "Eve", "role": "admin"})
+        assert response.status_code == 201
+        assert verify_token(response.get_json()["access_token"])["role"] == "user"
+        # A non-ASCII Authorization header is an invalid token, not a server error
+        assert client.get("/api/dashboard/stats", headers={"Authorization": "Bearer tökén.x"}).status_code == 401
+        conn = flask_app.get_db()
+        assert conn.execute("SELECT role FROM users WHERE username = 'eve'").fetchone()["role"] == "user"
+        # An admin demoted (here by themselves) loses the admin token at once, not when it expires
+        eve_id = conn.execute("SELECT id FROM users WHERE username = 'eve'").fetchone()["id"]
+        conn.execute("UPDATE users SET role = 'admin' WHERE id = ?", (eve_id,))
+        conn.commit()
+        conn.close()
+        admin = {"Authorization": f"Bearer {flask_app.create_access_token(eve_id, 'eve', 'admin')}"}
+        assert client.put(f"/api/users/{eve_id}/role", json={"role": "user"}, headers=admin).status_code == 200
+        assert client.get("/api/auth/login-stats", headers=admin).status_code == 401
+    print("✅ Registration role working")
+    return True
+
+def test_assessment_material_ids():
+    """Test the assessment route rejects malformed material ids before touching the database"""
+    from unittest import mock
+    import app as flask_app
+
+    client = flask_app.app.test_client()
+    headers = {"Authorization": f"Bearer {flask_app.create_access_token(1, 'ada', 'user')}"}
+    with mock.patch.object(flask_app, "get_db", side_effect=AssertionError("database used")):
+        for material_ids in (["abc"], "12", [None]):
+            response = client.post("/api/ai/assessment-content", headers=headers,
+                                   json={"material_ids": material_ids, "userquery": "photosynthesis"})
+            assert response.status_code == 400, material_ids
+    print("✅ Assessment material ids validated")
+    return True
+
+def test_file_download():
+    """Test downloads honour Range and ETags and only serve a user their own files"""
+    import io
+    import tempfile
+    from types import SimpleNamespace
+    from unittest import mock
+    from fastapi import FastAPI, UploadFile
+    from fastapi.testclient import TestClient
+    from file_service import LocalFileService
+    from routes import files
+    from routes.auth import get_current_user
+
+    user = SimpleNamespace(id=1, role="user")
+    app = FastAPI()
+    app.include_router(files.router, prefix="/files")
+    app.dependency_overrides[get_current_user] = lambda: user
+    data = bytes(range(256)) * 40
+
+    with tempfile.TemporaryDirectory() as directory:
+        service = LocalFileService(directory)
+        with mock.patch.object(files, "file_service", service):
+            info = service.upload_file(UploadFile(io.BytesIO(data), filename="notes.pdf"), user_id=1)
+            client = TestClient(app)
+            url = f"/files/download/{info['path']}"
+
+            response = client.get(url)
+            assert response.status_code == 200 and response.content == data
+            etag = response.headers["etag"]
+            assert client.get(url, headers={"If-None-Match": f'W/{etag}'}).status_code == 304
+
+            partial = client.get(url, headers={"Range": "bytes=100-199"})
+            assert partial.status_code == 206 and partial.content == data[100:200]
+
+            # Another user is refused, including through an unnormalised path
+            user.id = 2
+            assert client.get(url).status_code == 403
+            assert client.get(url.replace("documents/", "documents/%2E/")).status_code == 403
+            assert client.get("/files/download/temp/../catalog.db").status_code == 404
+            user.role = "admin"
+            assert client.get(url).status_code == 200
+    print("✅ File download working")
+    return True
+
+def test_file_catalog():
+    """Test reconcile indexes existing files and repairs drift"""
+    import io
+    import hashlib
+    import sqlite3
+    import tempfile
+    from pathlib import Path
+    from fastapi import UploadFile
+    from file_service import LocalFileService
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Files left by an install from before the catalogue existed
+        legacy = Path(directory) / "documents" / "legacy.txt"
+        legacy.parent.mkdir(parents=True)
+        legacy.write_bytes(b"uploaded before the catalogue")
+
+        # Creating the service doesn't walk the upload directories; the first reconcile is explicit
+        service = LocalFileService(directory)
+        assert service.list_files() == []
+        assert service.reconcile_catalog()["added"] == 1
+        listed = service.list_files()
+        assert [entry["path"] for entry in listed] == ["documents/legacy.txt"]
+        assert listed[0]["uploaded_by"] is None and listed[0]["hash"]
+
+        data = b"lesson plan" * 100
+        first = service.upload_file(UploadFile(io.BytesIO(data), filename="plan.txt"), user_id=1)
+        second = service.upload_file(UploadFile(io.BytesIO(data), filename="copy.txt"), user_id=2)
+        assert not first["deduplicated"] and second["deduplicated"]
+        assert [entry["path"] for entry in service.list_files(user_id=2)] == [second["path"]]
+        # The configured algorithm is kept apart from the SHA-256 storage hash
+        listed = service.list_files(user_id=1)[0]
+        assert listed["hash"] == hashlib.sha256(data).hexdigest()
+        assert listed["fingerprint"] == hashlib.md5(data).hexdigest()
+        assert listed["fingerprint_algorithm"] == "md5"
+
+        stats = service.get_storage_stats()
+        assert stats["total_files"] == 3 and stats["categories"]["documents"]["file_count"] == 3
+        assert stats["deduplication"]["saved_bytes"] == len(data)
+
+        # Drift: a file removed behind the catalogue's back and one copied in by hand
+        (Path(directory) / first["path"]).unlink()
+        (Path(directory) / "images" / "manual.png").write_bytes(b"png")
+        assert service.reconcile_catalog() == {"added": 1, "removed": 1, "rehashed": 0, "total": 3}
+        assert service.catalog.get(first["path"]) is None
+        assert service.catalog.get("images/manual.png")["category"] == "images"
+
+        # An existing catalogue is kept as is when the service starts again
+        assert len(LocalFileService(directory).list_files()) == 3
+
+    with tempfile.TemporaryDirectory() as directory:
+        # A catalogue from before the fingerprint columns, hashed with the old configurable algorithm
+        legacy = Path(directory) / "documents" / "legacy.txt"
+        legacy.parent.mkdir(parents=True)
+        legacy.write_bytes(b"old")
+        conn = sqlite3.connect(str(Path(directory) / "catalog.db"))
+        conn.execute('''CREATE TABLE files (path TEXT PRIMARY KEY, name TEXT, owner_id INTEGER,
+                        size INTEGER NOT NULL, mime_type TEXT, hash TEXT, category TEXT NOT NULL,
+                        created_at TIMESTAMP NOT NULL)''')
+        conn.execute("INSERT INTO files VALUES ('documents/legacy.txt', 'legacy.txt', 1, 3, NULL, ?, 'documents', '2024-01-01')",
+                     (hashlib.md5(b"old").hexdigest(),))
+        conn.commit()
+        conn.close()
+
+        service = LocalFileService(directory)
+        assert service.reconcile_catalog()["rehashed"] == 1
+        record = service.catalog.get("documents/legacy.txt")
+        assert record["hash"] == hashlib.sha256(b"old").hexdigest() and record["owner_id"] == 1
+        assert record["fingerprint"] == hashlib.md5(b"old").hexdigest()
+    print("✅ File catalogue working")
+    return True
+
+def test_file_dedupe_delete():
+    """Test identical uploads share one stored object, removed with the last file that references it"""
+    import io
+    import tempfile
+    from unittest import mock
+    from fastapi import UploadFile
+    from file_service import LocalFileService
+
+    data = b"worksheet " * 500
+    for hard_links in (True, False):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch("file_service.os.link", side_effect=os.link if hard_links else OSError("no links")):
+            service = LocalFileService(directory)
+            uploads = [service.upload_file(UploadFile(io.BytesIO(data), filename=f"sheet{i}.txt"), user_id=i)
+                       for i in range(3)]
+            object_path = service._object_path(uploads[0]["hash"])
+            savings = service.get_storage_stats()["deduplication"]
+            if not hard_links:
+                # Without hard links each upload is its one stored copy, and no savings are claimed
+                assert not service.object_store_enabled and not object_path.exists()
+                assert not any(upload["deduplicated"] for upload in uploads)
+                assert savings["saved_bytes"] == 0 and savings["unique_files"] == 3
+                assert service.delete_file(uploads[0]["path"])
+                assert (service.base_upload_dir / uploads[1]["path"]).read_bytes() == data
+                continue
+            assert [upload["deduplicated"] for upload in uploads] == [False, True, True]
+            assert object_path.read_bytes() == data
+            assert savings["saved_bytes"] == 2 * len(data) and savings["unique_files"] == 1
+
+            assert service.delete_file(uploads[0]["path"]) and service.delete_file(uploads[1]["path"])
+            assert object_path.exists(), "one file still references the object"
+            assert (service.base_upload_dir / uploads[2]["path"]).read_bytes() == data
+            assert service.delete_file(uploads[2]["path"])
+            assert not object_path.exists(), "object left behind"
+            assert not service.delete_file(uploads[2]["path"])
+    print("✅ File deduplication and deletion working")
+    return True
+
+def test_thumbnails():
+    """Test thumbnail jobs are dropped once finished and variants go with the image's last upload"""
+    import io
+    import time
+    import tempfile
+    from pathlib import Path
+    from types import SimpleNamespace
+    from unittest import mock
+    from PIL import Image
+    from fastapi import FastAPI, UploadFile
+    from fastapi.testclient import TestClient
+    from database import get_db
+    from file_service import LocalFileService
+    from thumbnail_service import ThumbnailService
+    from routes import files
+    from routes.auth import get_current_user
+
+    def wait_for_jobs(thumbnails):
+        deadline = time.monotonic() + 5
+        while thumbnails._jobs and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not thumbnails._jobs
+
+    image = io.BytesIO()
+    Image.new("RGB", (640, 480), "teal").save(image, format="PNG")
+
+    app = FastAPI()
+    app.include_router(files.router, prefix="/files")
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=1, role="admin")
+    app.dependency_overrides[get_db] = lambda: None
+
+    with tempfile.TemporaryDirectory() as directory:
+        service = LocalFileService(directory)
+        thumbnails = ThumbnailService(Path(directory), workers=1)
+        with mock.patch.object(files, "file_service", service), \
+                mock.patch.object(files, "thumbnail_service", thumbnails):
+            uploads = [service.upload_file(UploadFile(io.BytesIO(image.getvalue()), filename=name), user_id=1)
+                       for name in ("chart.png", "chart-copy.png")]
+            file_hash = uploads[0]["hash"]
+            thumbnails.schedule(uploads[0]["path"], file_hash).result()
+            wait_for_jobs(thumbnails)
+            assert thumbnails.status(file_hash)["status"] == "ready"
+
+            broken = Path(directory) / "images" / "broken.png"
+            broken.write_bytes(b"not an image")
+            thumbnails.schedule("images/broken.png", "broken").exception()
+            wait_for_jobs(thumbnails)
+            assert thumbnails.status("broken")["status"] == "failed"
+
+            client = TestClient(app)
+            variant = Path(directory) / thumbnails.variant_paths(file_hash)["small"]["webp"]
+            assert client.delete(f"/files/delete/{uploads[0]['path']}").status_code == 200
+            assert variant.exists(), "the other upload of the image still uses its thumbnails"
+            assert client.delete(f"/files/delete/{uploads[1]['path']}").status_code == 200
+            assert not variant.exists() and thumbnails.status(file_hash)["status"] == "missing"
+            assert client.delete("/files/delete/temp/../catalog.db").status_code == 404
+    print("✅ Thumbnail jobs and cleanup working")
+    return True
+
+def test_concurrent_extraction():
+    """Test uploaded files are extracted in parallel, never more at once than the extraction pool allows"""
+    import io
+    import time
+    import tempfile
+    import threading
+    from unittest import mock
+    from concurrent.futures import ThreadPoolExecutor
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from database import get_db
+    from file_service import LocalFileService
+    from routes import content_extraction
+
+    lock = threading.Lock()
+    running = [0]
+    most_running = [0]
+
+    def slow_plain_text(file_path, filename):
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        with open(file_path, encoding="utf-8") as text_file:
+            return text_file.read(), "text"
+
+    app = FastAPI()
+    app.include_router(content_extraction.router)
+    app.dependency_overrides[get_db] = lambda: None
+    uploads = [("files", (f"notes{i}.txt", io.BytesIO(f"Notes for week {i}".encode()), "text/plain"))
+               for i in range(6)]
+
+    with tempfile.TemporaryDirectory() as directory, ThreadPoolExecutor(max_workers=2) as pool, \
+            mock.patch.object(content_extraction, "file_service", LocalFileService(directory)), \
+            mock.patch.object(content_extraction, "_extraction_executor", pool), \
+            mock.patch.object(content_extraction, "extract_from_plain_text", slow_plain_text), \
+            mock.patch.dict(content_extraction._extraction_cache, clear=True):
+        response = TestClient(app).post("/extract-content", files=uploads, data={"source_type": "pdf"})
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["file_count"] == 6 and most_running[0] == 2
+    # Results keep upload order however the extractions finish
+    assert [info["filename"] for info in body["metadata"]["files_processed"]] == [f"notes{i}.txt" for i in range(6)]
+    print("✅ Concurrent extraction working")
+    return True
+
+def _write_pdf(path, page_texts):
+    """A PDF with one page per entry; empty strings give pages with no text layer"""
+    import fitz
+    with fitz.open() as pdf:
+        for text in page_texts:
+            page = pdf.new_page()
+            if text:
+                page.insert_text((72, 72), text)
+        pdf.save(path)
+
+def test_pdf_ocr_routing():
+    """Test PDFs without a text layer go to OCR, keeping PyPDF2's text when OCR is unavailable"""
+    import tempfile
+    from unittest import mock
+    from routes import content_extraction
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_pdf = os.path.join(directory, "text.pdf")
+        scanned_pdf = os.path.join(directory, "scanned.pdf")
+        _write_pdf(text_pdf, ["Photosynthesis converts light energy into chemical energy."])
+        _write_pdf(scanned_pdf, ["Fig. 1", "", ""])
+
+        with mock.patch.object(content_extraction.ocr_service, "ocr_pdf",
+                               return_value=("Scanned lesson text", {"ocr_pages": 2})) as ocr_pdf:
+            assert content_extraction.extract_from_pdf(text_pdf, "text.pdf")[1] == "pypdf2"
+            assert not ocr_pdf.called
+            assert content_extraction.extract_from_pdf(scanned_pdf, "scanned.pdf") == (
+                "Scanned lesson text", "pymupdf_tesseract_ocr", {"ocr_pages": 2})
+
+        for failure in (ImportError("no pytesseract"), RuntimeError("tesseract crashed")):
+            with mock.patch.object(content_extraction.ocr_service, "ocr_pdf", side_effect=failure):
+                text, method = content_extraction.extract_from_pdf(scanned_pdf, "scanned.pdf")
+                assert method == "pypdf2" and "Fig. 1" in text
+    print("✅ PDF OCR routing working")
+    return True
+
+def test_ocr_batching_and_cache():
+    """Test scanned pages go to the pool a bounded batch at a time and repeat pages come from the cache"""
+    import time
+    import tempfile
+    from unittest import mock
+    from concurrent.futures import ThreadPoolExecutor
+    from services import ocr_service as ocr_module
+
+    class TrackingExecutor(ThreadPoolExecutor):
+        def __init__(self):
+            super().__init__(max_workers=1)
+            self.futures, self.most_outstanding = [], 0
+
+        def submit(self, fn, *args):
+            outstanding = sum(not future.done() for future in self.futures)
+            self.most_outstanding = max(self.most_outstanding, outstanding)
+            future = super().submit(fn, *args)
+            self.futures.append(future)
+            return future
+
+    def fake_ocr(image_bytes):
+        time.sleep(0.01)
+        return f"ocr {len(image_bytes)}"
+
+    service = ocr_module.OCRService(workers=1, dpi=50)
+    executor = TrackingExecutor()
+    with tempfile.TemporaryDirectory() as directory, executor, \
+            mock.patch.object(ocr_module, "_ocr_page_image", side_effect=fake_ocr) as ocr_page, \
+            mock.patch.object(service, "_get_executor", return_value=executor):
+        pdf_path = os.path.join(directory, "scanned.pdf")
+        _write_pdf(pdf_path, [f"p{number}" * number for number in range(1, 9)])
+
+        text, stats = service.ocr_pdf(pdf_path)
+        assert ocr_page.call_count == 8 and stats["ocr_pages"] == 8 and stats["cache_hits"] == 0
+        assert stats["total_pages"] == 8 and text.count("ocr ") == 8
+        # One worker: never more than its two batches waiting, instead of every page of the document
+        assert executor.most_outstanding <= 2, executor.most_outstanding
+
+        again, stats = service.ocr_pdf(pdf_path)
+        assert again == text and stats["cache_hits"] == 8 and ocr_page.call_count == 8
+        assert service.get_stats()["cache_hits"] == 8
+    print("✅ OCR batching and page cache working")
+    return True
+
 if __name__ == "__main__":
     print("🧪 Testing Python FastAPI Backend Migration")
     print("=" * 50)
@@ -63,6 +1102,33 @@ if __name__ == "__main__":
     tests = [
         ("Import Test", test_imports),
         ("AI Service Test", test_ai_service),
+        ("Upload Streaming Test", test_upload_streaming_size_cap),
+        ("Search Index Test", test_search_index),
+        ("Prompt Budget Test", test_prompt_budget),
+        ("Circuit Breaker Test", test_circuit_breaker),
+        ("JSON Output Test", test_json_output),
+        ("Generation Profiles Test", test_generation_profiles),
+        ("Ollama Keep-Alive Test", test_ollama_keep_alive),
+        ("Retrieval Chunks Test", test_retrieval_chunks),
+        ("Review Prompt Prefix Test", test_review_prompt_prefix),
+        ("Lesson Triage Test", test_lesson_triage),
+        ("Material Summaries Test", test_material_summaries),
+        ("British Spelling Test", test_british_spelling),
+        ("QAQF Scoring Test", test_qaqf_scoring),
+        ("Near-Duplicate Test", test_near_duplicates),
+        ("Rate Limiter Test", test_rate_limiter),
+        ("User Cache Test", test_user_cache),
+        ("Password Hashing Test", test_password_hashing),
+        ("Signed Token Test", test_signed_tokens),
+        ("Registration Role Test", test_registration_role),
+        ("Assessment Material Ids Test", test_assessment_material_ids),
+        ("File Download Test", test_file_download),
+        ("File Catalogue Test", test_file_catalog),
+        ("File Dedupe Delete Test", test_file_dedupe_delete),
+        ("Thumbnails Test", test_thumbnails),
+        ("Concurrent Extraction Test", test_concurrent_extraction),
+        ("PDF OCR Routing Test", test_pdf_ocr_routing),
+        ("OCR Batching Test", test_ocr_batching_and_cache),
     ]
     
     passed = 0
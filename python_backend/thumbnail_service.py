@@ -0,0 +1,144 @@
+"""
+Background thumbnail generation for uploaded images
+Worker pool producing JPEG and WebP size variants, keyed by content hash
+"""
+
+import os
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict, Any
+
+from file_service import file_service
+
+logger = logging.getLogger(__name__)
+
+# Largest first: each variant is resized from the previous one, not the original
+THUMBNAIL_SIZES = {
+    "large": (480, 480),
+    "medium": (200, 200),
+    "small": (64, 64)
+}
+THUMBNAIL_FORMATS = {
+    "jpeg": ("JPEG", ".jpg", {"quality": 85, "optimize": True}),
+    "webp": ("WEBP", ".webp", {"quality": 80, "method": 4})
+}
+# Recent failures kept so status() can report them; older ones read as "missing"
+FAILED_JOBS_KEPT = 1024
+
+
+class ThumbnailService:
+    def __init__(self, base_upload_dir: Path, workers: Optional[int] = None):
+        self.base_upload_dir = Path(base_upload_dir)
+        self.thumb_dir = self.base_upload_dir / "thumbnails"
+        self.thumb_dir.mkdir(parents=True, exist_ok=True)
+        # Pillow releases the GIL while resizing and encoding, so threads run in parallel
+        self.workers = workers or int(os.getenv("THUMBNAIL_WORKERS", 2))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnails")
+        # Only unfinished jobs: each removes itself when done, recording a failure in _failed
+        self._jobs: Dict[str, Future] = {}
+        self._failed: "OrderedDict[str, str]" = OrderedDict()
+        # Re-entrant: a job that is already done runs its callback inside schedule()
+        self._lock = threading.RLock()
+
+    def variant_paths(self, file_hash: str) -> Dict[str, Dict[str, str]]:
+        """Relative paths of every variant; deterministic so clients can predict URLs"""
+        return {
+            size_name: {
+                format_name: f"thumbnails/{file_hash}_{size_name}{extension}"
+                for format_name, (_, extension, _) in THUMBNAIL_FORMATS.items()
+            }
+            for size_name in THUMBNAIL_SIZES
+        }
+
+    def schedule(self, image_path: str, file_hash: str) -> Future:
+        """Queue thumbnail generation; identical images are only processed once"""
+        with self._lock:
+            job = self._jobs.get(file_hash)
+            if job is not None and not job.done():
+                return job
+            # _generate returns straight away if the variants already exist
+            job = self._executor.submit(self._generate, self.base_upload_dir / image_path, file_hash)
+            self._jobs[file_hash] = job
+            self._failed.pop(file_hash, None)
+            job.add_done_callback(lambda done: self._finished(file_hash, done))
+            return job
+
+    def _finished(self, file_hash: str, job: Future):
+        with self._lock:
+            if self._jobs.get(file_hash) is job:
+                del self._jobs[file_hash]
+            if job.exception() is not None:
+                self._failed[file_hash] = str(job.exception())
+                while len(self._failed) > FAILED_JOBS_KEPT:
+                    self._failed.popitem(last=False)
+
+    def status(self, file_hash: str) -> Dict[str, Any]:
+        """Report generation state and the URLs of finished variants"""
+        with self._lock:
+            pending = file_hash in self._jobs
+            failed = file_hash in self._failed
+
+        if self._all_variants_exist(file_hash):
+            state = "ready"
+        elif pending:
+            state = "pending"
+        elif failed:
+            state = "failed"
+        else:
+            state = "missing"
+
+        thumbnails = {}
+        if state == "ready":
+            for size_name, formats in self.variant_paths(file_hash).items():
+                thumbnails[size_name] = {
+                    format_name: file_service.get_file_url(path)
+                    for format_name, path in formats.items()
+                }
+        return {"status": state, "thumbnails": thumbnails}
+
+    def remove(self, file_hash: str):
+        """Delete every variant of an image, once no stored file has its hash any more"""
+        with self._lock:
+            self._failed.pop(file_hash, None)
+        for formats in self.variant_paths(file_hash).values():
+            for path in formats.values():
+                (self.base_upload_dir / path).unlink(missing_ok=True)
+
+    def _all_variants_exist(self, file_hash: str) -> bool:
+        return all(
+            (self.base_upload_dir / path).exists()
+            for formats in self.variant_paths(file_hash).values()
+            for path in formats.values()
+        )
+
+    def _generate(self, full_path: Path, file_hash: str):
+        """Render every size/format variant (runs in the worker pool)"""
+        if self._all_variants_exist(file_hash):
+            return
+
+        from PIL import Image
+
+        paths = self.variant_paths(file_hash)
+        try:
+            with Image.open(full_path) as img:
+                largest = max(THUMBNAIL_SIZES.values())
+                # JPEG can decode straight at a reduced scale, which is much cheaper
+                img.draft("RGB", largest)
+                current = img.convert("RGB")
+
+            for size_name, size in THUMBNAIL_SIZES.items():
+                current.thumbnail(size, Image.Resampling.LANCZOS)
+                for format_name, (pil_format, _, options) in THUMBNAIL_FORMATS.items():
+                    target = self.base_upload_dir / paths[size_name][format_name]
+                    temp_target = target.with_name(target.name + ".part")
+                    current.save(temp_target, format=pil_format, **options)
+                    os.replace(temp_target, target)
+        except Exception:
+            logger.exception(f"Thumbnail generation failed for {full_path}")
+            raise
+
+# Global service instance
+thumbnail_service = ThumbnailService(file_service.base_upload_dir)